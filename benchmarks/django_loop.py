@@ -0,0 +1,127 @@
+"""Simulated Django request loop against an in-memory SQLite database.
+
+Requests go through Django's test client with
+``RequestProfilingMiddleware`` installed, in the configurations a
+deployment would use.
+"""
+
+import tempfile
+
+import django
+from django.conf import settings
+
+settings.configure(
+    DEBUG=True,
+    SECRET_KEY="benchmarks",
+    ALLOWED_HOSTS=["testserver"],
+    ROOT_URLCONF=__name__,
+    INSTALLED_APPS=[],
+    DATABASES={
+        "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}
+    },
+    MIDDLEWARE=[
+        "pyprofile.contrib.django.middleware.RequestProfilingMiddleware"
+    ],
+    PROFILING=False,
+)
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.http import JsonResponse  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.urls import path  # noqa: E402
+from pyprofile.contrib.django.sql_profiler import (  # noqa: E402
+    Profiler as SqlProfiler,
+)
+
+__all__ = [
+    "run",
+]
+
+ROWS = 100
+
+
+def orders(request):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, total FROM orders WHERE total > %s", [10])
+        rows = cursor.fetchall()
+    return JsonResponse({"orders": [{"id": i, "total": t} for i, t in rows]})
+
+
+def orders_sql_profiled(request):
+    with SqlProfiler("orders", profile_sql=True):
+        return orders(request)
+
+
+urlpatterns = [
+    path("orders/", orders),
+    path("orders/sql/", orders_sql_profiled),
+]
+
+
+def setup_database():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS orders (id integer, total integer)"
+        )
+        cursor.execute("DELETE FROM orders")
+        cursor.executemany(
+            "INSERT INTO orders VALUES (%s, %s)",
+            [(i, i % 50) for i in range(ROWS)],
+        )
+
+
+def run(compare, scale: float = 1.0) -> list:
+    """Run the request loop in each middleware configuration.
+
+    :param compare: ``benchmarks.run.compare``
+    :param scale: multiplier of the iteration counts
+    :type scale: float
+    """
+    setup_database()
+    number = max(int(200 * scale), 1)
+
+    with override_settings(MIDDLEWARE=[]):
+        # the handler loads the middleware on the first request, the
+        # baseline client goes without it whatever the settings
+        baseline_client = Client()
+        baseline_client.get("/orders/")
+
+    def baseline():
+        _get(baseline_client, "/orders/")
+
+    def scenario(name, url, **overrides):
+        # settings are overridden once, outside of the timed loops
+        with override_settings(**overrides):
+            client = Client()
+            client.get(url)
+            return compare(name, baseline, lambda: _get(client, url), number)
+
+    results = [
+        scenario("django.request.timed", "/orders/", PROFILING=True),
+        scenario(
+            "django.request.profiled",
+            "/orders/",
+            PROFILING=True,
+            PROFILING_SAMPLE_RATE=1,
+        ),
+        scenario("django.request.sql_profiler", "/orders/sql/"),
+    ]
+    with tempfile.TemporaryDirectory() as dump_dir:
+        results.append(
+            scenario(
+                "django.request.published",
+                "/orders/",
+                PROFILING=True,
+                PROFILING_SAMPLE_RATE=1,
+                PROFILER_DUMP=dump_dir,
+                PROFILER_WRITE_DOT=False,
+                PROFILER_WRITE_PNG=False,
+            )
+        )
+    return results
+
+
+def _get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, response.status_code
@@ -0,0 +1,136 @@
+"""Micro-benchmarks of the ``profile`` decorator and ``Profiler``.
+"""
+
+import tempfile
+
+from pyprofile import Profiler, profile
+from pyprofile.publishers import publish_stats
+
+__all__ = [
+    "run",
+]
+
+
+def noop():
+    pass
+
+
+def recurse(depth):
+    if depth:
+        return recurse(depth - 1)
+    return depth
+
+
+def make_functions(count: int) -> list:
+    """``count`` distinct functions, one code object and stats row each.
+    """
+    namespace = {}
+    for i in range(count):
+        exec("def f%d(x):\n    return x + %d\n" % (i, i), namespace)
+    return [namespace["f%d" % i] for i in range(count)]
+
+
+def call_all(functions):
+    for func in functions:
+        func(1)
+
+
+def run(compare, engine: str, scale: float = 1.0) -> list:
+    """Run every micro-benchmark for ``engine``.
+
+    :param compare: ``benchmarks.run.compare``
+    :param scale: multiplier of the iteration counts
+    :type scale: float
+    """
+
+    def times(number):
+        return max(int(number * scale), 1)
+
+    prefix = "micro.%s." % engine
+    results = []
+
+    wrapped = profile(noop, engine=engine)
+    results.append(
+        compare(prefix + "decorator_noop", noop, wrapped, times(2000))
+    )
+
+    budgeted = profile(noop, engine=engine, overhead_budget=0.02)
+    results.append(
+        compare(prefix + "decorator_budget_noop", noop, budgeted, times(2000))
+    )
+
+    for depth in (100, 500):
+
+        def profiled(depth=depth):
+            with Profiler("recurse", engine=engine):
+                recurse(depth)
+
+        results.append(
+            compare(
+                prefix + "recursion_%d" % depth,
+                lambda depth=depth: recurse(depth),
+                profiled,
+                times(200),
+            )
+        )
+
+    functions = make_functions(1000)
+
+    def many_profiled():
+        with Profiler("many", engine=engine):
+            call_all(functions)
+
+    results.append(
+        compare(
+            prefix + "many_small_functions_1000",
+            lambda: call_all(functions),
+            many_profiled,
+            times(100),
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as dump_dir:
+        for count in (10, 100, 1000, 10000):
+            functions = make_functions(count)
+            results.extend(
+                _stop_and_publish(
+                    compare, prefix, engine, functions, dump_dir, times(20)
+                )
+            )
+    return results
+
+
+def _stop_and_publish(compare, prefix, engine, functions, dump_dir, number):
+    count = len(functions)
+
+    def stop():
+        prof = Profiler("stop", engine=engine).start()
+        call_all(functions)
+        return prof.stop()
+
+    def run_only():
+        prof = Profiler("stop", engine=engine).start()
+        call_all(functions)
+        prof._halt()
+
+    stop_result = compare(
+        prefix + "stop_%d_functions" % count, run_only, stop, number
+    )
+
+    stats = stop()
+    prof = Profiler(
+        "publish",
+        dump_dir=dump_dir,
+        save_stats=True,
+        write_dot=False,
+        write_png=False,
+        write_binary=True,
+    )
+    artifacts = prof.artifacts()
+    publish_result = compare(
+        prefix + "publish_%d_functions" % count,
+        None,
+        lambda: publish_stats(stats, artifacts),
+        number,
+    )
+    return [stop_result, publish_result]
@@ -0,0 +1,135 @@
+"""Benchmarks measuring pyprofile's own overhead.
+
+Each benchmark times a workload without and with profiling and reports
+per call timings in microseconds, so overhead changes can be tracked
+between releases::
+
+    PYTHONPATH=src python benchmarks/run.py -o bench.json
+    PYTHONPATH=src python benchmarks/run.py --quick --only micro
+
+The Django benchmarks are skipped when Django is not installed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+import micro
+
+__all__ = [
+    "measure",
+    "compare",
+]
+
+
+def measure(func, number: int, repeat: int = 5) -> dict:
+    """Time ``func()`` and return per call microseconds.
+
+    The minimum over ``repeat`` runs is the least noisy estimate, the
+    median shows the spread.
+    """
+    func()  # warm up caches and lazy imports
+    runs = [
+        seconds / number * 1e6
+        for seconds in timeit.repeat(func, number=number, repeat=repeat)
+    ]
+    return {
+        "min_us": min(runs),
+        "median_us": statistics.median(runs),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def compare(
+    name: str, baseline, profiled, number: int, repeat: int = 5
+) -> dict:
+    """Measure ``profiled`` against ``baseline`` of the same workload.
+    """
+    result = {"name": name}
+    if baseline is not None:
+        result["baseline"] = measure(baseline, number, repeat)
+    result["profiled"] = measure(profiled, number, repeat)
+    if baseline is not None:
+        result["overhead_us"] = (
+            result["profiled"]["min_us"] - result["baseline"]["min_us"]
+        )
+        result["ratio"] = (
+            result["profiled"]["min_us"] / result["baseline"]["min_us"]
+            if result["baseline"]["min_us"]
+            else None
+        )
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "-o", "--output", default="bench.json", help="JSON results file"
+    )
+    parser.add_argument(
+        "--only",
+        choices=("micro", "django"),
+        action="append",
+        help="run only these suites",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer iterations, for CI"
+    )
+    parser.add_argument(
+        "--engine",
+        action="append",
+        help="profiling engines to benchmark, default cprofile",
+    )
+    args = parser.parse_args(argv)
+    suites = args.only or ["micro", "django"]
+    scale = 0.1 if args.quick else 1.0
+    engines = args.engine or ["cprofile"]
+
+    results = []
+    if "micro" in suites:
+        for engine in engines:
+            results.extend(micro.run(compare, engine, scale))
+    if "django" in suites:
+        try:
+            import django_loop
+        except ImportError as e:
+            print("skipping django benchmarks: %s" % e, file=sys.stderr)
+        else:
+            results.extend(django_loop.run(compare, scale))
+
+    for result in results:
+        print(
+            "%-48s %12.2f us%s"
+            % (
+                result["name"],
+                result["profiled"]["min_us"],
+                " (%+.2f us, x%.2f)"
+                % (result["overhead_us"], result["ratio"] or 0)
+                if "overhead_us" in result
+                else "",
+            )
+        )
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,33 @@
-from .profiler import Profiler, profile
+"""Python profiling and visualizing package.
+
+Attributes are imported on first access, so ``import pyprofile`` and
+decorating functions stay cheap until profiling actually runs.
+"""
+
+import importlib
 
 __all__ = [
     "profile",
     "Profiler",
 ]
+
+_LAZY_ATTRIBUTES = {
+    "profile": ".profiler",
+    "Profiler": ".profiler",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name)
+        )
+    value = getattr(
+        importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name
+    )
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
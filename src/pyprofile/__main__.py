@@ -0,0 +1,9 @@
+"""``python -m pyprofile``, see ``pyprofile.runner``.
+"""
+
+import sys
+
+from .runner import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""In-memory aggregation of repeated profiles.
+
+Profiling a function that runs thousands of times a minute produces one
+dump per call. An ``Aggregator`` instead merges each call's stats into a
+per-name accumulator and publishes one rolled-up dump per window.
+
+The memory and garbage collector results of the calls, with
+``memory=True`` or ``gc=True``, are rolled up too: allocation sites and
+collection counters are summed, peaks and pauses keep their maximum.
+"""
+
+import atexit
+import os
+import threading
+import time
+
+from .gcstats import GCStats
+from .memory import MemoryStats
+from .publishers import publish_stats
+from .stats import StructuredStats, merge_stats_dicts
+
+__all__ = [
+    "Aggregator",
+]
+
+
+class _Window(object):
+    def __init__(self, publisher, artifacts):
+        self.started_at = time.time()
+        self.publisher = publisher
+        self.artifacts = artifacts
+        self.profiles = 0
+        self.stats = {}
+        self.memory = None
+        self.memory_top = 0
+        self.gc = None
+        self.timer = None
+
+
+class Aggregator(object):
+    """Merges the stats of profiles sharing a name.
+
+    A window is published when it merged ``flush_every`` profiles, when
+    it is older than ``flush_interval`` seconds, or when it tracks more
+    than ``max_functions`` functions, which bounds its memory. A timer
+    publishes windows reaching ``flush_interval`` without a new profile,
+    so processes gone quiet still report; pending windows are published
+    at process exit.
+
+    :param flush_every: profiles merged per window
+    :type flush_every: int
+    :param flush_interval: maximum age of a window in seconds, unbounded
+        when ``None``
+    :type flush_interval: float
+    :param max_functions: maximum number of distinct functions per window
+    :type max_functions: int
+    """
+
+    def __init__(
+        self,
+        flush_every: int = 1000,
+        flush_interval: float = 60.0,
+        max_functions: int = 50000,
+    ):
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_functions = max_functions
+        self._windows = {}
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def add(self, profiler, stats: dict):
+        """Merge the filtered pstats dict of a stopped ``profiler``, and
+        its memory and gc results.
+        """
+        name = profiler.label
+        with self._lock:
+            window = self._windows.get(name)
+            if window is None:
+                window = self._windows[name] = _Window(
+                    profiler.publisher,
+                    profiler.artifacts(
+                        "stats_%s_%d" % (name, int(time.time()))
+                    ),
+                )
+                if self.flush_interval is not None:
+                    window.timer = threading.Timer(
+                        self.flush_interval, self._expire, (name, window)
+                    )
+                    window.timer.daemon = True
+                    window.timer.start()
+            merge_stats_dicts(window.stats, stats)
+            if profiler.memory_profiler is not None:
+                window.memory_top = profiler.memory_profiler.top
+                window.memory = _merge_memory(
+                    window.memory, profiler.memory_profiler.stats
+                )
+            if profiler.gc_monitor is not None:
+                window.gc = _merge_gc(
+                    window.gc,
+                    profiler.gc_monitor.stats,
+                    profiler.gc_monitor.max_collections,
+                )
+            window.profiles += 1
+            if not (
+                window.profiles >= self.flush_every
+                or len(window.stats) > self.max_functions
+                or (
+                    self.flush_interval is not None
+                    and time.time() - window.started_at >= self.flush_interval
+                )
+            ):
+                return
+            del self._windows[name]
+        self._publish(name, window)
+
+    def flush(self, name: str = None):
+        """Publish the pending window of ``name``, or all of them.
+        """
+        with self._lock:
+            if name is None:
+                windows = list(self._windows.items())
+                self._windows.clear()
+            elif name in self._windows:
+                windows = [(name, self._windows.pop(name))]
+            else:
+                windows = []
+        for name, window in windows:
+            self._publish(name, window)
+
+    def _expire(self, name, window):
+        with self._lock:
+            if self._windows.get(name) is not window:
+                # published meanwhile
+                return
+            del self._windows[name]
+        self._publish(name, window)
+
+    def _publish(self, name, window):
+        if window.timer is not None:
+            window.timer.cancel()
+        if not window.artifacts:
+            return
+        stats = StructuredStats.from_stats_dict(
+            window.stats,
+            meta={
+                "name": name,
+                "label": name,
+                "timestamp": window.started_at,
+                "pid": os.getpid(),
+                "profiles": window.profiles,
+                "window_start": window.started_at,
+                "window_end": time.time(),
+            },
+        )
+        if window.memory is not None:
+            window.memory.rows.sort(key=lambda row: row[0], reverse=True)
+            del window.memory.rows[window.memory_top :]
+            stats.memory = window.memory
+            stats.meta["memory"] = stats.memory.summary()
+        if window.gc is not None:
+            stats.gc = window.gc
+            stats.meta["gc"] = stats.gc.summary()
+        window.publisher.submit(publish_stats, stats, window.artifacts)
+
+
+def _merge_memory(total, memory):
+    # sums the growth of allocation sites, sizes and counts are the
+    # latest ones
+    if total is None:
+        return MemoryStats(
+            list(memory.rows),
+            memory.start,
+            memory.end,
+            memory.peak,
+            memory.frames,
+        )
+    rows = {row[4:]: row for row in total.rows}
+    for row in memory.rows:
+        previous = rows.get(row[4:])
+        if previous is not None:
+            row = (previous[0] + row[0], previous[1] + row[1]) + row[2:]
+        rows[row[4:]] = row
+    total.rows = list(rows.values())
+    total.end = memory.end
+    total.peak = max(total.peak, memory.peak)
+    total.frames = memory.frames
+    return total
+
+
+def _merge_gc(total, gc, max_collections):
+    if total is None:
+        return GCStats(
+            gc.collections[:max_collections],
+            gc.count,
+            gc.pause,
+            gc.max_pause,
+            [dict(generation) for generation in gc.generations],
+        )
+    total.collections.extend(
+        gc.collections[: max_collections - len(total.collections)]
+    )
+    total.count += gc.count
+    total.pause += gc.pause
+    total.max_pause = max(total.max_pause, gc.max_pause)
+    for generation, delta in zip(total.generations, gc.generations):
+        for key, value in delta.items():
+            generation[key] += value
+    return total
@@ -0,0 +1,136 @@
+"""Keeping the cost of a profiled function within a budget.
+
+An ``OverheadBudget`` decides which calls of a decorated function are
+profiled. It times every call, profiled or not, and keeps decayed means
+of both durations: their difference is what profiling one call costs,
+setup, instrumentation and publishing included. The fraction of
+profiled calls is then set so that this cost stays around ``budget``
+of the function's unprofiled wall time, and follows the function as it
+gets faster or slower.
+
+Calls are picked by accumulating the rate rather than at random, so a
+rate of 0.25 profiles exactly every fourth call. The first profiled
+call of a process pays for importing the profiling modules, tens of
+milliseconds, so it is left out of the estimates.
+"""
+
+__all__ = [
+    "OverheadBudget",
+]
+
+
+class OverheadBudget(object):
+    """Adaptive fraction of profiled calls of one function.
+
+    The rate stays within ``min_rate`` and ``max_rate``; below 1, the
+    default maximum keeps some calls unprofiled so the baseline is
+    still measured when profiling is cheap. Counters are updated
+    without a lock, concurrent calls may lose an update, which only
+    makes the estimates slightly staler.
+
+    :param budget: profiling overhead allowed, as a fraction of the
+        function's own wall time
+    :type budget: float
+    :param half_life: calls after which a duration weighs half in the
+        decayed means
+    :type half_life: float
+    :param min_rate: lowest fraction of profiled calls, the overhead may
+        exceed the budget there for very short functions
+    :type min_rate: float
+    :param max_rate: highest fraction of profiled calls
+    :type max_rate: float
+    :param warmup: first profiled calls left out of the estimates
+    :type warmup: int
+
+    :ivar calls: calls seen
+    :ivar profiled: calls profiled
+    :ivar rate: current fraction of profiled calls
+    :ivar baseline: decayed mean duration of an unprofiled call
+    :ivar overhead: decayed mean cost of profiling a call
+    """
+
+    def __init__(
+        self,
+        budget: float = 0.02,
+        half_life: float = 100.0,
+        min_rate: float = 0.0001,
+        max_rate: float = 0.99,
+        warmup: int = 1,
+    ):
+        if budget <= 0:
+            raise ValueError("Overhead budget must be positive: %s" % budget)
+        self.budget = budget
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.warmup = warmup
+        self._alpha = 1.0 - 0.5 ** (1.0 / half_life)
+        self.calls = 0
+        self.profiled = 0
+        # until both kinds of calls were timed, every other one is
+        # profiled, starting with an unprofiled one
+        self.rate = min(max(0.5, min_rate), max_rate)
+        self.baseline = 0.0
+        self.overhead = 0.0
+        self._profiled_time = 0.0
+        self._credit = 0.0
+
+    def sample(self) -> bool:
+        """Whether to profile the next call.
+        """
+        self._credit += self.rate
+        if self._credit < 1.0:
+            return False
+        self._credit -= 1.0
+        return True
+
+    def record(self, seconds: float, profiled: bool):
+        """Account for a call that took ``seconds`` in total, profiling
+        included when ``profiled``.
+        """
+        self.calls += 1
+        if profiled:
+            self.profiled += 1
+            if self.profiled <= self.warmup:
+                return
+            self._profiled_time = self._decay(
+                self._profiled_time, seconds, self.profiled - self.warmup
+            )
+        else:
+            self.baseline = self._decay(
+                self.baseline, seconds, self.calls - self.profiled
+            )
+        if self.profiled > self.warmup and self.calls > self.profiled:
+            self._adjust()
+
+    @property
+    def overhead_ratio(self) -> float:
+        """Estimated profiling cost at the current rate, as a fraction of
+        the function's unprofiled wall time.
+        """
+        if not self.baseline:
+            return 0.0
+        return self.rate * self.overhead / self.baseline
+
+    def counters(self) -> dict:
+        return {
+            "budget": self.budget,
+            "calls": self.calls,
+            "profiled": self.profiled,
+            "rate": self.rate,
+            "baseline": self.baseline,
+            "overhead": self.overhead,
+            "overhead_ratio": self.overhead_ratio,
+        }
+
+    def _decay(self, mean, value, count):
+        # plain mean over the first calls, so the first value does not
+        # linger as a bias
+        return mean + max(self._alpha, 1.0 / count) * (value - mean)
+
+    def _adjust(self):
+        self.overhead = max(self._profiled_time - self.baseline, 0.0)
+        if self.overhead:
+            rate = self.budget * self.baseline / self.overhead
+        else:
+            rate = self.max_rate
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
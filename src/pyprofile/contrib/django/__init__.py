@@ -0,0 +1,39 @@
+"""django integration.
+
+The middleware and the SQL profiler are imported on first access, so
+importing this package does not load django.
+"""
+
+import importlib
+
+__all__ = [
+    "RequestProfilingMiddleware",
+    "SamplingPolicy",
+    "current_profiler",
+    "Profiler",
+    "profile",
+]
+
+_LAZY_ATTRIBUTES = {
+    "RequestProfilingMiddleware": ".middleware",
+    "SamplingPolicy": ".middleware",
+    "current_profiler": ".middleware",
+    "Profiler": ".sql_profiler",
+    "profile": ".sql_profiler",
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name)
+        )
+    value = getattr(
+        importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name
+    )
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,84 @@
+"""Capturing sampled requests as replayable fixtures.
+
+Requests are recorded with their method, path, body and headers, and
+replayed through django's test client, which needs the settings of the
+captured project. Headers whose name looks like a credential, see
+``SENSITIVE``, e.g. cookies, ``Authorization`` or ``X-Api-Key``, are
+left out, and so are the bodies of forms and JSON objects with such a
+field, e.g. login forms. The patterns err on the side of leaving data
+out; anything else captured is written to disk as is.
+"""
+
+import json
+import re
+
+from pyprofile.fixtures import FixtureStore
+
+__all__ = [
+    "REPLAY_TARGET",
+    "capture_request",
+    "replay_request",
+]
+
+REPLAY_TARGET = "pyprofile.contrib.django.capture:replay_request"
+
+SENSITIVE = re.compile(
+    "token|key|auth|secret|passw|cookie|csrf|session", re.IGNORECASE
+)
+
+_client = None
+
+
+def capture_request(
+    store: FixtureStore, request, max_body: int = 65536
+) -> bool:
+    """Record ``request`` into ``store``, unless its body is larger
+    than ``max_body`` bytes.
+    """
+    if int(request.META.get("CONTENT_LENGTH") or 0) > max_body:
+        return False
+    headers = {
+        key: value
+        for key, value in request.META.items()
+        if key.startswith("HTTP_") and not SENSITIVE.search(key)
+    }
+    body = request.body
+    if any(SENSITIVE.search(field) for field in _fields(request)):
+        body = b""
+    return store.record(
+        REPLAY_TARGET,
+        (
+            request.method,
+            request.get_full_path(),
+            body,
+            request.META.get("CONTENT_TYPE", ""),
+            headers,
+        ),
+    )
+
+
+def _fields(request):
+    # names of the form fields, or of the keys of a JSON object
+    content_type = request.META.get("CONTENT_TYPE", "")
+    if content_type.startswith("application/json"):
+        try:
+            value = json.loads(request.body)
+        except ValueError:
+            return ()
+        return value if isinstance(value, dict) else ()
+    if request.method == "POST":
+        return list(request.POST) + list(request.FILES)
+    return ()
+
+
+def replay_request(method, path, body, content_type, headers):
+    """Send a captured request again, returns the response.
+    """
+    global _client
+    if _client is None:
+        from django.test import Client
+
+        _client = Client()
+    return _client.generic(
+        method, path, data=body, content_type=content_type, **headers
+    )
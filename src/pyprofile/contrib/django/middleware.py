@@ -3,12 +3,29 @@
 # Original author: udfalkso, hauser
 # Modified by: Anudeep Samaiya
 
+import contextvars
+import itertools
 import re
+import threading
+import timeit
+from collections import OrderedDict
 
 from django.conf import settings
 from pyprofile import Profiler
+from pyprofile.coroutines import run_stepped
+from pyprofile.publishers import BackgroundPublisher
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:
+    import asyncio
+
+    iscoroutinefunction = asyncio.iscoroutinefunction
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = asyncio.coroutines._is_coroutine
+        return func
 
-words_re = re.compile(r"\s+")
 
 group_prefix_re = [
     re.compile("^.*/django/[^/]+"),
@@ -16,57 +33,305 @@ group_prefix_re = [
     re.compile(".*"),  # catch strange entries
 ]
 
+_current_profiler = contextvars.ContextVar(
+    "pyprofile_request_profiler", default=None
+)
+
+
+def current_profiler():
+    """The ``Profiler`` of the request being handled, if it is profiled.
+    """
+    return _current_profiler.get()
+
+
+class SamplingPolicy(object):
+    """Decides which requests get profiled.
+
+    Every request is timed, which is cheap. A path whose last timed run
+    took longer than ``slow_threshold`` is profiled on its next request.
+    On top of that one request in ``sample_rate`` is profiled, and no
+    more than ``max_per_second`` requests are profiled per second.
+
+    :param sample_rate: profile one request in N, 0 disables it
+    :type sample_rate: int
+    :param slow_threshold: seconds above which a path gets profiled
+    :type slow_threshold: float
+    :param max_per_second: cap on profiled requests per second
+    :type max_per_second: int
+    :param max_paths: number of slow paths remembered
+    :type max_paths: int
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 0,
+        slow_threshold: float = None,
+        max_per_second: int = None,
+        max_paths: int = 1024,
+    ):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_per_second = max_per_second
+        self.max_paths = max_paths
+        self._requests = itertools.count(1)
+        self._slow_paths = OrderedDict()
+        self._lock = threading.Lock()
+        self._second = 0
+        self._profiled_this_second = 0
+
+    def should_profile(self, path: str) -> bool:
+        request_number = next(self._requests)
+        wanted = path in self._slow_paths or (
+            self.sample_rate and request_number % self.sample_rate == 0
+        )
+        return bool(wanted) and self._acquire()
+
+    def record(self, path: str, duration: float, profiled: bool):
+        """Feed back the duration of a handled request.
+        """
+        if self.slow_threshold is None:
+            return
+        with self._lock:
+            if profiled:
+                # time the next run again, profiled durations are inflated
+                self._slow_paths.pop(path, None)
+            elif duration > self.slow_threshold:
+                self._slow_paths[path] = True
+                self._slow_paths.move_to_end(path)
+                while len(self._slow_paths) > self.max_paths:
+                    self._slow_paths.popitem(last=False)
+
+    def _acquire(self):
+        if not self.max_per_second:
+            return True
+        second = int(timeit.default_timer())
+        with self._lock:
+            if second != self._second:
+                self._second = second
+                self._profiled_this_second = 0
+            if self._profiled_this_second >= self.max_per_second:
+                return False
+            self._profiled_this_second += 1
+            return True
+
 
 class RequestProfilingMiddleware(object):
     """
-    Displays cProfile profiling for any view.
-    http://yoursite.com/yourview/?prof
+    Profiles a sample of requests and persists the results to
+    ``PROFILER_DUMP``.
+
+    With ``PROFILING`` enabled, requests are picked by ``SamplingPolicy``
+    configured from ``PROFILING_SAMPLE_RATE``,
+    ``PROFILING_SLOW_THRESHOLD`` and ``PROFILING_MAX_PER_SECOND``.
+    ``PROFILER_ASYNC_PUBLISH`` writes the artifacts from a background
+    thread, off the request path. ``PROFILING_MEMORY`` also reports the
+    allocations of profiled requests, keeping ``PROFILING_MEMORY_FRAMES``
+    frames per allocation, and ``PROFILING_GC`` the garbage collections
+    that paused them. ``PROFILER_INCLUDE`` and ``PROFILER_EXCLUDE``
+    module patterns, e.g. ``["myapp.*"]``, keep framework internals out
+    of the profiles. ``PROFILING_CAPTURE_DIR`` records profiled requests
+    into a ``FixtureStore``, a ``PROFILING_CAPTURE_RATE`` fraction of
+    them, to replay them with ``pyprofile.fixtures.replay``.
+    ``PROFILER_STORE`` writes the profiles to the ``ProfileStore`` of
+    ``PROFILER_DUMP/store`` instead of loose files, keeping at most
+    ``PROFILER_STORE_MAX_BYTES`` bytes of profiles no older than
+    ``PROFILER_STORE_MAX_AGE`` seconds. The durations of profiled
+    requests are counted in the ``pyprofile.histogram`` histogram of
+    their view name.
 
-    Add the "prof" key to query string by appending ?prof (or &prof=)
-    and you'll see the profiling results in your browser.
-    It's set up to only be available in django's debug mode,
-    is available for superuser otherwise,
-    but you really shouldn't add this middleware to any production configuration.
+    In django's debug mode, adding the "prof" key to the query string
+    (?prof or &prof=) also shows the profiling results in your browser,
+    ?prof=dot the Graphviz call graph of the request.
 
-    WARNING: It uses cProfile profiler which is not thread safe.
+    Per request state lives in a context variable, so the middleware can
+    be shared by threads. Under ASGI the middleware runs natively async
+    and only profiles the steps of the request's own task.
     """
 
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.policy = SamplingPolicy(
+            sample_rate=getattr(settings, "PROFILING_SAMPLE_RATE", 0),
+            slow_threshold=getattr(settings, "PROFILING_SLOW_THRESHOLD", None),
+            max_per_second=getattr(settings, "PROFILING_MAX_PER_SECOND", None),
+        )
+        self.publisher = None
+        if getattr(settings, "PROFILER_ASYNC_PUBLISH", False):
+            self.publisher = BackgroundPublisher(overflow="drop")
+        dump_dir = getattr(settings, "PROFILER_DUMP", None)
+        if getattr(settings, "PROFILER_STORE", False) and dump_dir:
+            from pyprofile.store import get_store
+
+            # configures the store the exporter then writes to
+            get_store(
+                "%s/store" % dump_dir,
+                max_bytes=getattr(
+                    settings, "PROFILER_STORE_MAX_BYTES", 1 << 30
+                ),
+                max_age=getattr(
+                    settings, "PROFILER_STORE_MAX_AGE", 7 * 86400.0
+                ),
+            )
+        self.capture = None
+        capture_dir = getattr(settings, "PROFILING_CAPTURE_DIR", None)
+        if capture_dir:
+            from pyprofile.fixtures import FixtureStore
+
+            self.capture = FixtureStore(
+                capture_dir,
+                sample_rate=getattr(settings, "PROFILING_CAPTURE_RATE", 1.0),
+            )
 
     def __call__(self, request):
-        self.query_params = dict(request.GET)
-        self.profiling_enabled = settings.DEBUG and settings.PROFILING
-        path = request.get_full_path()
-        path = path.split("?")[0]
+        if self.is_async:
+            return self.__acall__(request)
+        enabled, show = self.is_enabled(request)
+        path = request.path
 
-        if not (self.profiling_enabled and self.query_params.get("prof")):
-            return self.get_response(request)
+        if not enabled or not (show or self.policy.should_profile(path)):
+            start = timeit.default_timer()
+            response = self.get_response(request)
+            if enabled:
+                self.policy.record(
+                    path, timeit.default_timer() - start, profiled=False
+                )
+            return response
 
-        with Profiler(
+        if self.capture is not None:
+            self.capture_request(request)
+        prof = self.get_profiler(path)
+        token = _current_profiler.set(prof)
+        try:
+            # Profiler.__exit__ would swallow the view's exceptions
+            prof.start()
+            try:
+                response = self.get_response(request)
+                prof.histogram = self.get_route(request)
+            finally:
+                prof.finish()
+        finally:
+            _current_profiler.reset(token)
+        self.policy.record(path, None, profiled=True)
+
+        if show:
+            if request.GET.get("prof") == "dot":
+                self.show_dot(response, prof)
+            else:
+                self.show_stats(response, prof)
+        return response
+
+    async def __acall__(self, request):
+        enabled, show = self.is_enabled(request)
+        path = request.path
+
+        if not enabled or not (show or self.policy.should_profile(path)):
+            start = timeit.default_timer()
+            response = await self.get_response(request)
+            if enabled:
+                self.policy.record(
+                    path, timeit.default_timer() - start, profiled=False
+                )
+            return response
+
+        if self.capture is not None:
+            self.capture_request(request)
+        prof = self.get_profiler(path)
+        token = _current_profiler.set(prof)
+        try:
+            prof.start().pause()
+            try:
+                response = await run_stepped(
+                    self.get_response(request), prof.resume, prof.pause
+                )
+                prof.histogram = self.get_route(request)
+            finally:
+                prof.finish()
+        finally:
+            _current_profiler.reset(token)
+        self.policy.record(path, None, profiled=True)
+
+        if show:
+            if request.GET.get("prof") == "dot":
+                self.show_dot(response, prof)
+            else:
+                self.show_stats(response, prof)
+        return response
+
+    def capture_request(self, request):
+        from pyprofile.contrib.django.capture import capture_request
+
+        capture_request(
+            self.capture,
+            request,
+            max_body=getattr(settings, "PROFILING_CAPTURE_MAX_BODY", 65536),
+        )
+
+    def is_enabled(self, request):
+        """Whether profiling is on, and whether to show the results.
+        """
+        enabled = getattr(settings, "PROFILING", False)
+        return enabled, enabled and settings.DEBUG and "prof" in request.GET
+
+    def get_route(self, request):
+        """Name of the view that handled ``request``, which keys the
+        latency histograms instead of its unbounded path.
+        """
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return "<unresolved>"
+        return match.view_name
+
+    def get_profiler(self, path):
+        return Profiler(
             str(path).replace("/", "_"),
-            dump_dir=settings.PROFILER_DUMP,
-            save_stats=settings.PROFILER_SAVE_STATS,
-            write_csv=settings.PROFILER_WRITE_CSV,
-            write_dot=settings.PROFILER_WRITE_DOT,
-            write_png=settings.PROFILER_WRITE_PNG,
-        ) as self.prof:
-            response = self.get_response(request)
-        stats_str = self.prof.stats_str
+            dump_dir=getattr(settings, "PROFILER_DUMP", None),
+            save_stats=getattr(settings, "PROFILER_SAVE_STATS", True),
+            write_csv=getattr(settings, "PROFILER_WRITE_CSV", True),
+            write_dot=getattr(settings, "PROFILER_WRITE_DOT", True),
+            write_png=getattr(settings, "PROFILER_WRITE_PNG", True),
+            write_flamegraph=getattr(
+                settings,
+                "PROFILER_WRITE_FLAMEGRAPH",
+                getattr(settings, "PROFILER_WRITE_PNG", True),
+            ),
+            engine=getattr(settings, "PROFILER_ENGINE", "cprofile"),
+            include=getattr(settings, "PROFILER_INCLUDE", ()),
+            exclude=getattr(settings, "PROFILER_EXCLUDE", ()),
+            publisher=self.publisher,
+            memory=getattr(settings, "PROFILING_MEMORY", False),
+            memory_frames=getattr(settings, "PROFILING_MEMORY_FRAMES", 1),
+            memory_top=getattr(settings, "PROFILING_MEMORY_TOP", 50),
+            gc=getattr(settings, "PROFILING_GC", False),
+            store=getattr(settings, "PROFILER_STORE", False),
+        )
 
+    def show_dot(self, response, prof):
+        """Replace the response with the request's call graph, rendered
+        in memory.
+        """
+        response.content = prof.dot().encode("utf-8")
+        response["Content-Type"] = "text/vnd.graphviz; charset=utf-8"
+
+    def show_stats(self, response, prof):
+        stats_str = prof.stats_str
         if response and response.content and stats_str:
             response.content = "<pre>" + stats_str + "</pre>"
         response.content = "\n".join(
             response.content.decode().split("\n")[:100]
         )
-        response.content += str.encode(self.summary_for_files(stats_str))
-        return response
-
-    def process_view(self, request, callback, callback_args, callback_kwargs):
-        if self.profiling_enabled and self.query_params.get("prof"):
-            return self.prof.profiler.runcall(
-                callback, request, *callback_args, **callback_kwargs
+        response.content += str.encode(self.summary_for_files(prof.stats))
+        if prof.stats.memory is not None:
+            response.content += str.encode(
+                self.summary_for_memory(prof.stats.memory)
             )
+        if prof.stats.gc is not None:
+            response.content += str.encode(self.summary_for_gc(prof.stats.gc))
 
     def get_group(self, _file):
         for g in group_prefix_re:
@@ -89,29 +354,51 @@ class RequestProfilingMiddleware(object):
 
         return res
 
-    def summary_for_files(self, stats_str):
-        stats_str = stats_str.split("\n")[5:]
+    def summary_for_memory(self, memory):
+        res = (
+            " ---- Memory ----\n\n"
+            "net %+d bytes, peak %d bytes\n\n"
+            "   size_diff count_diff site\n" % (memory.net, memory.peak)
+        )
+        for row in memory.rows[:40]:
+            res += "%+12d %+10d %s:%d\n" % (row[0], row[1], row[4], row[5])
+        return "<pre>" + res + "</pre>"
+
+    def summary_for_gc(self, gc):
+        res = (
+            " ---- GC ----\n\n"
+            "%d collections, %.3f ms paused, longest %.3f ms\n\n"
+            "gen collections  collected uncollectable\n"
+            % (gc.count, gc.pause * 1000, gc.max_pause * 1000)
+        )
+        for generation, delta in enumerate(gc.generations):
+            res += "%3d %11d %10d %13d\n" % (
+                generation,
+                delta["collections"],
+                delta["collected"],
+                delta["uncollectable"],
+            )
+        return "<pre>" + res + "</pre>"
 
+    def summary_for_files(self, stats):
         mystats = {}
         mygroups = {}
 
         _sum = 0
 
-        for s in stats_str:
-            fields = words_re.split(s)
-            if len(fields) == 7:
-                time = float(fields[2])
-                _sum += time
-                _file = fields[6].split(":")[0]
-
-                if _file not in mystats:
-                    mystats[_file] = 0
-                mystats[_file] += time
-
-                group = self.get_group(_file)
-                if group not in mygroups:
-                    mygroups[group] = 0
-                mygroups[group] += time
+        for row in range(len(stats)):
+            time = stats.tottime[row]
+            _sum += time
+            _file = stats.strings[stats.file_ids[row]]
+
+            if _file not in mystats:
+                mystats[_file] = 0
+            mystats[_file] += time
+
+            group = self.get_group(_file)
+            if group not in mygroups:
+                mygroups[group] = 0
+            mygroups[group] += time
 
         return (
             "<pre>"
@@ -0,0 +1,260 @@
+"""Capturing SQL queries through django's execute wrappers.
+
+Unlike ``connection.queries``, execute wrappers see every query whether
+or not ``DEBUG`` is on. Queries are grouped by fingerprint, the SQL with
+its literals stripped, so memory stays bounded however many queries a
+profiled block runs.
+
+Individual queries can also be kept in a ``QueryLog``, a ring buffer of
+the last queries, optionally only the slow ones, logged at once when
+the block ends.
+"""
+
+import array
+import contextlib
+import functools
+import random
+import re
+import timeit
+
+__all__ = [
+    "fingerprint",
+    "FingerprintStats",
+    "QueryLog",
+    "QueryCapture",
+]
+
+OTHER = "<other>"
+
+_fingerprint_res = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),  # string literals
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),  # numbers
+    # placeholders, but not casts such as ::integer
+    (re.compile(r"%s|%\(\w+\)s|\$\d+|(?<![:\w]):[A-Za-z_]\w*"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),  # IN lists
+    (re.compile(r"(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+"), r"\1"),  # VALUES
+    (re.compile(r"\s+"), " "),
+]
+
+
+@functools.lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """``sql`` with literals, placeholders and value lists collapsed.
+
+    ORM queries keep their literals in the parameters, so the same few
+    statements come back over and over; results are cached.
+    """
+    for pattern, replacement in _fingerprint_res:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class FingerprintStats(object):
+    """Count, total time and sampled durations of one fingerprint.
+
+    Durations are kept in a reservoir of ``reservoir_size`` uniform
+    samples, so percentiles are exact up to that many queries and
+    estimated past it.
+    """
+
+    def __init__(self, fingerprint: str, reservoir_size: int = 64):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.reservoir_size = reservoir_size
+        self.samples = []
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if len(self.samples) < self.reservoir_size:
+            self.samples.append(duration)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.reservoir_size:
+                self.samples[slot] = duration
+
+    def percentile(self, percent: float) -> float:
+        """Nearest-rank percentile of the sampled durations, in seconds.
+        """
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        rank = max(int(round(percent / 100.0 * len(samples))), 1)
+        return samples[min(rank, len(samples)) - 1]
+
+    def as_dict(self) -> dict:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "seconds": self.total,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class QueryLog(object):
+    """Ring buffer of the last ``capacity`` queries.
+
+    Slots are allocated upfront and overwritten once full, so a block
+    running thousands of queries keeps a fixed amount of memory and
+    ``dropped`` tells how many records were overwritten.
+
+    :param capacity: number of queries kept
+    :type capacity: int
+    :param slow_threshold: queries faster than this many seconds are
+        only counted in ``skipped``
+    :type slow_threshold: float
+    """
+
+    def __init__(self, capacity: int = 100, slow_threshold: float = 0.0):
+        if capacity < 1:
+            raise ValueError("Query log capacity must be positive")
+        self.capacity = capacity
+        self.slow_threshold = slow_threshold or 0.0
+        self.recorded = 0
+        self.skipped = 0
+        self.started = timeit.default_timer()
+        self._sql = [None] * capacity
+        self._aliases = [None] * capacity
+        self._offsets = array.array("d", bytes(8 * capacity))
+        self._durations = array.array("d", bytes(8 * capacity))
+
+    def __len__(self):
+        return min(self.recorded, self.capacity)
+
+    @property
+    def dropped(self) -> int:
+        return max(self.recorded - self.capacity, 0)
+
+    def add(self, sql: str, start: float, duration: float, alias=None):
+        """Keep one query, ``start`` being a ``timeit.default_timer()``
+        value.
+        """
+        if duration < self.slow_threshold:
+            self.skipped += 1
+            return
+        slot = self.recorded % self.capacity
+        self._sql[slot] = sql
+        self._aliases[slot] = alias
+        self._offsets[slot] = start - self.started
+        self._durations[slot] = duration
+        self.recorded += 1
+
+    def records(self) -> list:
+        """Kept queries, oldest first, ``offset`` being the seconds
+        between the creation of the log and the query.
+        """
+        first = self.recorded % self.capacity if self.dropped else 0
+        return [
+            {
+                "sql": self._sql[slot],
+                "alias": self._aliases[slot],
+                "offset": self._offsets[slot],
+                "seconds": self._durations[slot],
+            }
+            for slot in ((first + i) % self.capacity for i in range(len(self)))
+        ]
+
+
+class QueryCapture(object):
+    """Execute wrapper aggregating the queries run while it is installed.
+
+    :param max_fingerprints: distinct fingerprints tracked, later ones
+        are counted under ``"<other>"``
+    :type max_fingerprints: int
+    :param n_plus_one_threshold: a ``SELECT`` fingerprint run at least
+        this many times is reported as an N+1 suspect
+    :type n_plus_one_threshold: int
+    :param reservoir_size: durations sampled per fingerprint
+    :type reservoir_size: int
+    :param log: also keep individual queries in this log
+    :type log: QueryLog
+    :param span: also add individual queries to this trace span
+    :type span: pyprofile.trace.Span
+    """
+
+    def __init__(
+        self,
+        max_fingerprints: int = 200,
+        n_plus_one_threshold: int = 10,
+        reservoir_size: int = 64,
+        log: QueryLog = None,
+        span=None,
+    ):
+        self.max_fingerprints = max_fingerprints
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.reservoir_size = reservoir_size
+        self.log = log
+        self.span = span
+        self.fingerprints = {}
+        self.count = 0
+        self.total = 0.0
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = timeit.default_timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = timeit.default_timer() - start
+            self.record(sql, duration)
+            if self.log is not None:
+                self.log.add(sql, start, duration, context["connection"].alias)
+            if self.span is not None and "pyprofile_span" not in context:
+                # nested captures share the context, the innermost one
+                # adds the slice
+                context["pyprofile_span"] = self.span
+                self.span.query(
+                    sql, start, duration, context["connection"].alias
+                )
+
+    def record(self, sql: str, duration: float):
+        self.count += 1
+        self.total += duration
+        key = fingerprint(sql)
+        stats = self.fingerprints.get(key)
+        if stats is None:
+            if len(self.fingerprints) >= self.max_fingerprints:
+                key = OTHER
+                stats = self.fingerprints.get(key)
+            if stats is None:
+                stats = self.fingerprints[key] = FingerprintStats(
+                    key, self.reservoir_size
+                )
+        stats.add(duration)
+
+    def install(self, connections):
+        """Wrap the calling thread's handle of every connection given.
+        """
+        self._stack = contextlib.ExitStack()
+        for connection in connections:
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def uninstall(self):
+        if self._stack is not None:
+            self._stack.close()
+            self._stack = None
+
+    def by_total(self) -> list:
+        """Fingerprint stats, most expensive first.
+        """
+        return sorted(
+            self.fingerprints.values(),
+            key=lambda stats: stats.total,
+            reverse=True,
+        )
+
+    def n_plus_one_suspects(self) -> list:
+        return [
+            stats
+            for stats in self.by_total()
+            if stats.count >= self.n_plus_one_threshold
+            and stats.fingerprint != OTHER
+            and stats.fingerprint.lstrip("( ").upper().startswith("SELECT")
+        ]
@@ -1,9 +1,12 @@
 import functools
-import inspect
 import logging
 import sys
+import time
 import timeit
-from datetime import datetime
+import types
+
+from pyprofile.coroutines import iscoroutinefunction, run_stepped
+from pyprofile.histogram import record as record_duration
 
 try:
     from StringIO import StringIO
@@ -15,18 +18,94 @@ try:
 except ImportError:
     import profile as profile_module
 
-try:
-    from django.conf import settings
-except ImportError:
-    settings = None
 
-try:
-    if settings.configured:
-        from django.db import connections
+def get_settings():
+    """django settings, or ``None`` without django.
+
+    Looked up on use rather than at import time, so importing this
+    module neither needs nor loads django.
+    """
+    try:
+        from django.conf import settings
+    except ImportError:
+        return None
+    return settings
+
+
+def get_connections():
+    """django's connection handler, once settings are configured.
+    """
+    settings = get_settings()
+    if settings is None or not settings.configured:
+        return None
+    from django.db import connections
+
+    return connections
+
+
+def get_tracer():
+    """Tracer of ``PROFILING_TRACE_DIR``, or ``None`` when unset.
+    """
+    settings = get_settings()
+    if settings is None or not settings.configured:
+        return None
+    trace_dir = getattr(settings, "PROFILING_TRACE_DIR", None)
+    if not trace_dir:
+        return None
+    from pyprofile.trace import get_tracer
+
+    return get_tracer(
+        trace_dir,
+        mode=getattr(settings, "PROFILING_TRACE_MODE", "request"),
+        window=getattr(settings, "PROFILING_TRACE_WINDOW", 60.0),
+    )
+
+
+def log_queries(log, name, queries):
+    """Log the queries of a stopped ``QueryCapture`` as one record.
+
+    The record's ``extra`` holds the ``fingerprints`` stats, most
+    expensive first, and the individual ``queries`` kept by the
+    capture's log, if any.
+    """
+    fingerprints = [query.as_dict() for query in queries.by_total()]
+    query_log = queries.log
+    if query_log is None:
+        records, dropped, skipped = [], 0, 0
     else:
-        connections = None
-except (ImportError, AttributeError):
-    connections = None
+        records = query_log.records()
+        dropped, skipped = query_log.dropped, query_log.skipped
+    log.debug(
+        "%s: %d queries, %d fingerprints, %d logged, %d dropped",
+        name,
+        queries.count,
+        len(fingerprints),
+        len(records),
+        dropped,
+        extra={
+            "fingerprints": fingerprints,
+            "queries": records,
+            "queries_dropped": dropped,
+            "queries_skipped": skipped,
+        },
+    )
+
+
+_query_log_publisher = None
+
+
+def get_query_log_publisher():
+    """Background publisher logging queries off the request path.
+
+    Batches are dropped rather than blocking requests when the worker
+    falls behind.
+    """
+    global _query_log_publisher
+    if _query_log_publisher is None:
+        from pyprofile.publishers import BackgroundPublisher
+
+        _query_log_publisher = BackgroundPublisher(overflow="drop")
+    return _query_log_publisher
 
 
 class Profiler(object):
@@ -34,8 +113,22 @@ class Profiler(object):
     Util for profiling python code mainly in django projects,
     but can be used also on ordinary python code
 
-    Warning:
-        Currently only one connection is supported.
+    SQL queries are captured with ``connection.execute_wrapper``, so
+    they are seen with ``DEBUG`` off too, and grouped by fingerprint.
+    With the logger enabled for ``DEBUG``, the last
+    ``PROFILING_SQL_LOG_SIZE`` queries slower than
+    ``PROFILING_SQL_LOG_SLOW`` seconds are kept and logged in a single
+    record when the block ends, from a background thread if
+    ``PROFILING_SQL_LOG_ASYNC`` is set.
+
+    With ``PROFILING_TRACE_DIR`` set, blocks are also written as Chrome
+    trace events, nested blocks and captured queries as child slices,
+    one file per outermost block or, with ``PROFILING_TRACE_MODE`` set
+    to ``"window"``, per ``PROFILING_TRACE_WINDOW`` seconds.
+
+    With ``PROFILING_GC`` set, or ``profile_gc``, the garbage collections
+    that ran during the block are counted, their pauses added to the
+    ``performance`` extra and the trace span.
 
     """
 
@@ -44,7 +137,8 @@ class Profiler(object):
         name,
         start=False,
         profile_sql=False,
-        connection_names=("default",),
+        connection_names=None,
+        profile_gc=False,
     ):
         """Constructor
 
@@ -54,12 +148,16 @@ class Profiler(object):
         :type start: bool
         :param profile_sql: whether to profile sql queries or not
         :type profile_sql: bool
-        :param connection_names: names of database connections to profile
+        :param connection_names: names of database connections to profile,
+            all configured connections by default
         :type connection_names: tuple
+        :param profile_gc: whether to record garbage collections or not
+        :type profile_gc: bool
         :returns: Profiler instance
         :rtype: profiling.Profiler
 
         """
+        settings = get_settings()
         if settings is not None and hasattr(settings, "PROFILING_LOGGER_NAME"):
             logger_name = settings.PROFILING_LOGGER_NAME
         else:
@@ -68,12 +166,15 @@ class Profiler(object):
             logger_name += ".{0}".format(name)
         self.log = logging.getLogger(logger_name)
         self.name = name
-        self.pre_queries_cnt = {}
+        self.queries = None
+        self.tracer = None
+        self.span = None
         self.profile_sql = profile_sql
-        try:
-            assert isinstance(connection_names, tuple)
+        self.profile_gc = profile_gc
+        self.gc_monitor = None
+        if isinstance(connection_names, tuple) or connection_names is None:
             self.connection_names = connection_names
-        except AssertionError:
+        else:
             self.connection_names = ("default",)
         if start:
             self.start()
@@ -116,11 +217,47 @@ class Profiler(object):
         method directly, but rather use Profiler as context manager.
         """
         self.start_time = timeit.default_timer()
-        if self.__can_profile_sql():
-            for connection_name in self.connection_names:
-                self.pre_queries_cnt[connection_name] = len(
-                    connections[connection_name].queries
+        self.cpu_time = 0.0
+        self._cpu_mark = time.thread_time()
+        self._paused = False
+        self.queries = None
+        self.gc_monitor = None
+        if self.profile_gc or getattr(get_settings(), "PROFILING_GC", False):
+            from pyprofile.gcstats import GCMonitor
+
+            self.gc_monitor = GCMonitor().start()
+        self.tracer = get_tracer()
+        self.span = None
+        if self.tracer is not None:
+            self.span = self.tracer.begin(self.name)
+        connections = self.__get_sql_connections()
+        if connections is not None:
+            from pyprofile.contrib.django.queries import (
+                QueryCapture,
+                QueryLog,
+            )
+
+            settings = get_settings()
+            log_size = getattr(settings, "PROFILING_SQL_LOG_SIZE", 100)
+            if log_size and self.log.isEnabledFor(logging.DEBUG):
+                query_log = QueryLog(
+                    log_size, getattr(settings, "PROFILING_SQL_LOG_SLOW", 0.0)
                 )
+            else:
+                query_log = None
+            self.queries = QueryCapture(
+                max_fingerprints=getattr(
+                    settings, "PROFILING_SQL_MAX_FINGERPRINTS", 200
+                ),
+                n_plus_one_threshold=getattr(
+                    settings, "PROFILING_N_PLUS_ONE_THRESHOLD", 10
+                ),
+                log=query_log,
+                span=self.span,
+            ).install(
+                connections[connection_name]
+                for connection_name in self.connection_names or connections
+            )
 
     def stop(self):
         """
@@ -136,56 +273,93 @@ class Profiler(object):
             )
 
         self.stop_time = timeit.default_timer()
-        if self.__can_profile_sql():
-            sql_count, sql_time = 0, 0.0
-            for connection_name in self.connection_names:
-                sql_stat = self.__get_sql_stats_for_connection(connection_name)
-                sql_count, sql_time = (
-                    sql_count + sql_stat[0],
-                    sql_time + sql_stat[1],
+        self.pause()
+        if self.gc_monitor is not None:
+            self.gc_monitor.stop()
+        record_duration(self.name, self.get_duration_seconds())
+        if self.queries is not None:
+            self.queries.uninstall()
+        if self.span is not None:
+            args = {"cpu_seconds": self.cpu_time}
+            if self.gc_monitor is not None:
+                args["gc_collections"] = self.gc_monitor.stats.count
+                args["gc_seconds"] = self.gc_monitor.stats.pause
+            if self.queries is not None:
+                args["sql_count"] = self.queries.count
+                args["sql_seconds"] = self.queries.total
+            self.tracer.end(self.span, args)
+            self.span = None
+        if self.queries is not None:
+            if self.log.isEnabledFor(logging.INFO):
+                performance = self.get_performance()
+                performance["sql_count"] = self.queries.count
+                performance["sql_seconds"] = self.queries.total
+                self.log.info(
+                    "%s took: %f ms, executed %s queries in %f seconds",
+                    self.name,
+                    self.get_duration_milliseconds(),
+                    self.queries.count,
+                    self.queries.total,
+                    extra={"performance": performance},
                 )
-            self.log.info(
-                "%s took: %f ms, executed %s queries in %f seconds",
-                self.name,
-                self.get_duration_milliseconds(),
-                sql_count,
-                sql_time,
-                extra={
-                    "performance": {
-                        "duration_seconds": self.get_duration_seconds(),
-                        "duration_miliseconds": self.get_duration_milliseconds(),
-                        "duration_microseconds": self.get_duration_microseconds(),
-                    }
-                },
-            )
-            if sql_count:
-                for connection_name in self.connection_names:
-                    for query in connections[connection_name].queries[
-                        self.pre_queries_cnt[connection_name] :
-                    ]:
-                        self.log.debug(
-                            "(%s) %s",
-                            query.get("time"),
-                            query.get("sql"),
-                            extra={
-                                "query": query.get("sql"),
-                                "time": query.get("time"),
-                            },
-                        )
-        else:
+            if self.queries.count and self.log.isEnabledFor(logging.DEBUG):
+                if getattr(get_settings(), "PROFILING_SQL_LOG_ASYNC", False):
+                    get_query_log_publisher().submit(
+                        log_queries, self.log, self.name, self.queries
+                    )
+                else:
+                    log_queries(self.log, self.name, self.queries)
+            for query in self.queries.n_plus_one_suspects():
+                self.log.warning(
+                    "%s: possible N+1, %d queries like: %s",
+                    self.name,
+                    query.count,
+                    query.fingerprint,
+                    extra={"query": query.as_dict()},
+                )
+        elif self.log.isEnabledFor(logging.INFO):
             self.log.info(
                 "%s took: %f ms",
                 self.name,
                 self.get_duration_milliseconds(),
-                extra={
-                    "performance": {
-                        "duration_seconds": self.get_duration_seconds(),
-                        "duration_miliseconds": self.get_duration_milliseconds(),
-                        "duration_microseconds": self.get_duration_microseconds(),
-                    }
-                },
+                extra={"performance": self.get_performance()},
             )
 
+    def get_performance(self):
+        """Durations of the block, as logged in the ``performance`` extra.
+
+        Logging is skipped when the logger is not enabled for ``INFO``;
+        durations are always counted in the ``pyprofile.histogram``
+        histogram of the block's name. Blocks recording garbage
+        collections add their ``GCStats`` summary as ``gc``.
+
+        :rtype: dict
+
+        """
+        performance = {
+            "duration_seconds": self.get_duration_seconds(),
+            "duration_miliseconds": self.get_duration_milliseconds(),
+            "duration_microseconds": self.get_duration_microseconds(),
+            "cpu_seconds": self.cpu_time,
+        }
+        if self.gc_monitor is not None and self.gc_monitor.stats is not None:
+            performance["gc"] = self.gc_monitor.stats.summary()
+        return performance
+
+    def pause(self):
+        """Stop counting CPU time, e.g. while a profiled coroutine awaits.
+
+        The wall clock duration keeps running.
+        """
+        if not self._paused:
+            self.cpu_time += time.thread_time() - self._cpu_mark
+            self._paused = True
+
+    def resume(self):
+        if self._paused:
+            self._cpu_mark = time.thread_time()
+            self._paused = False
+
     def __enter__(self):
         self.start()
         return self
@@ -205,27 +379,14 @@ class Profiler(object):
         self.stop()
         return False
 
-    def __can_profile_sql(self):
-        return connections is not None and (
-            getattr(settings, "PROFILING_SQL_QUERIES", False)
+    def __get_sql_connections(self):
+        connections = get_connections()
+        if connections is not None and (
+            getattr(get_settings(), "PROFILING_SQL_QUERIES", False)
             or self.profile_sql
-        )
-
-    def __get_sql_stats_for_connection(self, connection_name):
-        pre_queries_cnt = self.pre_queries_cnt[connection_name]
-        sql_count = len(connections[connection_name].queries) - pre_queries_cnt
-        if sql_count > 0:
-            sql_time = sum(
-                [
-                    float(q["time"])
-                    for q in connections[connection_name].queries[
-                        pre_queries_cnt : pre_queries_cnt + sql_count
-                    ]
-                ]
-            )
-        else:
-            sql_time = 0.0
-        return sql_count, sql_time
+        ):
+            return connections
+        return None
 
 
 def profile(*fn, **options):
@@ -241,16 +402,18 @@ def profile(*fn, **options):
     :rtype: types.FunctionType
     :raises: TypeError, IOError
 
+    Coroutine functions are timed across their awaits, while CPU time
+    and execution statistics only cover the coroutine's own steps.
+
     """
     profile_sql = options.pop("profile_sql", True)
     stats = options.pop("stats", True)
     stats_buffer = options.pop("stats_buffer", None)
     save_stats = options.pop("save_stats", True)
+    manage_buffer = False
     if save_stats:
         manage_buffer = False if stats_buffer else True
-        file_name = settings.PROFILING_STATS_FILE % int(
-            datetime.now().timestamp()
-        )
+        file_name = get_settings().PROFILING_STATS_FILE % int(time.time())
         stats_buffer = stats_buffer or open(file_name, "w")
     if options:
         raise TypeError(
@@ -268,11 +431,7 @@ def profile(*fn, **options):
         except AttributeError:
             pass
 
-        def wrapper(*args, **kwargs):
-            try:
-                functools.update_wrapper(wrapper, func)
-            except AttributeError:
-                pass
+        def get_profiler_name(args):
             if (
                 args
                 and hasattr(args[0], "__class__")
@@ -280,53 +439,80 @@ def profile(*fn, **options):
                 and args[0].__class__.__dict__.get(func.__name__).__name__
                 == func.__name__
             ):
-                profiler_name = "%s.%s" % (
-                    args[0].__class__.__name__,
-                    func.__name__,
-                )
+                return "%s.%s" % (args[0].__class__.__name__, func.__name__)
+            if hasattr(func, "__name__"):
+                return "{0}.{1}".format(func.__module__, func.__name__)
+            if hasattr(func, "__class__"):
+                return func.__class__.__name__
+            return "Profiler"
+
+        def report(prof, profiler_name):
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            prof.print_stats()
+            statistics = sys.stdout.getvalue()
+            sys.stdout.close()
+            sys.stdout = old_stdout
+            if stats_buffer is not None:
+                stats_buffer.write(statistics)
+                manage_buffer and stats_buffer.close()
             else:
-                if hasattr(func, "__name__"):
-                    profiler_name = "{0}.{1}".format(
-                        func.__module__, func.__name__
+                settings = get_settings()
+                logger_name = (
+                    settings.PROFILING_LOGGER_NAME
+                    if settings is not None
+                    and hasattr(settings, "PROFILING_LOGGER_NAME")
+                    else __name__
+                )
+                logging.getLogger(
+                    "{0}.{1}".format(logger_name, profiler_name)
+                ).info(statistics)
+
+        if iscoroutinefunction(func):
+
+            async def wrapper(*args, **kwargs):
+                profiler_name = get_profiler_name(args)
+                with Profiler(profiler_name, profile_sql=profile_sql) as block:
+                    # only measure the steps of this coroutine, not the
+                    # tasks interleaving with it on the event loop
+                    block.pause()
+                    prof = profile_module.Profile() if stats else None
+
+                    def resume():
+                        block.resume()
+                        prof and prof.enable()
+
+                    def suspend():
+                        prof and prof.disable()
+                        block.pause()
+
+                    to_return = await run_stepped(
+                        func(*args, **kwargs), resume, suspend
                     )
-                elif hasattr(func, "__class__"):
-                    profiler_name = func.__class__.__name__
-                else:
-                    profiler_name = "Profiler"
-            if stats:
-                prof = profile_module.Profile()
-                with Profiler(profiler_name, profile_sql=profile_sql):
-                    to_return = prof.runcall(func, *args, **kwargs)
-                old_stdout = sys.stdout
-                sys.stdout = StringIO()
-                prof.print_stats()
-                statistics = sys.stdout.getvalue()
-                sys.stdout.close()
-                sys.stdout = old_stdout
-                if stats_buffer is not None:
-                    stats_buffer.write(statistics)
-                    manage_buffer and stats_buffer.close()
+                if stats:
+                    report(prof, profiler_name)
+                return to_return
+
+        else:
+
+            def wrapper(*args, **kwargs):
+                profiler_name = get_profiler_name(args)
+                if stats:
+                    prof = profile_module.Profile()
+                    with Profiler(profiler_name, profile_sql=profile_sql):
+                        to_return = prof.runcall(func, *args, **kwargs)
+                    report(prof, profiler_name)
                 else:
-                    logger_name = (
-                        settings.PROFILING_LOGGER_NAME
-                        if settings is not None
-                        and hasattr(settings, "PROFILING_LOGGER_NAME")
-                        else __name__
-                    )
-                    logging.getLogger(
-                        "{0}.{1}".format(logger_name, profiler_name)
-                    ).info(statistics)
-            else:
-                with Profiler(profiler_name, profile_sql=profile_sql):
-                    to_return = func(*args, **kwargs)
-            return to_return
+                    with Profiler(profiler_name, profile_sql=profile_sql):
+                        to_return = func(*args, **kwargs)
+                return to_return
 
         try:
             return functools.update_wrapper(wrapper, func)
         except AttributeError:
             return wrapper
 
-    if fn and inspect.isfunction(fn[0]):
+    if fn and isinstance(fn[0], types.FunctionType):
         # Called with no parameter
         return decorator(fn[0])
     else:
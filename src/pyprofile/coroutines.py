@@ -0,0 +1,60 @@
+"""Driving coroutines step by step.
+
+A coroutine only runs between two suspension points; in between, the
+event loop runs other tasks. ``run_stepped`` calls hooks around every
+step so a profiler can be active only while its own task executes.
+"""
+
+import functools
+import types
+
+__all__ = [
+    "iscoroutinefunction",
+    "run_stepped",
+]
+
+CO_COROUTINE = 0x80
+
+
+def iscoroutinefunction(func) -> bool:
+    """Like ``inspect.iscoroutinefunction``, without importing ``inspect``.
+    """
+    while isinstance(func, functools.partial):
+        func = func.func
+    func = getattr(func, "__func__", func)
+    code = getattr(func, "__code__", None)
+    return code is not None and bool(code.co_flags & CO_COROUTINE)
+
+
+@types.coroutine
+def run_stepped(coro, resume, suspend):
+    """Await ``coro``, calling ``resume()`` before and ``suspend()``
+    after each of its steps.
+
+    :param coro: coroutine object to run
+    :param resume: called when ``coro`` is about to run
+    :type resume: callable
+    :param suspend: called when ``coro`` yielded control or finished
+    :type suspend: callable
+    :returns: the value returned by ``coro``
+    """
+    send, throw = coro.send, coro.throw
+    value, error = None, None
+    while True:
+        resume()
+        try:
+            if error is not None:
+                yielded = throw(error)
+            else:
+                yielded = send(value)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            suspend()
+        try:
+            value, error = (yield yielded), None
+        except GeneratorExit:
+            coro.close()
+            raise
+        except BaseException as exc:
+            value, error = None, exc
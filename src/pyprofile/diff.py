@@ -0,0 +1,340 @@
+"""Comparing profiles and gating performance regressions.
+
+Two sets of dumps (``.prof`` files written by ``save_stats`` or binary
+``.pyps`` stats) are merged, normalized per call and per profile, and
+compared function by function.
+
+Command line usage, exits with 1 when a budget is exceeded::
+
+    python -m pyprofile.diff --base before/ --head after/ --max-total 0.1
+"""
+
+import argparse
+import fnmatch
+import os
+import pstats
+import sys
+
+from gprof2dot import Theme
+
+from .dot import profile_from_stats, write_dot
+from .stats import StructuredStats, merge_stats_dicts
+
+__all__ = [
+    "load_profiles",
+    "compare",
+    "Comparison",
+    "FunctionDelta",
+    "write_diff_dot",
+]
+
+DIFF_COLORMAP = Theme(
+    mincolor=(1.0 / 3.0, 0.80, 0.40),  # green, faster
+    maxcolor=(0.0, 1.0, 0.5),  # red, slower
+    gamma=1.0,
+)
+
+PROFILE_SUFFIXES = (".prof", ".pyps")
+
+
+def load_profiles(paths) -> tuple:
+    """Merge dumps into one raw pstats dict.
+
+    :param paths: ``.prof``/``.pyps`` files or directories holding them
+    :returns: ``(stats dict, number of profiles)``
+    """
+    merged = {}
+    profiles = 0
+    for path in _profile_files(paths):
+        if path.endswith(".pyps"):
+            with open(path, "rb") as f:
+                structured = StructuredStats.from_binary(f)
+            stats = structured.to_stats_dict()
+            profiles += structured.meta.get("profiles", 1)
+        else:
+            stats = pstats.Stats(path).stats
+            profiles += 1
+        merge_stats_dicts(merged, stats)
+    return merged, profiles
+
+
+class FunctionDelta(object):
+    """Per call and per profile figures of one function in both sets.
+    """
+
+    def __init__(self, func, base, head, base_profiles, head_profiles):
+        self.func = func
+        self.base_calls, self.base_tottime, self.base_cumtime = _per_call(
+            base, base_profiles
+        )
+        self.head_calls, self.head_tottime, self.head_cumtime = _per_call(
+            head, head_profiles
+        )
+
+    @property
+    def name(self) -> str:
+        return pstats.func_std_string(self.func)
+
+    @property
+    def tottime_delta(self) -> float:
+        return self.head_tottime - self.base_tottime
+
+    @property
+    def cumtime_delta(self) -> float:
+        return self.head_cumtime - self.base_cumtime
+
+    @property
+    def ratio(self) -> float:
+        """Relative change of the cumulative time per call.
+        """
+        if not self.base_cumtime:
+            return float("inf") if self.head_cumtime else 0.0
+        return self.cumtime_delta / self.base_cumtime
+
+    @property
+    def impact(self) -> float:
+        """Seconds gained or lost per profile.
+        """
+        return (
+            self.head_cumtime * self.head_calls
+            - self.base_cumtime * self.base_calls
+        )
+
+
+class Comparison(object):
+    """Result of ``compare``.
+
+    :param min_time: changes smaller than this many seconds per profile
+        are noise
+    :type min_time: float
+    :param min_ratio: relative changes smaller than this are noise
+    :type min_ratio: float
+    """
+
+    def __init__(
+        self, base, head, base_profiles, head_profiles, min_time, min_ratio
+    ):
+        self.base = base
+        self.head = head
+        self.base_profiles = max(base_profiles, 1)
+        self.head_profiles = max(head_profiles, 1)
+        self.min_time = min_time
+        self.min_ratio = min_ratio
+        self.functions = sorted(
+            (
+                FunctionDelta(
+                    func,
+                    base.get(func),
+                    head.get(func),
+                    self.base_profiles,
+                    self.head_profiles,
+                )
+                for func in set(base) | set(head)
+            ),
+            key=lambda delta: abs(delta.impact),
+            reverse=True,
+        )
+
+    @property
+    def base_total(self) -> float:
+        return _total_tt(self.base) / self.base_profiles
+
+    @property
+    def head_total(self) -> float:
+        return _total_tt(self.head) / self.head_profiles
+
+    @property
+    def total_ratio(self) -> float:
+        if not self.base_total:
+            return 0.0
+        return self.head_total / self.base_total - 1
+
+    def significant(self) -> list:
+        """Function changes above the noise thresholds.
+        """
+        return [
+            delta
+            for delta in self.functions
+            if abs(delta.impact) >= self.min_time
+            and abs(delta.ratio) >= self.min_ratio
+        ]
+
+    def violations(
+        self,
+        max_total: float = None,
+        max_function: float = None,
+        budgets: dict = None,
+    ) -> list:
+        """Budgets exceeded by the head profiles, as messages.
+
+        :param max_total: allowed relative growth of the total time
+        :type max_total: float
+        :param max_function: allowed relative growth of any significant
+            function's cumulative time per call
+        :type max_function: float
+        :param budgets: ``{pattern: seconds}`` maximum cumulative time
+            per call of the functions whose ``file:line(name)`` matches
+        :type budgets: dict
+        """
+        violations = []
+        if max_total is not None and self.total_ratio > max_total:
+            violations.append(
+                "total time grew by %.1f%% (budget %.1f%%)"
+                % (self.total_ratio * 100, max_total * 100)
+            )
+        if max_function is not None:
+            for delta in self.significant():
+                if delta.base_calls and delta.ratio > max_function:
+                    violations.append(
+                        "%s grew by %.1f%% per call (budget %.1f%%)"
+                        % (delta.name, delta.ratio * 100, max_function * 100)
+                    )
+        for pattern, seconds in (budgets or {}).items():
+            for delta in self.functions:
+                if (
+                    delta.head_calls
+                    and delta.head_cumtime > seconds
+                    and fnmatch.fnmatch(delta.name, pattern)
+                ):
+                    violations.append(
+                        "%s takes %.6fs per call (budget %.6fs)"
+                        % (delta.name, delta.head_cumtime, seconds)
+                    )
+        return violations
+
+
+def compare(
+    base: dict,
+    head: dict,
+    base_profiles: int = 1,
+    head_profiles: int = 1,
+    min_time: float = 1e-4,
+    min_ratio: float = 0.05,
+) -> Comparison:
+    """Compare two raw pstats dicts, e.g. from ``load_profiles``.
+    """
+    return Comparison(
+        base, head, base_profiles, head_profiles, min_time, min_ratio
+    )
+
+
+def write_diff_dot(comparison: Comparison, output, scale: float = 1.0):
+    """Write the head call graph colored by change, red is slower.
+
+    :param output: text file object
+    :param scale: relative change mapped to full red or green
+    :type scale: float
+    """
+    profile = profile_from_stats(comparison.head)
+    ratios = {
+        pstats.func_std_string(delta.func): delta.ratio
+        for delta in comparison.significant()
+    }
+    for function in profile.functions.values():
+        key = "%s:%d(%s)" % _split_function_name(function)
+        ratio = ratios.get(key, 0.0)
+        ratio = max(min(ratio / scale, 1.0), -1.0)
+        function.weight = 0.5 + ratio / 2
+        if key in ratios:
+            function.name += "\n%+.1f%%" % (ratios[key] * 100)
+    for function in profile.functions.values():
+        for call in function.calls.values():
+            call.weight = profile.functions[call.callee_id].weight
+    write_dot(profile, output, DIFF_COLORMAP)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyprofile.diff",
+        description="Compare two sets of pyprofile dumps.",
+    )
+    parser.add_argument("--base", nargs="+", required=True)
+    parser.add_argument("--head", nargs="+", required=True)
+    parser.add_argument("--min-time", type=float, default=1e-4)
+    parser.add_argument("--min-ratio", type=float, default=0.05)
+    parser.add_argument("--max-total", type=float, default=None)
+    parser.add_argument("--max-function", type=float, default=None)
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="PATTERN=SECONDS",
+        help="maximum cumulative seconds per call of matching functions",
+    )
+    parser.add_argument("--dot", help="write a differential call graph")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    base, base_profiles = load_profiles(args.base)
+    head, head_profiles = load_profiles(args.head)
+    comparison = compare(
+        base,
+        head,
+        base_profiles,
+        head_profiles,
+        min_time=args.min_time,
+        min_ratio=args.min_ratio,
+    )
+    print(
+        "total: %.6fs -> %.6fs per profile (%+.1f%%)"
+        % (
+            comparison.base_total,
+            comparison.head_total,
+            comparison.total_ratio * 100,
+        )
+    )
+    for delta in comparison.significant()[: args.top]:
+        print(
+            "%+10.6fs %+8.1f%% %s"
+            % (delta.impact, delta.ratio * 100, delta.name)
+        )
+    if args.dot:
+        with open(args.dot, "wt", encoding="UTF-8") as output:
+            write_diff_dot(comparison, output)
+
+    budgets = {}
+    for budget in args.budget:
+        pattern, _, seconds = budget.rpartition("=")
+        budgets[pattern] = float(seconds)
+    violations = comparison.violations(
+        args.max_total, args.max_function, budgets
+    )
+    for violation in violations:
+        print("budget exceeded: %s" % violation, file=sys.stderr)
+    return 1 if violations else 0
+
+
+def _profile_files(paths):
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                if entry.name.endswith(PROFILE_SUFFIXES):
+                    yield entry.path
+        else:
+            yield path
+
+
+def _per_call(stat, profiles):
+    if stat is None:
+        return 0.0, 0.0, 0.0
+    cc, nc, tt, ct, callers = stat
+    return (
+        nc / profiles,
+        tt / nc if nc else 0.0,
+        ct / cc if cc else 0.0,
+    )
+
+
+def _total_tt(stats):
+    return sum(stat[2] for stat in stats.values())
+
+
+def _split_function_name(function):
+    # PstatsParser names functions "module:line:name" and keeps the file
+    module, line, name = function.name.split(":", 2)
+    return function.filename, int(line), name
+
+
+if __name__ == "__main__":
+    sys.exit(main())
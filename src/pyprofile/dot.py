@@ -0,0 +1,142 @@
+"""Graphviz call graphs, written with gprof2dot.
+
+The gprof2dot model is built straight from a raw pstats dict rather
+than parsed back from a ``.prof`` file, and functions and calls below
+the pruning thresholds are skipped as it is built, so large profiles
+never turn into large graphs in memory.
+"""
+
+import os
+from io import StringIO
+
+from gprof2dot import (
+    CALLS,
+    TEMPERATURE_COLORMAP,
+    TIME,
+    TIME_RATIO,
+    TOTAL_TIME,
+    TOTAL_TIME_RATIO,
+    Call,
+    DotWriter,
+    Function,
+    Profile,
+)
+
+__all__ = [
+    "export_dot",
+    "profile_from_stats",
+    "render_dot",
+    "write_dot",
+]
+
+NODE_THRESHOLD = 0.5 / 100.0
+EDGE_THRESHOLD = 0.1 / 100.0
+
+
+def export_dot(stats, path, artifacts):
+    """Exporter of the ``dot`` format.
+    """
+    with open(path, "wt", encoding="UTF-8") as output:
+        write_dot(profile_from_stats(stats.to_stats_dict()), output)
+
+
+def profile_from_stats(
+    stats: dict,
+    node_thres: float = NODE_THRESHOLD,
+    edge_thres: float = EDGE_THRESHOLD,
+) -> Profile:
+    """gprof2dot ``Profile`` of a raw ``{func: (cc, nc, tt, ct,
+    callers)}`` dict, like ``PstatsParser`` followed by ``prune``.
+
+    :param node_thres: functions below this fraction of the total time
+        are left out
+    :type node_thres: float
+    :param edge_thres: calls below this fraction of the total time are
+        left out
+    :type edge_thres: float
+    """
+    time = sum(stat[2] for stat in stats.values())
+    total_time = max([time] + [stat[3] for stat in stats.values()])
+    kept = sorted(
+        func
+        for func, stat in stats.items()
+        if _ratio(stat[3], total_time) >= node_thres
+    )
+
+    profile = Profile()
+    profile[TIME] = time
+    profile[TOTAL_TIME] = total_time
+    profile[TIME_RATIO] = 1.0
+    profile[TOTAL_TIME_RATIO] = 1.0
+    functions = {}
+    for function_id, func in enumerate(kept):
+        cc, nc, tt, ct, callers = stats[func]
+        filename, line, name = func
+        function = Function(
+            function_id,
+            "%s:%d:%s"
+            % (os.path.splitext(os.path.basename(filename))[0], line, name),
+        )
+        function.filename = filename
+        function.called = nc
+        function[TIME] = tt
+        function[TOTAL_TIME] = ct
+        function[TIME_RATIO] = _ratio(tt, time)
+        function[TOTAL_TIME_RATIO] = _ratio(ct, total_time)
+        function.weight = function[TOTAL_TIME_RATIO]
+        profile.functions[function_id] = function
+        functions[func] = function
+
+    for func in kept:
+        cc, nc, tt, ct, callers = stats[func]
+        callee = functions[func]
+        for caller, edge in callers.items():
+            if caller not in functions:
+                continue
+            if isinstance(edge, tuple):
+                calls, call_time = edge[1], edge[3]
+            else:
+                # profile module only records the number of calls
+                calls, call_time = edge, _ratio(edge, nc) * ct
+            call_ratio = _ratio(call_time, total_time)
+            if call_ratio < edge_thres:
+                continue
+            call = Call(callee.id)
+            call[CALLS] = calls
+            call[TOTAL_TIME] = call_time
+            call[TOTAL_TIME_RATIO] = call_ratio
+            call.weight = call_ratio
+            functions[caller].add_call(call)
+    return profile
+
+
+def render_dot(
+    stats: dict,
+    theme=None,
+    node_thres: float = NODE_THRESHOLD,
+    edge_thres: float = EDGE_THRESHOLD,
+) -> str:
+    """Dot source of the call graph of a raw pstats dict.
+    """
+    output = StringIO()
+    write_dot(profile_from_stats(stats, node_thres, edge_thres), output, theme)
+    return output.getvalue()
+
+
+def write_dot(profile, output, theme=None):
+    """Render a gprof2dot ``profile`` to the ``output`` text file.
+    """
+    if theme is None:
+        theme = TEMPERATURE_COLORMAP
+        theme.skew = 1.0
+    dot = DotWriter(output)
+    dot.strip = False
+    dot.wrap = False
+    dot.show_function_events = [TOTAL_TIME_RATIO, TIME_RATIO]
+    dot.graph(profile, theme)
+
+
+def _ratio(numerator, denominator):
+    if not denominator:
+        return 0.0
+    return numerator / denominator
@@ -0,0 +1,230 @@
+"""Restricting profiles to chosen modules and functions.
+
+``ModuleFilter`` matches functions against ``fnmatch`` patterns of
+their dotted module name, e.g. ``"myapp.*"``, or of their module and
+name, e.g. ``"myapp.views.index"``. Functions left out are collapsed
+into their nearest kept caller: their own time becomes the caller's.
+
+Engines apply filters as early as they can. The monitoring engine
+disables the events of excluded functions on their first call, the
+sampler drops their frames from each sample, and cProfile stats, which
+record every call regardless, are collapsed when the profile stops.
+"""
+
+import fnmatch
+import os
+import sys
+
+__all__ = [
+    "ModuleFilter",
+    "collapse_stats",
+    "module_name",
+]
+
+_module_names = {}
+
+
+def module_name(filename: str) -> str:
+    """Dotted module name of a source file, based on ``sys.path``.
+    """
+    name = _module_names.get(filename)
+    if name is not None:
+        return name
+    if filename == "~":
+        # cProfile's key of built-in functions
+        name = "builtins"
+    elif filename.startswith("<frozen "):
+        name = filename[len("<frozen ") : -1]
+    elif filename.startswith("<"):
+        name = filename
+    else:
+        path = os.path.abspath(filename)
+        root = ""
+        for entry in sys.path:
+            entry = os.path.join(os.path.abspath(entry or os.curdir), "")
+            if path.startswith(entry) and len(entry) > len(root):
+                root = entry
+        parts = os.path.splitext(path[len(root) :])[0].split(os.sep)
+        if root and len(parts) > 1 and parts[-1] == "__init__":
+            parts.pop()
+        name = ".".join(part for part in parts if part)
+    _module_names[filename] = name
+    return name
+
+
+class ModuleFilter(object):
+    """Include/exclude patterns over module and function names.
+
+    :param include: patterns of the functions to keep, all when empty
+    :type include: list
+    :param exclude: patterns of the functions to drop, even when
+        included
+    :type exclude: list
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._keys = {}
+        self._codes = {}
+
+    def __call__(self, func: tuple) -> bool:
+        """Whether the pstats ``(file, line, name)`` key is kept.
+        """
+        kept = self._keys.get(func)
+        if kept is None:
+            kept = self._keys[func] = self.match(module_name(func[0]), func[2])
+        return kept
+
+    def code(self, code) -> bool:
+        """Whether the functions of a code object are kept.
+        """
+        kept = self._codes.get(code)
+        if kept is None:
+            kept = self._codes[code] = self.match(
+                module_name(code.co_filename), code.co_name
+            )
+        return kept
+
+    def match(self, module: str, name: str) -> bool:
+        qualified = module + "." + name
+        if self.include and not any(
+            fnmatch.fnmatchcase(module, pattern)
+            or fnmatch.fnmatchcase(qualified, pattern)
+            for pattern in self.include
+        ):
+            return False
+        return not any(
+            fnmatch.fnmatchcase(module, pattern)
+            or fnmatch.fnmatchcase(qualified, pattern)
+            for pattern in self.exclude
+        )
+
+
+def collapse_stats(stats: dict, keep) -> dict:
+    """Raw pstats dict without the functions ``keep`` rejects.
+
+    The own time of a dropped function goes to its nearest kept
+    callers, split in proportion to the time of each call path, and
+    kept functions called from dropped ones get their nearest kept
+    callers as callers instead. Dropped functions without any kept
+    caller, e.g. the framework code around a view, are left out, along
+    with the share of time of the call paths coming from them.
+
+    :param keep: ``keep((file, line, name)) -> bool``
+    :type keep: callable
+    """
+    dropped = [func for func in stats if not keep(func)]
+    if not dropped:
+        return stats
+    ancestors = _kept_ancestors(stats, keep, dropped)
+
+    collapsed = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        if func in ancestors:
+            continue
+        edges = {}
+        for caller, edge in callers.items():
+            weights = ancestors.get(caller)
+            if weights is None:
+                _add_edge(edges, caller, edge, 1.0)
+            else:
+                for ancestor, weight in weights.items():
+                    _add_edge(edges, ancestor, edge, weight)
+        collapsed[func] = [cc, nc, tt, ct, edges]
+    for func in dropped:
+        tt = stats[func][2]
+        for ancestor, weight in ancestors[func].items():
+            collapsed[ancestor][2] += tt * weight
+    return {
+        func: (
+            cc,
+            nc,
+            tt,
+            ct,
+            {caller: tuple(edge) for caller, edge in edges.items()},
+        )
+        for func, (cc, nc, tt, ct, edges) in collapsed.items()
+    }
+
+
+def _kept_ancestors(stats, keep, dropped):
+    """``{dropped func: {nearest kept caller: weight}}``, the share of
+    the calls of each function made on behalf of each kept caller.
+
+    Weights sum to less than 1 when some calls come from paths without
+    any kept function, and are empty when all of them do.
+    """
+    ancestors = {}
+    for start in dropped:
+        if start in ancestors:
+            continue
+        # iterative post-order walk, framework call chains run deep
+        pending = [(start, False)]
+        visiting = set()
+        while pending:
+            func, expanded = pending.pop()
+            if func in ancestors:
+                continue
+            callers = stats[func][4]
+            if not expanded:
+                visiting.add(func)
+                pending.append((func, True))
+                for caller in callers:
+                    if (
+                        caller in stats
+                        and not keep(caller)
+                        and caller not in ancestors
+                        and caller not in visiting
+                    ):
+                        pending.append((caller, False))
+                continue
+            visiting.discard(func)
+            weights = {}
+            total = 0.0
+            for caller, edge in callers.items():
+                if caller == func or caller in visiting:
+                    # recursion, or a cycle of dropped functions whose
+                    # calls are accounted for where the cycle is entered
+                    continue
+                # calls weigh by cumulative time, or by count when untimed
+                weight = _edge_weight(edge)
+                total += weight
+                if caller not in stats:
+                    continue
+                if keep(caller):
+                    weights[caller] = weights.get(caller, 0.0) + weight
+                else:
+                    # the share of paths without a kept function is lost
+                    for ancestor, share in ancestors.get(caller, {}).items():
+                        weights[ancestor] = (
+                            weights.get(ancestor, 0.0) + weight * share
+                        )
+            ancestors[func] = (
+                {
+                    ancestor: weight / total
+                    for ancestor, weight in weights.items()
+                }
+                if total
+                else {}
+            )
+    return ancestors
+
+
+def _edge_weight(edge):
+    if not isinstance(edge, tuple):
+        # profile module only records the number of calls
+        return float(edge)
+    return edge[3] or float(edge[0])
+
+
+def _add_edge(edges, caller, edge, weight):
+    if not isinstance(edge, tuple):
+        edge = (edge, edge, 0.0, 0.0)
+    current = edges.get(caller)
+    if current is None:
+        current = edges[caller] = [0, 0, 0.0, 0.0]
+    current[0] += int(round(edge[0] * weight))
+    current[1] += int(round(edge[1] * weight))
+    current[2] += edge[2] * weight
+    current[3] += edge[3] * weight
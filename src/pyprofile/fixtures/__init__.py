@@ -1,14 +1,41 @@
+"""Capturing calls to replay them offline.
+
+``FixtureStore`` records the arguments of calls, e.g. of functions
+decorated with ``@profile(capture=...)`` or of requests sampled by the
+django middleware, and ``replay`` calls them again, timed, warmed up
+and optionally spread over several processes.
+"""
+
 import logging
+import os
+
+from .replay import ReplayResult, replay
+from .store import Fixture, FixtureStore, resolve
+
+__all__ = [
+    "Fixture",
+    "FixtureStore",
+    "ReplayResult",
+    "load_fixtures",
+    "replay",
+    "resolve",
+]
 
-logger = logging.getLogger("__name__")
+logger = logging.getLogger(__name__)
 
 
 def load_fixtures(fixtures: list, raw=False, file_type=None, *args, **kwargs):
+    """Contents of the ``fixtures`` files of extension ``file_type``,
+    concatenated in order, ``None`` when none matches.
+    """
     value = None
     if raw and file_type:
+        extension = "." + file_type.lstrip(".")
         for item in fixtures:
+            if os.path.splitext(str(item))[1] != extension:
+                continue
             with open(item, "r") as fd:
-                return fd.read()
+                value = fd.read() if value is None else value + fd.read()
     else:
         logger.info("Invalid raw file type.")
     return value
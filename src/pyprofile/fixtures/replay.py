@@ -0,0 +1,177 @@
+"""Replaying captured calls offline.
+
+Every fixture of a store is called ``warmup`` times untimed, then
+``iterations`` times timed, the durations going to a latency histogram
+per target. Fixtures can be spread over several processes, each one
+replaying its share, and the timed passes can run under a ``Profiler``
+to profile the replayed hot path.
+"""
+
+import logging
+import timeit
+
+from .store import FixtureStore, resolve
+
+__all__ = [
+    "ReplayResult",
+    "replay",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayResult(object):
+    """Durations and errors of a replay, per target.
+
+    :ivar histograms: ``{target: Histogram}`` of the timed calls
+    :ivar errors: ``{target: number of calls that raised}``
+    """
+
+    def __init__(self, histograms: dict = None, errors: dict = None):
+        self.histograms = histograms or {}
+        self.errors = errors or {}
+
+    def merge(self, other: "ReplayResult"):
+        for target, histogram in other.histograms.items():
+            if target in self.histograms:
+                self.histograms[target].merge(histogram)
+            else:
+                self.histograms[target] = histogram
+        for target, errors in other.errors.items():
+            self.errors[target] = self.errors.get(target, 0) + errors
+        return self
+
+    def summary(self) -> dict:
+        return {
+            target: {
+                "count": histogram.count,
+                "errors": self.errors.get(target, 0),
+                "total": histogram.total,
+                "p50": histogram.percentile(50),
+                "p99": histogram.percentile(99),
+                "max": histogram.max,
+            }
+            for target, histogram in sorted(self.histograms.items())
+        }
+
+
+def replay(
+    store,
+    target: str = None,
+    warmup: int = 1,
+    iterations: int = 10,
+    processes: int = 1,
+    unwrap: bool = True,
+    profile: dict = None,
+) -> ReplayResult:
+    """Replay the fixtures of ``store``.
+
+    :param store: ``FixtureStore`` or its directory
+    :param target: replay the calls of this target only
+    :type target: str
+    :param warmup: untimed passes over the fixtures
+    :type warmup: int
+    :param iterations: timed passes over the fixtures
+    :type iterations: int
+    :param processes: worker processes sharing the fixtures, the calling
+        process replays them all when ``1``
+    :type processes: int
+    :param unwrap: call decorated targets through ``__wrapped__``
+    :type unwrap: bool
+    :param profile: ``Profiler`` keyword arguments, to profile the timed
+        passes of each process
+    :type profile: dict
+    """
+    if not isinstance(store, FixtureStore):
+        store = FixtureStore(store)
+    fixtures = list(store.fixtures(target))
+    if processes <= 1 or len(fixtures) < 2:
+        return _replay(fixtures, warmup, iterations, unwrap, profile)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    processes = min(processes, len(fixtures))
+    result = ReplayResult()
+    with ProcessPoolExecutor(processes) as executor:
+        for snapshot in executor.map(
+            _replay_snapshot,
+            [fixtures[i::processes] for i in range(processes)],
+            [warmup] * processes,
+            [iterations] * processes,
+            [unwrap] * processes,
+            [profile] * processes,
+        ):
+            result.merge(_from_snapshot(snapshot))
+    return result
+
+
+def _replay(fixtures, warmup, iterations, unwrap, profile):
+    from ..histogram import HistogramRegistry
+
+    funcs = {}
+    registry = HistogramRegistry()
+    errors = {}
+    timer = timeit.default_timer
+    for _ in range(warmup):
+        for fixture in fixtures:
+            _call(fixture, funcs, unwrap, None)
+
+    def timed():
+        for _ in range(iterations):
+            for fixture in fixtures:
+                start = timer()
+                if not _call(fixture, funcs, unwrap, errors):
+                    continue
+                registry.record(fixture.target, timer() - start)
+
+    if profile is None:
+        timed()
+    else:
+        from ..profiler import Profiler
+
+        options = dict(profile)
+        with Profiler(options.pop("name", "replay"), **options):
+            timed()
+    return ReplayResult(
+        {name: registry.get(name) for name in registry.names()}, errors
+    )
+
+
+def _call(fixture, funcs, unwrap, errors):
+    try:
+        func = funcs.get(fixture.target)
+        if func is None:
+            # a target renamed since the capture counts as an error
+            func = funcs[fixture.target] = resolve(fixture.target, unwrap)
+        fixture(func)
+    except Exception:
+        logger.debug("Replayed %s raised", fixture.target, exc_info=True)
+        if errors is not None:
+            errors[fixture.target] = errors.get(fixture.target, 0) + 1
+        return False
+    return True
+
+
+def _replay_snapshot(fixtures, warmup, iterations, unwrap, profile):
+    # histograms travel between processes as snapshots
+    result = _replay(fixtures, warmup, iterations, unwrap, profile)
+    return (
+        {
+            target: histogram.snapshot()
+            for target, histogram in result.histograms.items()
+        },
+        result.errors,
+    )
+
+
+def _from_snapshot(snapshot):
+    from ..histogram import Histogram
+
+    histograms, errors = snapshot
+    return ReplayResult(
+        {
+            target: Histogram.from_snapshot(histogram)
+            for target, histogram in histograms.items()
+        },
+        errors,
+    )
@@ -0,0 +1,198 @@
+"""On-disk store of captured calls.
+
+Each process appends to its own segment file, so workers of one server
+can share a store directory without locking each other. A segment is
+a header followed by length-prefixed records, each one a compressed
+pickle of ``(target, args, kwargs, timestamp)``. A segment cut short
+by a crash loses its last record only.
+
+Records are unpickled when read: only replay stores you wrote.
+"""
+
+import atexit
+import importlib
+import logging
+import os
+import pickle
+import random
+import struct
+import threading
+import time
+import zlib
+
+__all__ = [
+    "Fixture",
+    "FixtureStore",
+    "resolve",
+]
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PYFX1\n"
+SEGMENT_SUFFIX = ".pyfx"
+
+_LENGTH = struct.Struct("<I")
+
+
+class Fixture(object):
+    """One captured call of ``target``, a ``"module:qualname"`` name.
+    """
+
+    __slots__ = ("target", "args", "kwargs", "timestamp")
+
+    def __init__(self, target, args, kwargs, timestamp):
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.timestamp = timestamp
+
+    def __call__(self, func=None):
+        """Call ``func``, by default the resolved target, with the
+        captured arguments.
+        """
+        if func is None:
+            func = resolve(self.target)
+        return func(*self.args, **self.kwargs)
+
+
+class FixtureStore(object):
+    """Directory of captured calls.
+
+    :param sample_rate: fraction of the calls recorded
+    :type sample_rate: float
+    :param max_records: records written per process, unbounded when
+        ``None``
+    :type max_records: int
+    :param compress_level: zlib level of the records
+    :type compress_level: int
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        max_records: int = None,
+        compress_level: int = 6,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_records = max_records
+        self.compress_level = compress_level
+        self.recorded = 0
+        self.skipped = 0
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def record(self, target: str, args=(), kwargs=None) -> bool:
+        """Append a call, returns ``False`` if it was not recorded.
+
+        Calls are left out by sampling, past ``max_records``, or when
+        their arguments cannot be pickled.
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.max_records is not None and self.recorded >= self.max_records:
+            return False
+        try:
+            payload = zlib.compress(
+                pickle.dumps(
+                    (target, tuple(args), dict(kwargs or {}), time.time()),
+                    pickle.HIGHEST_PROTOCOL,
+                ),
+                self.compress_level,
+            )
+        except Exception:
+            logger.debug("Cannot pickle a call of %s", target, exc_info=True)
+            self.skipped += 1
+            return False
+        with self._lock:
+            self._segment().write(_LENGTH.pack(len(payload)) + payload)
+            self.recorded += 1
+        return True
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def segments(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def fixtures(self, target: str = None):
+        """Iterate over the recorded calls, of ``target`` only if given.
+        """
+        self.flush()
+        for segment in self.segments():
+            with open(segment, "rb") as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    logger.warning("Not a fixture segment: %s", segment)
+                    continue
+                while True:
+                    header = f.read(_LENGTH.size)
+                    if len(header) < _LENGTH.size:
+                        break
+                    payload = f.read(_LENGTH.unpack(header)[0])
+                    try:
+                        fixture = Fixture(
+                            *pickle.loads(zlib.decompress(payload))
+                        )
+                    except Exception:
+                        # cut short by a crash, nothing follows
+                        logger.warning("Truncated fixture in %s", segment)
+                        break
+                    if target is None or fixture.target == target:
+                        yield fixture
+
+    __iter__ = fixtures
+
+    def targets(self) -> dict:
+        """``{target: number of recorded calls}``.
+        """
+        counts = {}
+        for fixture in self.fixtures():
+            counts[fixture.target] = counts.get(fixture.target, 0) + 1
+        return counts
+
+    def _segment(self):
+        pid = os.getpid()
+        if self._file is None or self._pid != pid:
+            # forked workers get a segment of their own; writes are
+            # unbuffered, a child has no parent data left to flush
+            os.makedirs(self.path, exist_ok=True)
+            path = os.path.join(
+                self.path, "calls_%d_%d%s" % (pid, time.time(), SEGMENT_SUFFIX)
+            )
+            self._file = open(path, "ab", buffering=0)
+            self._file.write(MAGIC)
+            self._pid = pid
+            atexit.register(self.close)
+        return self._file
+
+
+def resolve(target: str, unwrap: bool = True):
+    """Function named by a ``"module:qualname"`` target.
+
+    :param unwrap: follow ``__wrapped__``, so functions decorated with
+        ``@profile`` are called without being profiled on every call
+    :type unwrap: bool
+    """
+    module_name, _, qualname = target.partition(":")
+    func = importlib.import_module(module_name)
+    for attribute in qualname.split("."):
+        func = getattr(func, attribute)
+    while unwrap and hasattr(func, "__wrapped__"):
+        func = func.__wrapped__
+    return func
@@ -0,0 +1,301 @@
+"""Flame graphs rendered to self-contained SVG.
+
+Profiles are first turned into collapsed stacks, ``{"a;b;c": seconds}``,
+the input format of Brendan Gregg's ``flamegraph.pl``. Sampled profiles
+provide their stacks directly, deterministic ones are unfolded from the
+caller/callee graph, splitting each function's time between its callers
+in proportion to the edges.
+
+Frames narrower than ``min_width`` pixels are merged into their parent,
+which bounds the size of the SVG however many frames the profile has.
+Click a frame to zoom into it, click the title to reset.
+"""
+
+import html
+import os
+import zlib
+
+__all__ = [
+    "export_flamegraph",
+    "export_icicle",
+    "export_collapsed",
+    "frame_name",
+    "collapsed_from_stats",
+    "write_collapsed",
+    "render_svg",
+]
+
+FRAME_HEIGHT = 16
+FONT_SIZE = 12
+FONT_WIDTH = 0.59  # average glyph width per point of font size
+TITLE_HEIGHT = 32
+
+_SCRIPT = """
+var W = %(width)d, frames = document.querySelectorAll("g.f");
+function label(g) {
+  var r = g.querySelector("rect"), t = g.querySelector("text");
+  var w = +r.getAttribute("width"), n = g.querySelector("title")
+    .textContent.split("\\n")[0];
+  var fit = Math.floor((w - 6) / %(glyph)f);
+  t.setAttribute("x", +r.getAttribute("x") + 3);
+  t.textContent = fit < 3 ? "" : n.length > fit ? n.slice(0, fit - 2) + ".." : n;
+}
+function zoom(x0, w, d) {
+  for (var i = 0; i < frames.length; i++) {
+    var g = frames[i], r = g.querySelector("rect");
+    var gx = +g.dataset.x, gw = +g.dataset.w, gd = +g.dataset.d;
+    var inside = gx >= x0 - 1e-9 && gx + gw <= x0 + w + 1e-9;
+    var above = gd < d && gx <= x0 + 1e-9 && gx + gw >= x0 + w - 1e-9;
+    g.style.display = inside || above ? "" : "none";
+    if (above) { r.setAttribute("x", 0); r.setAttribute("width", W); }
+    else if (inside) {
+      r.setAttribute("x", (gx - x0) / w * W);
+      r.setAttribute("width", gw / w * W);
+    }
+    label(g);
+  }
+}
+for (var i = 0; i < frames.length; i++) {
+  frames[i].onclick = function () {
+    zoom(+this.dataset.x, +this.dataset.w, +this.dataset.d);
+  };
+}
+document.getElementById("reset").onclick = function () { zoom(0, 1, 0); };
+"""
+
+
+def export_flamegraph(stats, path, artifacts):
+    with open(path, "wt", encoding="UTF-8") as f:
+        render_svg(_collapsed(stats), f, title=_title(stats))
+
+
+def export_icicle(stats, path, artifacts):
+    with open(path, "wt", encoding="UTF-8") as f:
+        render_svg(_collapsed(stats), f, title=_title(stats), icicle=True)
+
+
+def export_collapsed(stats, path, artifacts):
+    with open(path, "wt", encoding="UTF-8") as f:
+        write_collapsed(_collapsed(stats), f)
+
+
+def frame_name(func: tuple) -> str:
+    """Frame label of a pstats ``(file, line, name)`` key.
+    """
+    filename, line, name = func
+    if line:
+        name = "%s (%s:%d)" % (name, os.path.basename(filename), line)
+    return name.replace(";", ":")
+
+
+def collapsed_from_stats(
+    stats: dict, min_fraction: float = 0.0005, max_depth: int = 256
+) -> dict:
+    """Unfold a raw pstats dict into collapsed stacks.
+
+    Recursive calls are folded into the first frame of their function
+    and branches worth less than ``min_fraction`` of the total time are
+    merged into their parent, which bounds the number of stacks.
+
+    :returns: ``{"root;...;leaf": seconds}``
+    """
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            if caller != func:
+                callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [
+        func
+        for func, stat in stats.items()
+        if not any(caller != func for caller in stat[4])
+    ]
+    if not roots and stats:
+        # everything sits in a cycle, start from the heaviest function
+        roots = [max(stats, key=lambda func: stats[func][3])]
+    total = sum(stat[2] for stat in stats.values())
+    min_time = total * min_fraction
+
+    collapsed = {}
+    pending = [
+        (root, stats[root][3], (root,), frame_name(root)) for root in roots
+    ]
+    while pending:
+        func, seconds, path, name = pending.pop()
+        ct = stats[func][3]
+        children = []
+        if len(path) < max_depth and ct:
+            for callee, edge_ct in callees.get(func, ()):
+                if callee not in path:
+                    children.append((callee, edge_ct * seconds / ct))
+        children_total = sum(child_time for _, child_time in children)
+        if children_total > seconds:
+            # recursion makes edges count time more than once
+            children = [
+                (callee, child_time * seconds / children_total)
+                for callee, child_time in children
+            ]
+        self_time = seconds
+        for callee, child_time in children:
+            if child_time < min_time:
+                continue
+            self_time -= child_time
+            pending.append(
+                (
+                    callee,
+                    child_time,
+                    path + (callee,),
+                    name + ";" + frame_name(callee),
+                )
+            )
+        if self_time > 0:
+            collapsed[name] = collapsed.get(name, 0.0) + self_time
+    return collapsed
+
+
+def write_collapsed(collapsed: dict, output):
+    """Write ``flamegraph.pl`` compatible lines, in microseconds.
+    """
+    for stack, seconds in sorted(collapsed.items()):
+        microseconds = int(round(seconds * 1e6))
+        if microseconds:
+            output.write("%s %d\n" % (stack, microseconds))
+
+
+def render_svg(
+    collapsed: dict,
+    output,
+    title: str = "Flame Graph",
+    width: int = 1200,
+    min_width: float = 0.5,
+    icicle: bool = False,
+):
+    """Write an interactive flame graph of ``collapsed`` stacks.
+
+    :param output: text file object
+    :param min_width: frames narrower than this many pixels are merged
+        into their parent
+    :type min_width: float
+    :param icicle: draw roots at the top, growing downwards
+    :type icicle: bool
+    """
+    root = _build_tree(collapsed)
+    total = root[0]
+    frames = _layout(root, total, width, min_width)
+    depth = max((frame[3] for frame in frames), default=0) + 1
+    height = depth * FRAME_HEIGHT + TITLE_HEIGHT + 8
+
+    write = output.write
+    write(
+        '<?xml version="1.0" standalone="no"?>\n'
+        '<svg version="1.1" width="%d" height="%d" '
+        'xmlns="http://www.w3.org/2000/svg" '
+        'font-family="Verdana, sans-serif" font-size="%d">\n'
+        % (width, height, FONT_SIZE)
+    )
+    write(
+        "<style>g.f:hover rect { stroke: #000; stroke-width: 0.5; }"
+        " g.f { cursor: pointer; }</style>\n"
+        '<rect width="100%%" height="100%%" fill="#f8f8f8"/>\n'
+        '<text id="reset" x="%d" y="20" text-anchor="middle" '
+        'font-size="16" style="cursor: pointer">%s</text>\n'
+        % (width // 2, html.escape(title))
+    )
+    for name, x, frame_width, frame_depth, seconds in frames:
+        if icicle:
+            y = TITLE_HEIGHT + frame_depth * FRAME_HEIGHT
+        else:
+            y = height - (frame_depth + 1) * FRAME_HEIGHT - 4
+        escaped = html.escape(name)
+        write(
+            '<g class="f" data-x="%.6f" data-w="%.6f" data-d="%d">'
+            "<title>%s\n%.6fs, %.2f%%</title>"
+            '<rect x="%.2f" y="%d" width="%.2f" height="%d" fill="%s" '
+            'rx="2"/><text x="%.2f" y="%d">%s</text></g>\n'
+            % (
+                x / width,
+                frame_width / width,
+                frame_depth,
+                escaped,
+                seconds,
+                100.0 * seconds / total if total else 0.0,
+                x,
+                y,
+                frame_width,
+                FRAME_HEIGHT - 1,
+                _color(name),
+                x + 3,
+                y + FRAME_HEIGHT - 4,
+                html.escape(_fit(name, frame_width)),
+            )
+        )
+    write(
+        "<script><![CDATA[%s]]></script>\n</svg>\n"
+        % (_SCRIPT % {"width": width, "glyph": FONT_SIZE * FONT_WIDTH})
+    )
+
+
+def _collapsed(stats):
+    # unfolded once per profile, shared by the flame graph exporters
+    if stats.stacks is None:
+        stats.stacks = collapsed_from_stats(stats.to_stats_dict())
+    return stats.stacks
+
+
+def _title(stats):
+    return stats.meta.get("label") or stats.meta.get("name", "")
+
+
+def _build_tree(collapsed):
+    # node: [seconds, {name: node}]
+    root = [0.0, {}]
+    for stack, seconds in collapsed.items():
+        if seconds <= 0:
+            continue
+        node = root
+        node[0] += seconds
+        for name in stack.split(";"):
+            child = node[1].get(name)
+            if child is None:
+                child = node[1][name] = [0.0, {}]
+            child[0] += seconds
+            node = child
+    return root
+
+
+def _layout(root, total, width, min_width):
+    """Positioned frames as ``(name, x, width, depth, seconds)``.
+    """
+    frames = []
+    if not total:
+        return frames
+    scale = width / total
+    pending = [(root[1], 0.0, 0)]
+    while pending:
+        children, x, depth = pending.pop()
+        for name in sorted(children):
+            seconds, grandchildren = children[name]
+            frame_width = seconds * scale
+            if frame_width >= min_width:
+                frames.append((name, x, frame_width, depth, seconds))
+                if grandchildren:
+                    pending.append((grandchildren, x, depth + 1))
+            x += frame_width
+    return frames
+
+
+def _fit(name, width):
+    fit = int((width - 6) / (FONT_SIZE * FONT_WIDTH))
+    if fit < 3:
+        return ""
+    if len(name) > fit:
+        return name[: fit - 2] + ".."
+    return name
+
+
+def _color(name):
+    # stable warm colors, like flamegraph.pl's "hot" palette
+    value = zlib.crc32(name.encode("utf-8"))
+    red = 205 + value % 50
+    green = (value >> 8) % 230
+    blue = (value >> 16) % 55
+    return "rgb(%d,%d,%d)" % (red, green, blue)
@@ -0,0 +1,146 @@
+"""Garbage collector pauses within profiled blocks.
+
+cProfile charges a collection to whatever function happened to
+allocate when it triggered, so GC pauses are hard to tell apart in a
+profile. ``GCMonitor`` records the generation, duration and yield of
+every collection that runs while it is started, through
+``gc.callbacks``, along with the ``gc.get_stats()`` deltas of the
+window.
+
+A single callback serves every running monitor and is only registered
+while at least one runs, so blocks without a collection pay nothing
+but the start and stop bookkeeping. Collections are process wide: one
+triggered by another thread is recorded by every monitor running
+meanwhile.
+"""
+
+import gc
+import threading
+import timeit
+
+__all__ = [
+    "GCMonitor",
+    "GCStats",
+]
+
+_monitors = ()
+_lock = threading.Lock()
+_collection_start = None
+
+
+def _callback(phase, info):
+    global _collection_start
+    if phase == "start":
+        _collection_start = timeit.default_timer()
+        return
+    if _collection_start is None:
+        # registered in the middle of a collection
+        return
+    duration = timeit.default_timer() - _collection_start
+    _collection_start = None
+    for monitor in _monitors:
+        monitor._record(
+            info["generation"],
+            duration,
+            info["collected"],
+            info["uncollectable"],
+        )
+
+
+class GCStats(object):
+    """Collections seen by a ``GCMonitor``, picklable for the publishers.
+
+    ``collections`` are ``(generation, seconds, collected,
+    uncollectable)`` tuples in the order they ran, the first
+    ``max_collections`` of the window only; the counters cover them
+    all. ``generations`` holds the ``gc.get_stats()`` deltas of the
+    window, one ``{"collections", "collected", "uncollectable"}`` dict
+    per generation.
+    """
+
+    def __init__(
+        self,
+        collections: list,
+        count: int,
+        pause: float,
+        max_pause: float,
+        generations: list,
+    ):
+        self.collections = collections
+        self.count = count
+        self.pause = pause
+        self.max_pause = max_pause
+        self.generations = generations
+
+    def summary(self) -> dict:
+        return {
+            "collections": self.count,
+            "pause_seconds": self.pause,
+            "max_pause_seconds": self.max_pause,
+            "generations": self.generations,
+        }
+
+
+class GCMonitor(object):
+    """Collections and ``gc.get_stats()`` deltas between ``start`` and
+    ``stop``.
+
+    :param max_collections: collections kept one by one, the later ones
+        are only counted
+    :type max_collections: int
+    """
+
+    def __init__(self, max_collections: int = 1000):
+        self.max_collections = max_collections
+        self.stats: GCStats = None
+        self._collections = []
+        self._count = 0
+        self._pause = 0.0
+        self._max_pause = 0.0
+        self._start_stats = None
+
+    def start(self):
+        global _monitors
+        self._collections = []
+        self._count = 0
+        self._pause = 0.0
+        self._max_pause = 0.0
+        self._start_stats = gc.get_stats()
+        with _lock:
+            if not _monitors:
+                gc.callbacks.append(_callback)
+            _monitors = _monitors + (self,)
+        return self
+
+    def stop(self) -> GCStats:
+        global _monitors
+        with _lock:
+            _monitors = tuple(
+                monitor for monitor in _monitors if monitor is not self
+            )
+            if not _monitors and _callback in gc.callbacks:
+                gc.callbacks.remove(_callback)
+        self.stats = GCStats(
+            self._collections,
+            self._count,
+            self._pause,
+            self._max_pause,
+            [
+                {
+                    key: end[key] - start[key]
+                    for key in ("collections", "collected", "uncollectable")
+                }
+                for start, end in zip(self._start_stats, gc.get_stats())
+            ],
+        )
+        return self.stats
+
+    def _record(self, generation, seconds, collected, uncollectable):
+        self._count += 1
+        self._pause += seconds
+        if seconds > self._max_pause:
+            self._max_pause = seconds
+        if len(self._collections) < self.max_collections:
+            self._collections.append(
+                (generation, seconds, collected, uncollectable)
+            )
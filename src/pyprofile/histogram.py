@@ -0,0 +1,367 @@
+"""Compact latency histograms keyed by profiler name.
+
+Durations are counted in log-linear buckets over integer microseconds,
+HDR histogram style: values below ``2 ** sub_bucket_bits`` get a bucket
+each, larger ones keep ``sub_bucket_bits - 1`` bits of precision, so
+every recorded value is off by less than 1/64 with the default 7 bits.
+
+Each thread increments its own array of counters, so recording takes
+no lock; readers sum the arrays. Snapshots fold the arrays of threads
+that exited into one, so short lived threads do not pile up. An array
+holds 1708 counters of 8 bytes with the default precision and range,
+so every name costs about 14 KB per recording thread.
+
+A registry keeps at most ``max_names`` histograms, 100 by default, or
+about 1.4 MB per recording thread; names past it are counted in the
+``<other>`` histogram: name them after routes or code blocks, not after
+unbounded values such as URLs with ids.
+"""
+
+import array
+import atexit
+import logging
+import threading
+import time
+
+__all__ = [
+    "Histogram",
+    "HistogramRegistry",
+    "SnapshotExporter",
+    "registry",
+    "record",
+]
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PERCENTILES = (50, 90, 99, 99.9)
+
+OTHER = "<other>"
+
+
+class Histogram(object):
+    """Latency histogram of one name.
+
+    :param sub_bucket_bits: precision of the buckets
+    :type sub_bucket_bits: int
+    :param max_seconds: larger durations are counted as this
+    :type max_seconds: float
+    """
+
+    def __init__(
+        self, name: str, sub_bucket_bits: int = 7, max_seconds: float = 3600.0
+    ):
+        self.name = name
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value = int(max_seconds * 1e6)
+        self.size = self._index(self.max_value) + 1
+        self._shards = {}
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Count one duration, in seconds.
+        """
+        value = min(max(int(seconds * 1e6), 0), self.max_value)
+        shard = self._shards.get(threading.get_ident())
+        if shard is None:
+            shard = self._new_shard()
+        counts, totals = shard
+        counts[self._index(value)] += 1
+        totals[0] += value
+        if value > totals[1]:
+            totals[1] = value
+
+    def counts(self) -> array.array:
+        """Bucket counts summed over every thread.
+        """
+        merged = array.array("q", bytes(8 * self.size))
+        for counts, _ in list(self._shards.values()):
+            for index, count in enumerate(counts):
+                if count:
+                    merged[index] += count
+        return merged
+
+    @property
+    def count(self) -> int:
+        return sum(sum(counts) for counts, _ in list(self._shards.values()))
+
+    @property
+    def total(self) -> float:
+        """Sum of the recorded durations, in seconds.
+        """
+        return (
+            sum(totals[0] for _, totals in list(self._shards.values())) / 1e6
+        )
+
+    @property
+    def max(self) -> float:
+        return (
+            max(
+                (totals[1] for _, totals in list(self._shards.values())),
+                default=0,
+            )
+            / 1e6
+        )
+
+    def percentile(self, percent: float) -> float:
+        return self.percentiles(percent)[0]
+
+    def percentiles(self, *percents) -> list:
+        """Durations below which ``percents`` of the records fall, in
+        seconds, in a single pass over the buckets.
+        """
+        counts = self.counts()
+        total = sum(counts)
+        results = [0.0] * len(percents)
+        if not total:
+            return results
+        wanted = sorted(
+            (max(percent / 100.0 * total, 1), i)
+            for i, percent in enumerate(percents)
+        )
+        seen = 0
+        next_wanted = 0
+        for index, count in enumerate(counts):
+            if not count:
+                continue
+            seen += count
+            while next_wanted < len(wanted) and seen >= wanted[next_wanted][0]:
+                results[wanted[next_wanted][1]] = self._value(index) / 1e6
+                next_wanted += 1
+            if next_wanted == len(wanted):
+                break
+        return results
+
+    def merge(self, other: "Histogram"):
+        """Add the records of ``other``, which must use the same buckets.
+        """
+        if (other.sub_bucket_bits, other.size) != (
+            self.sub_bucket_bits,
+            self.size,
+        ):
+            raise ValueError("Cannot merge histograms of different layouts")
+        self._merge_counts(
+            other.counts(), int(other.total * 1e6), int(other.max * 1e6)
+        )
+        return self
+
+    def reset(self):
+        with self._lock:
+            self._shards = {}
+
+    def prune(self):
+        """Fold the counters of threads that exited, and of merged
+        histograms, into a single array.
+        """
+        live = {thread.ident for thread in threading.enumerate()}
+        with self._lock:
+            stale = [key for key in self._shards if key not in live]
+            if len(stale) < 2:
+                return
+            counts = array.array("q", bytes(8 * self.size))
+            totals = array.array("q", [0, 0])
+            for key in stale:
+                shard_counts, shard_totals = self._shards.pop(key)
+                for index, count in enumerate(shard_counts):
+                    if count:
+                        counts[index] += count
+                totals[0] += shard_totals[0]
+                totals[1] = max(totals[1], shard_totals[1])
+            self._shards[object()] = (counts, totals)
+
+    def snapshot(self) -> dict:
+        """Summary and sparse buckets, restored by ``from_snapshot``.
+        """
+        self.prune()
+        counts = self.counts()
+        percentiles = self.percentiles(*SNAPSHOT_PERCENTILES)
+        return {
+            "name": self.name,
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "max_seconds": self.max_value / 1e6,
+            "count": sum(counts),
+            "total": self.total,
+            "max": self.max,
+            "percentiles": {
+                str(percent): value
+                for percent, value in zip(SNAPSHOT_PERCENTILES, percentiles)
+            },
+            "buckets": {
+                str(index): count
+                for index, count in enumerate(counts)
+                if count
+            },
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot: dict) -> "Histogram":
+        histogram = cls(
+            snapshot["name"],
+            snapshot["sub_bucket_bits"],
+            snapshot["max_seconds"],
+        )
+        counts = array.array("q", bytes(8 * histogram.size))
+        for index, count in snapshot["buckets"].items():
+            counts[int(index)] = count
+        histogram._merge_counts(
+            counts, int(snapshot["total"] * 1e6), int(snapshot["max"] * 1e6)
+        )
+        return histogram
+
+    def _index(self, value):
+        bits = self.sub_bucket_bits
+        if value < 1 << bits:
+            return value
+        shift = value.bit_length() - bits
+        return (shift << (bits - 1)) + (value >> shift)
+
+    def _value(self, index):
+        # middle of the bucket's range
+        bits = self.sub_bucket_bits
+        if index < 1 << bits:
+            return index
+        shift = (index >> (bits - 1)) - 1
+        mantissa = index - (shift << (bits - 1))
+        return (mantissa << shift) + (1 << shift) // 2
+
+    def _new_shard(self):
+        shard = (
+            array.array("q", bytes(8 * self.size)),
+            array.array("q", [0, 0]),
+        )
+        with self._lock:
+            self._shards[threading.get_ident()] = shard
+        return shard
+
+    def _merge_counts(self, counts, total, max_value):
+        # merged records get a shard of their own, never written by a thread
+        shard = (counts, array.array("q", [total, max_value]))
+        with self._lock:
+            self._shards[object()] = shard
+
+
+class HistogramRegistry(object):
+    """Process-wide histograms, created on first use of a name.
+
+    :param max_names: histograms kept, the records of further names go
+        to the ``<other>`` histogram. Each one takes about 14 KB per
+        thread recording to it
+    :type max_names: int
+    """
+
+    def __init__(self, max_names: int = 100, **options):
+        self.max_names = max_names
+        self.options = options
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Histogram:
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    if len(self._histograms) >= self.max_names:
+                        name = OTHER
+                        histogram = self._histograms.get(name)
+                    if histogram is None:
+                        histogram = self._histograms[name] = Histogram(
+                            name, **self.options
+                        )
+        return histogram
+
+    def record(self, name: str, seconds: float):
+        self.get(name).record(seconds)
+
+    def names(self) -> list:
+        return sorted(self._histograms)
+
+    def snapshot(self, reset: bool = False) -> dict:
+        """``{name: Histogram.snapshot()}`` of every histogram.
+
+        :param reset: start every histogram over, e.g. per export period
+        :type reset: bool
+        """
+        snapshots = {}
+        for name in self.names():
+            histogram = self._histograms[name]
+            snapshots[name] = histogram.snapshot()
+            if reset:
+                histogram.reset()
+        return snapshots
+
+
+registry = HistogramRegistry()
+
+
+def record(name: str, seconds: float):
+    """Count a duration in the histogram of ``name`` of the process.
+    """
+    registry.record(name, seconds)
+
+
+class SnapshotExporter(object):
+    """Periodically exports the snapshots of a registry.
+
+    Each export is one JSON line appended to ``path``, and/or a call of
+    ``callback`` with the snapshots. A last export runs at process exit.
+
+    :param interval: seconds between exports
+    :type interval: float
+    :param reset: start histograms over after each export, so every
+        snapshot covers one period
+    :type reset: bool
+    """
+
+    def __init__(
+        self,
+        registry: HistogramRegistry = registry,
+        interval: float = 60.0,
+        path: str = None,
+        callback=None,
+        reset: bool = True,
+    ):
+        self.registry = registry
+        self.interval = interval
+        self.path = path
+        self.callback = callback
+        self.reset = reset
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="pyprofile-histograms", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        if self._thread is not None and not self._stopped.is_set():
+            self._stopped.set()
+            self._thread.join()
+            self.export()
+
+    def export(self) -> dict:
+        import json
+
+        snapshots = self.registry.snapshot(reset=self.reset)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(
+                    json.dumps(
+                        {"timestamp": time.time(), "histograms": snapshots}
+                    )
+                    + "\n"
+                )
+        if self.callback is not None:
+            self.callback(snapshots)
+        return snapshots
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.export()
+            except Exception:
+                logger.exception("Failed to export histograms")
@@ -0,0 +1,224 @@
+"""Memory profiling with ``tracemalloc``.
+
+``MemoryProfiler`` snapshots traced allocations when a profile starts
+and stops and reports the allocation sites that grew the most, the net
+growth and the peak reached in between.
+
+Tracing costs grow with the number of frames kept per allocation, so
+the default keeps one; filters drop allocations before they are
+compared. ``tracemalloc`` is process wide: allocations of every thread
+and task running meanwhile are reported, and a profile started while
+something else traces keeps the traceback depth already in use.
+Profiles share the trace: the first to start begins it unless it was
+already running, and the last to stop ends it. The traced peak is
+process wide too, and only the first profile resets it: a profile
+overlapping another reports the peak reached since the earliest of
+them started.
+"""
+
+import csv
+import os
+import threading
+import tracemalloc
+
+__all__ = [
+    "MemoryProfiler",
+    "MemoryStats",
+    "export_memory",
+]
+
+CSV_HEADER = (
+    "size_diff",
+    "count_diff",
+    "size",
+    "count",
+    "filename",
+    "lineno",
+    "traceback",
+)
+
+KEY_TYPES = ("lineno", "filename", "traceback")
+
+DEFAULT_EXCLUDE = (
+    tracemalloc.__file__,
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    "<unknown>",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "*"),
+)
+
+_lock = threading.Lock()
+_running = 0
+_started_tracing = False
+
+
+def _acquire(frames):
+    # whether the trace starts now, with nothing traced before it
+    global _running, _started_tracing
+    with _lock:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+            _started_tracing = True
+        elif not _running and hasattr(tracemalloc, "reset_peak"):
+            # Python 3.9+, the peak covers the whole trace before that
+            tracemalloc.reset_peak()
+        _running += 1
+        return started
+
+
+def _release():
+    global _running, _started_tracing
+    with _lock:
+        _running -= 1
+        if not _running and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class MemoryStats(object):
+    """Result of a ``MemoryProfiler``, picklable for the publishers.
+
+    ``rows`` are ``(size_diff, count_diff, size, count, filename,
+    lineno, traceback)`` tuples, largest growth first; ``traceback`` is
+    a ``;`` separated list of ``file:line`` frames, outermost first.
+    Sizes are in bytes.
+    """
+
+    def __init__(
+        self, rows: list, start: int, end: int, peak: int, frames: int
+    ):
+        self.rows = rows
+        self.start = start
+        self.end = end
+        self.peak = peak
+        self.frames = frames
+
+    @property
+    def net(self) -> int:
+        """Growth of the traced memory between start and stop.
+        """
+        return self.end - self.start
+
+    def summary(self) -> dict:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "net": self.net,
+            "peak": self.peak,
+            "frames": self.frames,
+        }
+
+    def to_csv(self, fp) -> None:
+        writer = csv.writer(fp, lineterminator="\n")
+        writer.writerow(CSV_HEADER)
+        writer.writerows(self.rows)
+
+
+class MemoryProfiler(object):
+    """Top allocation sites, growth and peak between ``start`` and
+    ``stop``.
+
+    :param frames: frames kept per allocation
+    :type frames: int
+    :param top: number of allocation sites reported
+    :type top: int
+    :param key_type: group allocations by ``"lineno"``, ``"filename"``
+        or ``"traceback"``
+    :type key_type: str
+    :param include: filename patterns to keep, all when empty
+    :type include: list
+    :param exclude: filename patterns to drop, on top of tracemalloc,
+        import machinery and pyprofile itself
+    :type exclude: list
+    """
+
+    def __init__(
+        self,
+        frames: int = 1,
+        top: int = 50,
+        key_type: str = "lineno",
+        include=(),
+        exclude=(),
+    ):
+        if key_type not in KEY_TYPES:
+            raise ValueError("Unsupported memory key type: %s" % key_type)
+        self.frames = frames
+        self.top = top
+        self.key_type = key_type
+        self.filters = [
+            tracemalloc.Filter(True, pattern) for pattern in include
+        ] + [
+            tracemalloc.Filter(False, pattern)
+            for pattern in tuple(exclude) + DEFAULT_EXCLUDE
+        ]
+        self.stats: MemoryStats = None
+        self._start_snapshot = None
+        self._start_size = 0
+
+    def start(self):
+        if _acquire(self.frames):
+            # nothing traced yet, there is no start snapshot to compare to
+            self._start_snapshot = None
+        else:
+            self._start_snapshot = self._snapshot()
+        self._start_size = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def stop(self) -> MemoryStats:
+        end_size, peak = tracemalloc.get_traced_memory()
+        snapshot = self._snapshot()
+        frames = tracemalloc.get_traceback_limit()
+        _release()
+        if self._start_snapshot is None:
+            rows = [
+                _row(stat.size, stat.count, stat.size, stat.count, stat)
+                for stat in snapshot.statistics(self.key_type)
+            ]
+        else:
+            rows = [
+                _row(
+                    stat.size_diff,
+                    stat.count_diff,
+                    stat.size,
+                    stat.count,
+                    stat,
+                )
+                for stat in snapshot.compare_to(
+                    self._start_snapshot, self.key_type
+                )
+            ]
+        self._start_snapshot = None
+        self.stats = MemoryStats(
+            rows[: self.top], self._start_size, end_size, peak, frames
+        )
+        return self.stats
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self.filters)
+
+
+def export_memory(stats, path, artifacts):
+    """Exporter of the ``memory`` format, a no-op without memory stats.
+    """
+    if stats.memory is None:
+        return
+    with open(path, "w", newline="") as f:
+        stats.memory.to_csv(f)
+
+
+def _row(size_diff, count_diff, size, count, stat):
+    # frames are sorted from the oldest to the allocation site
+    site = stat.traceback[-1]
+    traceback = ";".join(
+        "%s:%d" % (frame.filename, frame.lineno) for frame in stat.traceback
+    )
+    return (
+        size_diff,
+        count_diff,
+        size,
+        count,
+        site.filename,
+        site.lineno,
+        traceback,
+    )
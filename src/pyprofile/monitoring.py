@@ -0,0 +1,377 @@
+"""Deterministic profiler built on ``sys.monitoring`` (PEP 669).
+
+cProfile before Python 3.12 hooks ``setprofile`` and sees every call,
+return and C call. ``MonitoringProfiler`` only registers the Python
+start, resume, return, yield and unwind events, and past ``max_calls``
+calls of a function it returns ``DISABLE`` so the interpreter stops
+reporting that function at all: hot helpers cost nothing once enough
+of their calls were timed. Later calls of a retired function count in
+the own time of their caller.
+
+Line events can be enabled for a few named functions, timing each of
+their lines, callees included, like ``line_profiler``.
+
+Calls of C functions are not reported, their time counts in their
+caller's own time, like the time of functions left out by a
+``ModuleFilter``, whose events are disabled on their first call.
+
+Disabled events stay disabled once the tool id is freed. The next
+profile enabling the same id turns them back on, for the functions
+pyprofile retired only: ``sys.monitoring.restart_events()`` would also
+undo what other tools disabled.
+"""
+
+import csv
+import sys
+import threading
+import timeit
+import weakref
+
+from .stats import merge_stats_dicts
+
+__all__ = [
+    "MonitoringProfiler",
+    "available",
+    "export_lines",
+]
+
+LINES_HEADER = ("filename", "function", "lineno", "hits", "seconds")
+
+# candidates, in order of preference; the others are reserved for
+# debuggers, coverage, profilers such as cProfile and optimizers
+TOOL_IDS = (3, 4)
+TOOL_NAME = "pyprofile"
+
+# {tool id: code objects whose events a profile disabled}
+_retired_codes = {}
+
+
+def available() -> bool:
+    """Whether ``sys.monitoring`` exists and has a tool id to spare.
+    """
+    monitoring = getattr(sys, "monitoring", None)
+    return monitoring is not None and any(
+        monitoring.get_tool(tool_id) is None for tool_id in TOOL_IDS
+    )
+
+
+class _ThreadState(object):
+    __slots__ = ("stack", "depths", "stats", "lines")
+
+    def __init__(self):
+        # [code, start, time of callees, current line, line start]
+        self.stack = []
+        self.depths = {}
+        # {code: [cc, nc, tt, ct, {caller code: [nc, cc, tt, ct]}]}
+        self.stats = {}
+        # {code: {lineno: [hits, seconds]}}
+        self.lines = {}
+
+
+class MonitoringProfiler(object):
+    """cProfile compatible collector on ``sys.monitoring`` events.
+
+    :param max_calls: calls timed per function before its events are
+        disabled, every call when ``0``; timing every call costs more
+        than cProfile, callbacks being Python functions
+    :type max_calls: int
+    :param lines: functions to time line by line, as function objects
+        or qualified names such as ``"Model.save"``
+    :type lines: list
+    :param threads: record every thread instead of the enabling one
+    :type threads: bool
+    :param filter: events of the code objects it rejects are disabled
+        on their first call
+    :type filter: pyprofile.filters.ModuleFilter
+    """
+
+    def __init__(
+        self,
+        max_calls: int = 1000,
+        lines=(),
+        threads: bool = False,
+        filter=None,
+    ):
+        if not hasattr(sys, "monitoring"):
+            raise RuntimeError("sys.monitoring requires Python 3.12+")
+        self.max_calls = max_calls
+        self.threads = threads
+        self.filter = filter
+        self.line_codes = set()
+        self.line_names = set()
+        for func in lines:
+            if isinstance(func, str):
+                self.line_names.add(func)
+            else:
+                self.line_codes.add(getattr(func, "__code__", func))
+        self.stats = {}
+        self.thread_stats = {}
+        self.thread_names = {}
+        self.line_stats = {}
+        self._states = {}
+        self._calls = {}
+        self._retired = set()
+        self._seen = set()
+        self._tool_id = None
+        self._thread_id = None
+        self._paused = False
+
+    def enable(self):
+        if self._tool_id is not None:
+            return
+        monitoring = sys.monitoring
+        for tool_id in TOOL_IDS:
+            if monitoring.get_tool(tool_id) is None:
+                break
+        else:
+            raise RuntimeError("No sys.monitoring tool id available")
+        monitoring.use_tool_id(tool_id, TOOL_NAME)
+        self._tool_id = tool_id
+        self._thread_id = threading.get_ident()
+        self._state(self._thread_id)
+        for event, callback in self._callbacks():
+            monitoring.register_callback(tool_id, event, callback)
+        # local events instrument a code object anew, bringing back the
+        # events a previous session disabled
+        events = monitoring.events
+        local = (
+            events.PY_START
+            | events.PY_RESUME
+            | events.PY_RETURN
+            | events.PY_YIELD
+        )
+        for code in _retired_codes.pop(tool_id, ()):
+            monitoring.set_local_events(tool_id, code, local)
+            monitoring.set_local_events(tool_id, code, 0)
+        for code in self.line_codes:
+            monitoring.set_local_events(tool_id, code, monitoring.events.LINE)
+        self._paused = False
+        monitoring.set_events(tool_id, self._events())
+
+    def disable(self):
+        if self._tool_id is None:
+            return
+        monitoring = sys.monitoring
+        monitoring.set_events(self._tool_id, 0)
+        for code in self.line_codes:
+            monitoring.set_local_events(self._tool_id, code, 0)
+        for event, _ in self._callbacks():
+            monitoring.register_callback(self._tool_id, event, None)
+        if self._retired:
+            _retired_codes.setdefault(self._tool_id, weakref.WeakSet()).update(
+                self._retired
+            )
+        monitoring.free_tool_id(self._tool_id)
+        self._tool_id = None
+        self._flush()
+
+    def pause(self):
+        """Stop recording without giving the tool id back.
+
+        Cheaper than ``disable`` when toggled often, e.g. around every
+        step of a coroutine. Calls still running are accounted as if
+        they returned now, like cProfile does when disabled.
+        """
+        if self._tool_id is not None and not self._paused:
+            sys.monitoring.set_events(self._tool_id, 0)
+            self._paused = True
+            self._flush()
+
+    def resume(self):
+        if self._tool_id is None:
+            self.enable()
+        elif self._paused:
+            self._paused = False
+            sys.monitoring.set_events(self._tool_id, self._events())
+
+    def runcall(self, func, *args, **kwargs):
+        self.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.disable()
+
+    def create_stats(self):
+        """Build the pstats compatible ``stats`` dict, per-thread ones
+        in ``thread_stats`` and line timings in ``line_stats``.
+        """
+        self.disable()
+        self.stats = {}
+        self.thread_stats = {}
+        self.line_stats = {}
+        for thread_id, state in self._states.items():
+            stats = _stats_dict(state.stats)
+            self.thread_stats[thread_id] = stats
+            merge_stats_dicts(self.stats, stats)
+            for code, lines in state.lines.items():
+                timings = self.line_stats.setdefault(_code_key(code), {})
+                for lineno, (hits, seconds) in lines.items():
+                    timing = timings.get(lineno, (0, 0.0))
+                    timings[lineno] = (timing[0] + hits, timing[1] + seconds)
+
+    def _callbacks(self):
+        events = sys.monitoring.events
+        return (
+            (events.PY_START, self._on_start),
+            (events.PY_RESUME, self._on_start),
+            (events.PY_THROW, self._on_throw),
+            (events.PY_RETURN, self._on_return),
+            (events.PY_YIELD, self._on_return),
+            (events.PY_UNWIND, self._on_unwind),
+            (events.LINE, self._on_line),
+        )
+
+    def _events(self):
+        # LINE is only enabled locally, on the functions timed by line
+        events = 0
+        for event, _ in self._callbacks():
+            if event != sys.monitoring.events.LINE:
+                events |= event
+        return events
+
+    def _state(self, thread_id):
+        state = self._states.get(thread_id)
+        if state is None and (self.threads or thread_id == self._thread_id):
+            state = self._states[thread_id] = _ThreadState()
+            self.thread_names[thread_id] = threading.current_thread().name
+        return state
+
+    def _on_start(self, code, offset):
+        thread_id = threading.get_ident()
+        state = self._states.get(thread_id) or self._state(thread_id)
+        if state is None:
+            return
+        if (
+            self.filter is not None
+            and not self.filter.code(code)
+            and code not in self.line_codes
+        ):
+            self._retired.add(code)
+            return sys.monitoring.DISABLE
+        state.stack.append([code, timeit.default_timer(), 0.0, 0, 0.0])
+        depths = state.depths
+        depths[code] = depths.get(code, 0) + 1
+        if self.line_names and code not in self._seen:
+            self._seen.add(code)
+            if (
+                code.co_qualname in self.line_names
+                or code.co_name in self.line_names
+            ):
+                self.line_codes.add(code)
+                sys.monitoring.set_local_events(
+                    self._tool_id, code, sys.monitoring.events.LINE
+                )
+        if self.max_calls:
+            calls = self._calls[code] = self._calls.get(code, 0) + 1
+            if calls >= self.max_calls and code not in self.line_codes:
+                self._retired.add(code)
+                return sys.monitoring.DISABLE
+
+    def _on_throw(self, code, offset, exception):
+        # PY_THROW cannot be disabled, unlike the PY_RESUME it stands for
+        self._on_start(code, offset)
+
+    def _on_return(self, code, offset, value):
+        state = self._states.get(threading.get_ident())
+        if state is None:
+            return
+        if state.stack and state.stack[-1][0] is code:
+            self._exit(state, timeit.default_timer())
+        if code in self._retired and not state.depths.get(code):
+            return sys.monitoring.DISABLE
+
+    def _on_unwind(self, code, offset, exception):
+        state = self._states.get(threading.get_ident())
+        if state is not None and state.stack and state.stack[-1][0] is code:
+            self._exit(state, timeit.default_timer())
+
+    def _on_line(self, code, lineno):
+        state = self._states.get(threading.get_ident())
+        if state is None or not state.stack or state.stack[-1][0] is not code:
+            return
+        now = timeit.default_timer()
+        entry = state.stack[-1]
+        lines = state.lines.get(code)
+        if lines is None:
+            lines = state.lines[code] = {}
+        if entry[3]:
+            lines[entry[3]][1] += now - entry[4]
+        timing = lines.get(lineno)
+        if timing is None:
+            timing = lines[lineno] = [0, 0.0]
+        timing[0] += 1
+        entry[3] = lineno
+        entry[4] = now
+
+    def _exit(self, state, now):
+        code, start, callees, lineno, line_start = state.stack.pop()
+        elapsed = now - start
+        if lineno:
+            state.lines[code][lineno][1] += now - line_start
+        depth = state.depths[code] = state.depths[code] - 1
+        stats = state.stats.get(code)
+        if stats is None:
+            stats = state.stats[code] = [0, 0, 0.0, 0.0, {}]
+        stats[1] += 1
+        stats[2] += elapsed - callees
+        if not depth:
+            stats[0] += 1
+            stats[3] += elapsed
+        if state.stack:
+            caller = state.stack[-1]
+            caller[2] += elapsed
+            edge = stats[4].get(caller[0])
+            if edge is None:
+                edge = stats[4][caller[0]] = [0, 0, 0.0, 0.0]
+            edge[0] += 1
+            edge[2] += elapsed - callees
+            if not depth:
+                edge[1] += 1
+                edge[3] += elapsed
+
+    def _flush(self):
+        now = timeit.default_timer()
+        for state in self._states.values():
+            while state.stack:
+                self._exit(state, now)
+
+
+def export_lines(stats, path, artifacts):
+    """Exporter of the ``lines`` format, a no-op without line timings.
+    """
+    if not stats.line_stats:
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(LINES_HEADER)
+        for (filename, _, function), timings in sorted(
+            stats.line_stats.items()
+        ):
+            for lineno, (hits, seconds) in sorted(timings.items()):
+                writer.writerow((filename, function, lineno, hits, seconds))
+
+
+def _stats_dict(stats):
+    # code objects to pstats keys, merging codes that share one
+    merged = {}
+    for code, (cc, nc, tt, ct, callers) in stats.items():
+        merge_stats_dicts(
+            merged,
+            {
+                _code_key(code): (
+                    cc,
+                    nc,
+                    tt,
+                    ct,
+                    {
+                        _code_key(caller): tuple(edge)
+                        for caller, edge in callers.items()
+                    },
+                )
+            },
+        )
+    return merged
+
+
+def _code_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
@@ -1,20 +1,14 @@
 """Simple cProfile based python profiler.
 """
 
-import cProfile
 import functools
-import inspect
-import pstats
-from datetime import datetime
+import os
+import time
+import timeit
+import types
 from io import StringIO
 
-from gprof2dot import (
-    TEMPERATURE_COLORMAP,
-    TIME_RATIO,
-    TOTAL_TIME_RATIO,
-    DotWriter,
-    PstatsParser,
-)
+from .coroutines import iscoroutinefunction, run_stepped
 
 __all__ = [
     "profile",
@@ -22,21 +16,193 @@ __all__ = [
 ]
 
 
+# Engines, and everything only needed once profiling runs, are imported
+# on first use so that importing and decorating stay cheap. They return
+# the name of the engine they picked, and its collector.
+def _cprofile_engine(threads=False, **options):
+    # cProfile cannot skip calls, filters are applied when it stops
+    if threads:
+        from .threads import ThreadedProfile
+
+        return "cprofile", ThreadedProfile()
+    import cProfile
+
+    return "cprofile", cProfile.Profile()
+
+
+def _sampling_engine(**options):
+    from .sampling import SamplingProfiler
+
+    return (
+        "sampling",
+        SamplingProfiler(
+            interval=options.get("interval", 0.005),
+            mode=options.get("sampling_mode", "thread"),
+            threads=options.get("threads", False),
+            filter=options.get("filter"),
+        ),
+    )
+
+
+def _monitoring_engine(threads=False, **options):
+    from .monitoring import MonitoringProfiler, available
+
+    if not available():
+        # Python < 3.12, or every tool id taken
+        return _cprofile_engine(threads=threads)
+    return (
+        "monitoring",
+        MonitoringProfiler(
+            max_calls=options.get("max_calls", 1000),
+            lines=options.get("lines", ()),
+            threads=threads,
+            filter=options.get("filter"),
+        ),
+    )
+
+
+ENGINES = {
+    "cprofile": _cprofile_engine,
+    "sampling": _sampling_engine,
+    "monitoring": _monitoring_engine,
+}
+
+
 def profile(*fn, **options):
     """Profiler as a decorator.
+
+    Accepts the same keyword arguments as ``Profiler``, e.g.
+    ``@profile(engine="sampling", interval=0.001)``.
+
+    ``aggregate=True`` merges the stats of every call into one dump per
+    window instead of writing one per call, tuned with ``flush_every``,
+    ``flush_interval`` and ``max_functions`` (see ``Aggregator``). An
+    ``Aggregator`` instance can be passed to share it between functions.
+
+    ``engine="monitoring"`` profiles with ``sys.monitoring`` on Python
+    3.12+ and falls back to cProfile elsewhere; ``max_calls`` stops
+    timing a function after that many calls and ``lines`` names the
+    functions timed line by line, written to ``<name>.lines.csv`` (see
+    ``MonitoringProfiler``).
+
+    ``include`` and ``exclude`` restrict profiles to functions whose
+    module, or module and name, match the given patterns, e.g.
+    ``include=["myapp.*"]``; other calls count in their nearest kept
+    caller (see ``pyprofile.filters``).
+
+    On coroutine functions the profiler only runs while the coroutine
+    itself executes, so tasks interleaving on one event loop do not end
+    up in each other's profiles; ``wall_time`` includes awaits while
+    ``cpu_time`` only counts the task's own steps.
+
+    ``enabled=False`` returns the function undecorated, at no cost.
+
+    The wall time of every profile is counted in the ``pyprofile.histogram``
+    histogram of its name, or of ``histogram``.
+
+    ``capture`` records the arguments of every call into a
+    ``FixtureStore``, or the store of that directory, to replay them
+    with ``pyprofile.fixtures.replay``.
+
+    ``memory=True`` also reports allocations with ``tracemalloc``, tuned
+    with ``memory_frames``, ``memory_top``, ``memory_key_type``,
+    ``memory_include`` and ``memory_exclude`` (see ``MemoryProfiler``),
+    and writes them to ``<name>.mem.csv``.
+
+    ``gc=True`` also records the garbage collections that ran during the
+    profile, their generation and pause (see ``GCMonitor``).
+
+    ``overhead_budget=0.02`` profiles only as many calls as keeps the
+    profiling cost around 2% of the function's wall time, adjusting the
+    fraction of profiled calls as it goes; an ``OverheadBudget`` can be
+    passed instead to tune it. Its counters are exposed as the
+    ``budget`` attribute of the decorated function.
     """
-    name = options.get("name")
+    enabled = options.pop("enabled", True)
+    name = options.pop("name", None)
+    capture = options.pop("capture", None)
+    aggregate = options.pop("aggregate", False)
+    overhead_budget = options.pop("overhead_budget", None)
+    aggregate_options = {
+        option: options.pop(option)
+        for option in ("flush_every", "flush_interval", "max_functions")
+        if option in options
+    }
 
     def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            with Profiler(name or func.__name__, **options):
-                to_return = func(*args, **kwargs)
-            return to_return
+        if not enabled:
+            return func
+        aggregator = aggregate or None
+        if aggregate is True:
+            from .aggregate import Aggregator
+
+            aggregator = Aggregator(**aggregate_options)
+        profiler_options = dict(options, aggregator=aggregator)
+        store = capture
+        if isinstance(capture, str):
+            from .fixtures import FixtureStore
+
+            store = FixtureStore(capture)
+        target = "%s:%s" % (func.__module__, func.__qualname__)
+        budget = overhead_budget
+        if isinstance(overhead_budget, (int, float)):
+            from .budget import OverheadBudget
+
+            # each function gets its own, their costs differ
+            budget = OverheadBudget(overhead_budget)
+        timer = timeit.default_timer
+
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if store is not None:
+                    store.record(target, args, kwargs)
+                if budget is not None and not budget.sample():
+                    start = timer()
+                    to_return = await func(*args, **kwargs)
+                    budget.record(timer() - start, False)
+                    return to_return
+                start = timer()
+                prof = Profiler(name or func.__name__, **profiler_options)
+                prof.start().pause()
+                try:
+                    to_return = await run_stepped(
+                        func(*args, **kwargs), prof.resume, prof.pause
+                    )
+                finally:
+                    prof.finish()
+                if budget is not None:
+                    budget.record(timer() - start, True)
+                return to_return
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if store is not None:
+                    store.record(target, args, kwargs)
+                if budget is None:
+                    with Profiler(name or func.__name__, **profiler_options):
+                        to_return = func(*args, **kwargs)
+                    return to_return
+                profiled = budget.sample()
+                start = timer()
+                if profiled:
+                    with Profiler(name or func.__name__, **profiler_options):
+                        to_return = func(*args, **kwargs)
+                else:
+                    to_return = func(*args, **kwargs)
+                budget.record(timer() - start, profiled)
+                return to_return
+
+        wrapper.aggregator = aggregator
+        wrapper.capture = store
+        wrapper.budget = budget
 
         return wrapper
 
-    if fn and inspect.isfunction(fn[0]):
+    if fn and isinstance(fn[0], types.FunctionType):
         # Called with no parameter
         return decorator(fn[0])
     else:
@@ -46,85 +212,318 @@ def profile(*fn, **options):
 
 class Profiler(object):
     def __init__(self, name: str, dump_dir: str = None, *args, **kwargs):
-        self.stats: str = None
-        self.name: str = (
-            f"stats_{name.strip()}_{int(datetime.now().timestamp())}"
-        )
+        self.stats = None
+        self._pstats = None
+        self._stats_str: str = None
+        self.wall_time: float = None
+        self.cpu_time: float = None
+        self.label: str = name.strip()
+        self.name: str = f"stats_{self.label}_{int(time.time())}"
         self.dump_dir = dump_dir
         self.save_stats = kwargs.pop("save_stats", False) and dump_dir
         self.write_csv = kwargs.pop("write_csv", True)
         self.write_dot = kwargs.pop("write_dot", True)
         self.write_png = kwargs.pop("write_png", True)
-        self._prof_file = f"{dump_dir}/{self.name}.prof"
-        self._csv_file = f"{dump_dir}/{self.name}.csv"
-        self._dot_file = f"{dump_dir}/{self.name}.dot"
-        self._png_file = f"{dump_dir}/{self.name}.png"
+        self.write_flamegraph = kwargs.pop("write_flamegraph", self.write_png)
+        self.write_icicle = kwargs.pop("write_icicle", False)
+        self.write_collapsed = kwargs.pop("write_collapsed", False)
+        self.write_json = kwargs.pop("write_json", False)
+        self.write_binary = kwargs.pop("write_binary", False)
+        self.spool = kwargs.pop("spool", False)
+        self.store = kwargs.pop("store", False)
+        self._publisher = kwargs.pop("publisher", None)
+        self.aggregator = kwargs.pop("aggregator", None)
+        # latency histogram the wall time is counted in, see histogram.py
+        self.histogram = kwargs.pop("histogram", None)
+        self.engine = kwargs.pop("engine", "cprofile")
+        if self.engine not in ENGINES:
+            raise ValueError("Unsupported profiling engine: %s" % self.engine)
+        # the engine that actually ran, see start()
+        self.engine_used = self.engine
+        self.engine_options = {
+            option: kwargs.pop(option)
+            for option in (
+                "interval",
+                "sampling_mode",
+                "threads",
+                "max_calls",
+                "lines",
+            )
+            if option in kwargs
+        }
+        include = kwargs.pop("include", ())
+        exclude = kwargs.pop("exclude", ())
+        self.filter = None
+        if include or exclude:
+            from .filters import ModuleFilter
+
+            self.filter = ModuleFilter(include, exclude)
+        self.memory = kwargs.pop("memory", False)
+        self.write_memory = kwargs.pop("write_memory", self.memory)
+        self.memory_options = {
+            option[len("memory_") :]: kwargs.pop(option)
+            for option in (
+                "memory_frames",
+                "memory_top",
+                "memory_key_type",
+                "memory_include",
+                "memory_exclude",
+            )
+            if option in kwargs
+        }
+        self.memory_profiler = None
+        self.gc = kwargs.pop("gc", False)
+        self.gc_monitor = None
 
     def __enter__(self, *args, **kwargs):
         self.start(*args, **kwargs)
         return self
 
     def __exit__(self, *args, **kwargs):
-        self.stats_str = self.stop(*args, **kwargs)
-        self._publish_stats_to_csv(self.stats_str)
-        self._publish_stats_to_dot(self.stats_str)
-        self._publish_stats_to_graph(self.stats_str)
+        self.finish()
         return True
 
+    def finish(self):
+        """Stop profiling and publish, or aggregate, the stats.
+        """
+        if self.aggregator is not None:
+            # skip building the structured stats of every single call
+            self.aggregator.add(self, self._collect())
+            return
+        self.publish(self.stop())
+
+    @property
+    def publisher(self):
+        if self._publisher is None:
+            from .publishers import Publisher
+
+            self._publisher = Publisher()
+        return self._publisher
+
+    def publish(self, stats):
+        """Hand the artifacts of ``stats`` over to the publisher.
+        """
+        artifacts = self.artifacts()
+        if artifacts:
+            from .publishers import publish_stats
+
+            self.publisher.submit(publish_stats, stats, artifacts)
+
+    def artifacts(self, name: str = None) -> dict:
+        """Files to publish, as ``{format: path}``.
+
+        With ``spool=True`` the stats go to a single per-process spool
+        file instead, to be merged with ``pyprofile.spool``, and with
+        ``store=True`` to the ``ProfileStore`` of ``<dump_dir>/store``.
+
+        :param name: base file name, defaults to the profiler name
+        :type name: str
+        """
+        if not self.save_stats:
+            return {}
+        if self.spool:
+            from .spool import spool_path
+
+            return {"spool": spool_path(self.dump_dir, self.label)}
+        if self.store:
+            return {"store": f"{self.dump_dir}/store"}
+        path = f"{self.dump_dir}/{name or self.name}"
+        artifacts = {"prof": f"{path}.prof"}
+        if self.write_csv:
+            artifacts["csv"] = f"{path}.csv"
+        if self.write_json:
+            artifacts["json"] = f"{path}.json"
+        if self.write_binary:
+            artifacts["binary"] = f"{path}.pyps"
+        if self.write_dot:
+            artifacts["dot"] = f"{path}.dot"
+        if self.write_flamegraph:
+            artifacts["flamegraph"] = f"{path}.svg"
+        if self.write_icicle:
+            artifacts["icicle"] = f"{path}.icicle.svg"
+        if self.write_collapsed:
+            artifacts["collapsed"] = f"{path}.folded"
+        if self.memory and self.write_memory:
+            artifacts["memory"] = f"{path}.mem.csv"
+        if self.engine_options.get("lines"):
+            artifacts["lines"] = f"{path}.lines.csv"
+        return artifacts
+
+    @property
+    def stats_str(self) -> str:
+        """``pstats`` text report, rendered on first access only.
+        """
+        if self._stats_str is None and self._pstats is not None:
+            out = StringIO()
+            self._pstats.stream = out
+            self._pstats.sort_stats("ncalls", "tottime", "cumtime")
+            self._pstats.print_stats()
+            self._stats_str = out.getvalue()
+        return self._stats_str
+
+    def dot(self, **options) -> str:
+        """Graphviz call graph of the stopped profile, rendered in memory.
+
+        Accepts the ``theme``, ``node_thres`` and ``edge_thres`` options
+        of ``pyprofile.dot.render_dot``; needs gprof2dot.
+        """
+        from .dot import render_dot
+
+        return render_dot(self._pstats.stats, **options)
+
     def stop(self, *args, **kwargs):
-        self.profiler.disable()
-        out = StringIO()
-        stats = pstats.Stats(self.profiler, stream=out)
-        self.save_stats and stats.dump_stats(self._prof_file)
-        stats.sort_stats("ncalls", "tottime", "cumtime")
-        stats.print_stats()
-        return out.getvalue()
+        import pstats
+
+        from .stats import StructuredStats
+
+        stats = self._collect()
+        self.stats = StructuredStats.from_stats_dict(
+            stats,
+            meta={
+                "name": self.name,
+                "label": self.label,
+                "timestamp": time.time(),
+                "pid": os.getpid(),
+                "engine": self.engine_used,
+                "wall_time": self.wall_time,
+                "cpu_time": self.cpu_time,
+            },
+        )
+        if stats is not self._pstats.stats:
+            self._pstats = (
+                pstats.Stats(self.stats) if stats else pstats.Stats()
+            )
+        if hasattr(self.profiler, "collapsed") and self.save_stats:
+            self.stats.stacks = self.profiler.collapsed()
+        self.stats.line_stats = getattr(self.profiler, "line_stats", None)
+        if self.memory_profiler is not None:
+            self.stats.memory = self.memory_profiler.stats
+            self.stats.meta["memory"] = self.stats.memory.summary()
+        if self.gc_monitor is not None:
+            self.stats.gc = self.gc_monitor.stats
+            self.stats.meta["gc"] = self.stats.gc.summary()
+        return self.stats
+
+    def thread_stats(self) -> dict:
+        """Per-thread breakdown of a stopped ``threads=True`` profile.
+
+        :returns: ``{thread id: StructuredStats}``, empty when the engine
+            has no per-thread data
+        """
+        from .stats import StructuredStats
+
+        names = getattr(self.profiler, "thread_names", {})
+        return {
+            thread_id: StructuredStats.from_stats_dict(
+                self._filtered(stats),
+                meta={
+                    "name": self.name,
+                    "thread_id": thread_id,
+                    "thread_name": names.get(thread_id, str(thread_id)),
+                },
+            )
+            for thread_id, stats in getattr(
+                self.profiler, "thread_stats", {}
+            ).items()
+        }
 
     def start(self, *args, **kwargs):
-        self.profiler = cProfile.Profile()
-        self.profiler.enable()
+        self.engine_used, self.profiler = ENGINES[self.engine](
+            filter=self.filter, **self.engine_options
+        )
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        if self.memory:
+            # traced before the timers start, its snapshots are not timed
+            from .memory import MemoryProfiler
+
+            self.memory_profiler = MemoryProfiler(**self.memory_options)
+            self.memory_profiler.start()
+        if self.gc:
+            from .gcstats import GCMonitor
+
+            self.gc_monitor = GCMonitor().start()
+        self._started_at = timeit.default_timer()
+        self._paused = False
+        self._cpu_mark = time.thread_time()
+        self._enable()
         return self
 
-    def _publish_stats_to_dot(self, stats: str, *args, **kwargs):
-        if not self.save_stats or not self.write_dot:
-            return
-        with open(self._dot_file, "wt", encoding="UTF-8") as output:
-            theme = TEMPERATURE_COLORMAP
-            theme.skew = 1.0
-            profile = PstatsParser(self._prof_file).parse()
-            profile.prune(0.5 / 100.0, 0.1 / 100.0, None, False)
-            dot = DotWriter(output)
-            dot.strip = False
-            dot.wrap = False
-            dot.show_function_events = [TOTAL_TIME_RATIO, TIME_RATIO]
-            dot.graph(profile, theme)
-
-    def _publish_stats_to_graph(self, stats: str, *args, **kwargs):
-        if not self.save_stats or not self.write_png:
-            return
-        return None
+    def pause(self):
+        """Suspend profiling, e.g. while a profiled coroutine awaits.
+        """
+        if self._paused:
+            return self
+        getattr(self.profiler, "pause", self.profiler.disable)()
+        self.cpu_time += time.thread_time() - self._cpu_mark
+        self._paused = True
+        return self
 
-    def _publish_stats_to_csv(self, stats: str, *args, **kwargs):
-        if not self.save_stats or not self.write_csv:
-            return
-        # chop the string into a csv-like buffer
-        res = "ncalls" + stats.split("ncalls")[-1]
-        # save it to disk
-        with open(self._csv_file, "w",) as f:
-            f.write(
-                "\n".join(
-                    [
-                        self._get_csv_line_item(ln.rstrip())
-                        for ln in res.split("\n")
-                    ]
-                )
+    def resume(self):
+        if not self._paused:
+            return self
+        self._paused = False
+        self._cpu_mark = time.thread_time()
+        try:
+            getattr(self.profiler, "resume", self.profiler.enable)()
+        except ValueError:
+            # cProfile taken by another task meanwhile (3.12+), this step
+            # goes unrecorded rather than failing the profiled code
+            pass
+        return self
+
+    def _enable(self):
+        try:
+            self.profiler.enable()
+        except RuntimeError:
+            if self.engine_used != "monitoring":
+                raise
+            # another tool took the sys.monitoring id since the engine
+            # was built
+            self.engine_used, self.profiler = _cprofile_engine(
+                filter=self.filter, **self.engine_options
+            )
+            self._enable()
+        except ValueError:
+            # Python 3.12+ runs a single cProfile per process: while the
+            # profile of another thread holds it, sample instead. Signal
+            # sampling fails the same way outside of the main thread, the
+            # sampler thread works anywhere
+            options = dict(self.engine_options, sampling_mode="thread")
+            self.engine_used, self.profiler = _sampling_engine(
+                filter=self.filter, **options
             )
+            self.profiler.enable()
+
+    def _collect(self):
+        # halts profiling, returns the filtered pstats dict
+        import pstats
+
+        self._halt()
+        try:
+            self._pstats = pstats.Stats(self.profiler)
+        except TypeError:
+            # nothing was recorded, e.g. no sample hit a very short call
+            self._pstats = pstats.Stats()
+        self._stats_str = None
+        return self._filtered(self._pstats.stats)
+
+    def _filtered(self, stats):
+        # collapses what engines could not leave out while recording
+        if self.filter is None:
+            return stats
+        from .filters import collapse_stats
+
+        return collapse_stats(stats, self.filter)
+
+    def _halt(self):
+        self.pause()
+        self.profiler.disable()
+        self.wall_time = timeit.default_timer() - self._started_at
+        if self.memory_profiler is not None:
+            self.memory_profiler.stop()
+        if self.gc_monitor is not None:
+            self.gc_monitor.stop()
+        from .histogram import record
 
-    def _get_csv_line_item(self, line):
-        line = line.split("{", 2)
-        if len(line) < 2:
-            return ",".join(line[0].split(None, 6))
-        stats, function_name = line
-        stats = stats.split(None, 6)
-        stats.append("{" + function_name)
-        return ",".join(stats)
+        record(self.histogram or self.label, self.wall_time)
@@ -0,0 +1,307 @@
+"""Writing profile artifacts to the dump directory.
+
+``publish_stats`` writes every requested artifact of one profile. It only
+needs picklable arguments, so publishers are free to run it inline, on a
+worker thread or in a worker process.
+
+Each format is written by an exporter, ``exporter(stats, path,
+artifacts)``, registered in ``EXPORTERS``. Exporters registered as
+``"module:function"`` are imported on first use, so e.g. gprof2dot is
+only loaded by processes that write dot graphs.
+"""
+
+import atexit
+import importlib
+import logging
+import marshal
+import os
+import queue
+import threading
+import timeit
+import weakref
+
+__all__ = [
+    "publish_stats",
+    "register_exporter",
+    "Publisher",
+    "BackgroundPublisher",
+]
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop", "drop_oldest")
+
+_STOP = object()
+
+# live BackgroundPublisher instances, shut down at process exit
+_publishers = weakref.WeakSet()
+
+
+def export_prof(stats, path, artifacts):
+    with open(path, "wb") as f:
+        marshal.dump(stats.to_stats_dict(), f)
+
+
+def export_csv(stats, path, artifacts):
+    with open(path, "w", newline="") as f:
+        stats.to_csv(f)
+
+
+def export_json(stats, path, artifacts):
+    with open(path, "w") as f:
+        stats.to_json(f)
+
+
+def export_binary(stats, path, artifacts):
+    with open(path, "wb") as f:
+        stats.to_binary(f)
+
+
+# in the order they run
+EXPORTERS = {
+    "prof": export_prof,
+    "csv": export_csv,
+    "json": export_json,
+    "binary": export_binary,
+    "spool": "pyprofile.spool:export_spool",
+    "store": "pyprofile.store:export_store",
+    "dot": "pyprofile.dot:export_dot",
+    "flamegraph": "pyprofile.flamegraph:export_flamegraph",
+    "icicle": "pyprofile.flamegraph:export_icicle",
+    "collapsed": "pyprofile.flamegraph:export_collapsed",
+    "memory": "pyprofile.memory:export_memory",
+    "lines": "pyprofile.monitoring:export_lines",
+}
+
+
+def register_exporter(format: str, exporter):
+    """Add or replace the exporter of ``format``.
+
+    :param exporter: ``exporter(stats, path, artifacts)`` callable, or
+        its ``"module:function"`` name to import it on first use
+    """
+    EXPORTERS[format] = exporter
+
+
+def publish_stats(stats, artifacts: dict):
+    """Write ``stats`` to each ``{format: path}`` of ``artifacts``.
+
+    Built-in formats are ``prof``, ``csv``, ``json``, ``binary``,
+    ``spool``, ``store``, ``dot``, ``flamegraph``, ``icicle``,
+    ``collapsed``, ``memory`` and ``lines``. Flame graphs use the
+    sampled stacks when ``stats`` has them.
+    """
+    for format in list(EXPORTERS):
+        if format in artifacts:
+            _get_exporter(format)(stats, artifacts[format], artifacts)
+
+
+def _get_exporter(format):
+    exporter = EXPORTERS[format]
+    if isinstance(exporter, str):
+        module, _, function = exporter.partition(":")
+        exporter = getattr(importlib.import_module(module), function)
+        EXPORTERS[format] = exporter
+    return exporter
+
+
+class Publisher(object):
+    """Runs publishing jobs inline, on the caller's thread.
+    """
+
+    def submit(self, fn, *args) -> bool:
+        fn(*args)
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        return True
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        pass
+
+
+class BackgroundPublisher(Publisher):
+    """Runs publishing jobs off the profiled code path.
+
+    Jobs go through a bounded queue served by worker threads, which run
+    them directly or hand them to a process pool.
+
+    :param maxsize: maximum number of queued jobs
+    :type maxsize: int
+    :param workers: number of worker threads, and pool processes when
+        ``executor`` is ``"process"``
+    :type workers: int
+    :param overflow: what to do when the queue is full: ``"block"`` the
+        caller (backpressure, for at most ``timeout`` seconds before
+        dropping the job), ``"drop"`` the new job or ``"drop_oldest"``
+        queued job
+    :type overflow: str
+    :param timeout: how long ``"block"`` waits for a free slot, forever
+        when ``None``
+    :type timeout: float
+    :param executor: ``"thread"`` or ``"process"``
+    :type executor: str
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        workers: int = 1,
+        overflow: str = "block",
+        timeout: float = None,
+        executor: str = "thread",
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unsupported overflow policy: %s" % overflow)
+        if executor not in ("thread", "process"):
+            raise ValueError("Unsupported executor: %s" % executor)
+        self.maxsize = maxsize
+        self.workers = workers
+        self.overflow = overflow
+        self.timeout = timeout
+        self.executor = executor
+        self.submitted = 0
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._pid = None
+        self._closed = False
+        _publishers.add(self)
+
+    def submit(self, fn, *args) -> bool:
+        """Queue ``fn(*args)``, returns ``False`` if the job was dropped.
+        """
+        if self._closed:
+            raise RuntimeError("Publisher was shut down")
+        self._ensure_workers()
+        job = (fn, args)
+        with self._lock:
+            self.submitted += 1
+            self._pending += 1
+        try:
+            if self.overflow == "block":
+                self._queue.put(job, timeout=self.timeout)
+            elif self.overflow == "drop":
+                self._queue.put_nowait(job)
+            else:
+                self._put_dropping_oldest(job)
+        except queue.Full:
+            self._job_done(dropped=True)
+            return False
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued job ran, ``False`` on timeout.
+        """
+        deadline = None if timeout is None else timeit.default_timer()
+        with self._idle:
+            while self._pending:
+                if deadline is None:
+                    self._idle.wait()
+                    continue
+                remaining = deadline + timeout - timeit.default_timer()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """Stop the workers, publishing queued jobs first if ``wait``.
+
+        Called at process exit for every publisher still alive, so
+        queued artifacts are not lost.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._pid != os.getpid():
+            return
+        if wait:
+            self.flush(timeout)
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        if wait:
+            for thread in self._threads:
+                thread.join(timeout)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+
+    def _ensure_workers(self):
+        # Threads do not survive a fork, start fresh ones in each process.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.maxsize)
+            self._pending = 0
+            self._pool = None
+            if self.executor == "process":
+                from concurrent.futures import ProcessPoolExecutor
+
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._threads = [
+                threading.Thread(
+                    target=self._work,
+                    name="pyprofile-publisher-%d" % i,
+                    daemon=True,
+                )
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def _put_dropping_oldest(self, job):
+        while True:
+            try:
+                self._queue.put_nowait(job)
+                return
+            except queue.Full:
+                pass
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                continue
+            self._job_done(dropped=True)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is _STOP:
+                return
+            fn, args = job
+            failed = False
+            try:
+                if self._pool is not None:
+                    self._pool.submit(fn, *args).result()
+                else:
+                    fn(*args)
+            except Exception:
+                failed = True
+                logger.exception("Failed to publish profile artifacts")
+            self._job_done(failed=failed)
+
+    def _job_done(self, dropped=False, failed=False):
+        with self._idle:
+            self._pending -= 1
+            if dropped:
+                self.dropped += 1
+            elif failed:
+                self.failed += 1
+            else:
+                self.published += 1
+            if not self._pending:
+                self._idle.notify_all()
+
+
+def _shutdown_publishers():
+    # a single hook, one per publisher would keep them all alive
+    for publisher in list(_publishers):
+        publisher.shutdown()
+
+
+atexit.register(_shutdown_publishers)
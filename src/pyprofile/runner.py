@@ -0,0 +1,275 @@
+"""Profiling scripts and modules from the command line.
+
+Runs a script or module under a ``Profiler``, as ``python -m cProfile``
+does, with the engines, output formats and ``dump_dir`` of
+``Profiler``::
+
+    python -m pyprofile run -o profiles --format csv,dot script.py arg
+    python -m pyprofile run --engine sampling -m package.module arg
+
+With ``--interval`` the profile is cut in windows: every ``interval``
+seconds the running profiler is stopped and published, and a new one
+started, so long running processes emit incremental snapshots instead
+of one report at exit. Windows are switched from a ``SIGALRM`` handler,
+which runs in the main thread the script runs in; this needs a Unix
+platform and a script that does not use ``SIGALRM`` itself. Frames
+already running when a window starts, e.g. the script's main loop,
+only show up in it through the calls they make.
+
+Without ``-o``, the ``pstats`` report of each profile is printed to
+stdout instead.
+"""
+
+import argparse
+import os
+import runpy
+import signal
+import sys
+
+from .profiler import ENGINES, Profiler
+
+__all__ = [
+    "main",
+    "run",
+]
+
+FORMATS = (
+    "csv",
+    "json",
+    "binary",
+    "dot",
+    "flamegraph",
+    "icicle",
+    "collapsed",
+    "spool",
+    "store",
+)
+
+
+class _Windows(object):
+    """Profilers of consecutive windows of a run.
+    """
+
+    def __init__(self, name, options, interval, publisher):
+        self.name = name
+        self.options = options
+        self.interval = interval
+        self.publisher = publisher
+        self.windows = 0
+        self.profiler = None
+        self._previous_handler = None
+        self._switching = False
+        self._base_depth = None
+
+    def start(self):
+        self.profiler = self._new()
+        if self.interval:
+            self._previous_handler = signal.signal(
+                signal.SIGALRM, self._switch
+            )
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        self.profiler.start()
+        self._base_depth = getattr(self.profiler.profiler, "base_depth", None)
+
+    def stop(self):
+        if self.interval:
+            signal.setitimer(signal.ITIMER_REAL, 0, 0)
+            signal.signal(signal.SIGALRM, self._previous_handler)
+        self._finish()
+
+    def _new(self):
+        profiler = Profiler(
+            self.name, publisher=self.publisher, **self.options
+        )
+        self.windows += 1
+        if self.interval:
+            # several windows can start within a second
+            profiler.name = "%s_%04d" % (profiler.name, self.windows)
+        return profiler
+
+    def _switch(self, signum, frame):
+        if self._switching:
+            # a slow publication overran the interval
+            return
+        self._switching = True
+        try:
+            self._finish()
+            self.profiler = self._new()
+            self.profiler.start()
+            engine = self.profiler.profiler
+            if hasattr(engine, "base_depth"):
+                # started from the handler, the sampler would cut its
+                # stacks at the interrupted frame
+                engine.base_depth = self._base_depth
+        finally:
+            self._switching = False
+
+    def _finish(self):
+        profiler = self.profiler
+        profiler.finish()
+        if profiler.save_stats:
+            print(
+                "pyprofile: %s, %d functions in %.3fs"
+                % (profiler.name, len(profiler.stats), profiler.wall_time),
+                file=sys.stderr,
+            )
+        else:
+            sys.stdout.write(profiler.stats_str)
+            sys.stdout.flush()
+
+
+def run(
+    target: str,
+    args=(),
+    module: bool = False,
+    name: str = None,
+    interval: float = None,
+    **options
+) -> int:
+    """Run a script, or a module with ``module=True``, under profiling.
+
+    :param target: path of the script, or name of the module
+    :type target: str
+    :param args: command line arguments of the script
+    :param name: profile name, defaults to the script or module name
+    :type name: str
+    :param interval: seconds between incremental snapshots, a single
+        profile when ``None``
+    :type interval: float
+    :param options: ``Profiler`` keyword arguments
+    :returns: exit status of the script
+    :rtype: int
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(target))[0]
+    publisher = None
+    if interval:
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("--interval needs signal.setitimer (Unix).")
+        from .publishers import BackgroundPublisher
+
+        # keeps writing artifacts out of the signal handler
+        publisher = BackgroundPublisher()
+    windows = _Windows(name, options, interval, publisher)
+
+    saved_argv, saved_path = sys.argv[:], sys.path[:]
+    sys.argv = [target] + list(args)
+    if module:
+        sys.path.insert(0, os.getcwd())
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(target)))
+    status = 0
+    windows.start()
+    try:
+        if module:
+            runpy.run_module(target, run_name="__main__", alter_sys=True)
+        else:
+            runpy.run_path(target, run_name="__main__")
+    except SystemExit as exit:
+        status = exit.code
+    finally:
+        windows.stop()
+        if publisher is not None:
+            publisher.shutdown()
+        sys.argv, sys.path[:] = saved_argv, saved_path
+    if status is None:
+        return 0
+    if isinstance(status, int):
+        return status
+    print(status, file=sys.stderr)
+    return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyprofile",
+        description="Profile a Python script or module.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    runner = subparsers.add_parser(
+        "run",
+        help="run a script or module under profiling",
+        usage="python -m pyprofile run [options] (script | -m module) "
+        "[args ...]",
+    )
+    runner.add_argument(
+        "-m",
+        dest="module",
+        action="store_true",
+        help="run the target as a module, like python -m",
+    )
+    runner.add_argument(
+        "-o",
+        "--dump-dir",
+        default=None,
+        help="directory of the artifacts, the report is printed without",
+    )
+    runner.add_argument(
+        "--format",
+        default="csv",
+        help="comma separated: %s" % ", ".join(FORMATS),
+    )
+    runner.add_argument(
+        "--engine", default="cprofile", choices=sorted(ENGINES)
+    )
+    runner.add_argument(
+        "--sampling-interval",
+        type=float,
+        default=None,
+        help="seconds between two samples of the sampling engine",
+    )
+    runner.add_argument(
+        "--threads",
+        action="store_true",
+        help="also profile the threads the script starts",
+    )
+    runner.add_argument(
+        "--include", action="append", default=[], help="module pattern"
+    )
+    runner.add_argument(
+        "--exclude", action="append", default=[], help="module pattern"
+    )
+    runner.add_argument("--name", default=None, help="profile name")
+    runner.add_argument(
+        "--interval",
+        type=float,
+        default=None,
+        help="emit a snapshot every INTERVAL seconds",
+    )
+    runner.add_argument("target", help="script path, or module with -m")
+    runner.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    if args.command != "run":
+        parser.print_help()
+        return 2
+
+    formats = [format for format in args.format.split(",") if format]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        parser.error("unsupported format: %s" % ", ".join(sorted(unknown)))
+    options = {
+        "dump_dir": args.dump_dir,
+        "save_stats": args.dump_dir is not None,
+        "engine": args.engine,
+        "include": args.include,
+        "exclude": args.exclude,
+        "spool": "spool" in formats,
+        "store": "store" in formats,
+    }
+    for format in ("csv", "json", "binary", "dot", "flamegraph", "icicle"):
+        options["write_" + format] = format in formats
+    options["write_collapsed"] = "collapsed" in formats
+    if args.sampling_interval is not None:
+        options["interval"] = args.sampling_interval
+    if args.threads:
+        options["threads"] = True
+    if args.dump_dir is not None:
+        os.makedirs(args.dump_dir, exist_ok=True)
+    return run(
+        args.target,
+        args.args,
+        module=args.module,
+        name=args.name,
+        interval=args.interval,
+        **options
+    )
@@ -0,0 +1,274 @@
+"""Statistical sampling profiler.
+
+Instead of hooking every call like cProfile, the sampler wakes up at a
+fixed interval and records the current stack of the profiled thread. The
+collected stacks are turned into a pstats compatible stats dict, so the
+result can be fed to ``pstats.Stats`` and every publisher built on it.
+"""
+
+import os
+import signal
+import sys
+import threading
+import timeit
+from collections import Counter
+
+from .flamegraph import frame_name
+
+__all__ = [
+    "SamplingProfiler",
+]
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class SamplingProfiler(object):
+    """Low overhead profiler sampling the stack of the calling thread.
+
+    :param interval: seconds between two samples
+    :type interval: float
+    :param mode: ``"thread"`` to sample from a background thread using
+        ``sys._current_frames`` or ``"signal"`` to use an ``ITIMER_PROF``
+        interval timer (main thread only, POSIX only)
+    :type mode: str
+    :param threads: sample every running thread instead of the calling
+        one only
+    :type threads: bool
+    :param filter: frames of the code objects it rejects are dropped
+        from the samples
+    :type filter: pyprofile.filters.ModuleFilter
+
+    :ivar base_depth: frames dropped from the bottom of the calling
+        thread's samples, those already running when ``enable`` was
+        called
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+        mode: str = "thread",
+        threads: bool = False,
+        filter=None,
+    ):
+        if mode not in ("thread", "signal"):
+            raise ValueError("Unsupported sampling mode: %s" % mode)
+        self.interval = interval
+        self.mode = mode
+        self.threads = threads
+        self.filter = filter
+        # {(thread id, stack of code objects): number of samples}
+        self.stacks = Counter()
+        self.thread_names = {}
+        self.samples = 0
+        self.ticks = 0
+        self.elapsed = 0.0
+        self.stats = {}
+        self.thread_stats = {}
+        self._enabled = False
+        self._thread = None
+        self._thread_id = None
+        self._stop_event = None
+        self._previous_handler = None
+        self._started_at = None
+        self._paused = False
+        self.base_depth = 0
+
+    def enable(self):
+        if self._enabled:
+            return
+        self._thread_id = threading.get_ident()
+        self.base_depth = _caller_depth(sys._getframe(1))
+        self._started_at = timeit.default_timer()
+        self._paused = False
+        if self.mode == "signal":
+            # raises ValueError outside of the main thread
+            self._previous_handler = signal.signal(
+                signal.SIGPROF, self._signal_handler
+            )
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name="pyprofile-sampler", daemon=True
+            )
+            self._thread.start()
+        self._enabled = True
+
+    def disable(self):
+        if not self._enabled:
+            return
+        self._enabled = False
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+        else:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        if not self._paused:
+            self.elapsed += timeit.default_timer() - self._started_at
+
+    def pause(self):
+        """Stop recording samples without stopping the sampler.
+
+        Cheaper than ``disable`` when toggled often, e.g. around every
+        step of a coroutine.
+        """
+        if self._enabled and not self._paused:
+            self._paused = True
+            self.elapsed += timeit.default_timer() - self._started_at
+
+    def resume(self):
+        if not self._enabled:
+            self.enable()
+        elif self._paused:
+            self._started_at = timeit.default_timer()
+            self._paused = False
+
+    def runcall(self, func, *args, **kwargs):
+        self.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.disable()
+
+    def create_stats(self):
+        """Build a pstats compatible ``stats`` dict from the samples.
+
+        Time is attributed to each stack in proportion to the number of
+        samples it received over the wall time spent enabled. Stats of
+        each thread are kept in ``thread_stats``, keyed by thread id.
+        """
+        self.disable()
+        weight = self.elapsed / self.ticks if self.ticks else 0.0
+        merged = {}
+        per_thread = {}
+        for (thread_id, stack), count in self.stacks.items():
+            stats = per_thread.setdefault(thread_id, {})
+            _add_stack(stats, stack, count, count * weight)
+            _add_stack(merged, stack, count, count * weight)
+        self.stats = _freeze(merged)
+        self.thread_stats = {
+            thread_id: _freeze(stats)
+            for thread_id, stats in per_thread.items()
+        }
+
+    def collapsed(self) -> dict:
+        """Sampled stacks as ``{"a;b;c": seconds}``, for flame graphs.
+
+        With ``threads=True`` each stack starts with its thread's name.
+        """
+        weight = self.elapsed / self.ticks if self.ticks else 0.0
+        collapsed = {}
+        for (thread_id, stack), count in self.stacks.items():
+            names = [frame_name(_code_key(code)) for code in stack]
+            if self.threads:
+                names.insert(0, self.thread_names.get(thread_id, "thread"))
+            key = ";".join(names)
+            collapsed[key] = collapsed.get(key, 0.0) + count * weight
+        return collapsed
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._tick(None)
+
+    def _signal_handler(self, signum, frame):
+        self._tick(frame)
+
+    def _tick(self, frame):
+        if self._paused:
+            return
+        self.ticks += 1
+        if not self.threads:
+            if frame is None:
+                frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._sample(self._thread_id, frame, self.base_depth)
+            return
+        current = threading.get_ident()
+        for thread_id, thread_frame in sys._current_frames().items():
+            if thread_id == current:
+                if self.mode == "thread":
+                    # the sampler thread itself
+                    continue
+                thread_frame = frame
+            base_depth = 0
+            if thread_id == self._thread_id:
+                base_depth = self.base_depth
+            self._sample(thread_id, thread_frame, base_depth)
+
+    def _sample(self, thread_id, frame, base_depth):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+        del stack[:base_depth]
+        if self.filter is not None:
+            stack = [code for code in stack if self.filter.code(code)]
+        if stack:
+            if thread_id not in self.thread_names:
+                self.thread_names[thread_id] = _thread_name(thread_id)
+            self.stacks[thread_id, tuple(stack)] += 1
+            self.samples += 1
+
+
+def _add_stack(stats, stack, count, seconds):
+    """Account one sampled ``stack`` into a mutable stats dict.
+    """
+    seen = set()
+    for depth, code in enumerate(stack):
+        func = _code_key(code)
+        entry = stats.get(func)
+        if entry is None:
+            entry = stats[func] = [0, 0, 0.0, 0.0, {}]
+        is_leaf = depth == len(stack) - 1
+        if is_leaf:
+            entry[2] += seconds
+        if func in seen:
+            continue
+        seen.add(func)
+        entry[0] += count
+        entry[1] += count
+        entry[3] += seconds
+        if depth:
+            caller = _code_key(stack[depth - 1])
+            edge = entry[4].get(caller, (0, 0, 0.0, 0.0))
+            entry[4][caller] = (
+                edge[0] + count,
+                edge[1] + count,
+                edge[2] + (seconds if is_leaf else 0.0),
+                edge[3] + seconds,
+            )
+
+
+def _freeze(stats):
+    return {func: tuple(entry) for func, entry in stats.items()}
+
+
+def _thread_name(thread_id):
+    for thread in threading.enumerate():
+        if thread.ident == thread_id:
+            return thread.name
+    return str(thread_id)
+
+
+def _caller_depth(frame):
+    """Depth of the stack below the first frame outside this package.
+
+    Frames below it were already running when sampling started, they are
+    dropped from the samples like cProfile never sees them.
+    """
+    while frame is not None and frame.f_code.co_filename.startswith(
+        _PACKAGE_DIR
+    ):
+        frame = frame.f_back
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return max(depth - 1, 0)
+
+
+def _code_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
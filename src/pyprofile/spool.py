@@ -0,0 +1,219 @@
+"""Spooling profiles from many processes and merging them.
+
+Each profile is written to ``<dump_dir>/spool`` as a binary stats file
+named after its label, the writer's pid and a per-process sequence
+number, so pre-fork workers never overwrite each other's dumps. The
+merge engine combines spooled files into one aggregate per label and
+time window.
+
+Command line usage::
+
+    python -m pyprofile.spool merge <dump_dir>/spool -o merged --window 300
+"""
+
+import argparse
+import itertools
+import os
+import sys
+
+from .stats import StructuredStats, merge_stats_dicts
+
+__all__ = [
+    "spool_path",
+    "write_spool",
+    "read_spool",
+    "merge_spool",
+    "write_merged",
+]
+
+SPOOL_SUFFIX = ".pyps"
+
+_sequence = itertools.count()
+
+
+def spool_path(dump_dir: str, label: str) -> str:
+    """A unique spool file path for a new profile of ``label``.
+    """
+    return os.path.join(
+        str(dump_dir),
+        "spool",
+        "%s.%d.%08d%s" % (label, os.getpid(), next(_sequence), SPOOL_SUFFIX),
+    )
+
+
+def write_spool(stats: StructuredStats, path: str):
+    """Write ``stats`` so that readers never see a partial file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        stats.to_binary(f)
+    os.replace(tmp_path, path)
+
+
+def export_spool(stats, path, artifacts):
+    """Exporter of the ``spool`` format.
+    """
+    write_spool(stats, path)
+
+
+def read_spool(path: str) -> StructuredStats:
+    with open(path, "rb") as f:
+        return StructuredStats.from_binary(f)
+
+
+def merge_spool(
+    paths, window: float = 300.0, jobs: int = None, delete: bool = False
+) -> dict:
+    """Merge spooled profiles per label and time window.
+
+    Files are split in chunks merged by ``jobs`` worker processes, each
+    reading one file at a time, so memory grows with the number of
+    distinct functions rather than the number of files.
+
+    :param paths: spool files, or directories holding them
+    :param window: window length in seconds, 0 merges everything
+    :type window: float
+    :param jobs: worker processes, defaults to the number of CPUs
+    :type jobs: int
+    :param delete: remove the spool files once merged
+    :type delete: bool
+    :returns: ``{(label, window start): StructuredStats}``
+    """
+    files = sorted(_spool_files(paths))
+    jobs = jobs or os.cpu_count() or 1
+    chunks = [files[i :: jobs * 4] for i in range(min(len(files), jobs * 4))]
+    if jobs == 1 or len(chunks) <= 1:
+        merged = _combine(map(_merge_chunk, chunks, itertools.repeat(window)))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            merged = _combine(
+                pool.map(_merge_chunk, chunks, itertools.repeat(window))
+            )
+    if delete:
+        for path in files:
+            os.remove(path)
+    return {
+        group: StructuredStats.from_stats_dict(stats, meta)
+        for group, (stats, meta) in merged.items()
+    }
+
+
+def write_merged(merged: dict, out_dir: str, formats=("binary", "csv")):
+    """Publish merged profiles as ``stats_<label>_<window start>.*``.
+    """
+    # publishers writes spool files, import it late to avoid a cycle
+    from .publishers import publish_stats
+
+    os.makedirs(out_dir, exist_ok=True)
+    extensions = {
+        "prof": "prof",
+        "csv": "csv",
+        "json": "json",
+        "binary": "pyps",
+        "flamegraph": "svg",
+        "collapsed": "folded",
+    }
+    for (label, window_start), stats in merged.items():
+        path = os.path.join(out_dir, "stats_%s_%d" % (label, window_start))
+        publish_stats(
+            stats,
+            {
+                format: "%s.%s" % (path, extensions[format])
+                for format in formats
+            },
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyprofile.spool",
+        description="Merge spooled pyprofile dumps.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    merge = subparsers.add_parser("merge", help="merge spool files")
+    merge.add_argument("paths", nargs="+", help="spool files or directories")
+    merge.add_argument("-o", "--output", required=True, help="output dir")
+    merge.add_argument(
+        "--window", type=float, default=300.0, help="window in seconds"
+    )
+    merge.add_argument("--jobs", type=int, default=None)
+    merge.add_argument(
+        "--format",
+        default="binary,csv",
+        help="comma separated: prof, csv, json, binary, flamegraph, collapsed",
+    )
+    merge.add_argument(
+        "--delete", action="store_true", help="remove merged spool files"
+    )
+    args = parser.parse_args(argv)
+    if args.command != "merge":
+        parser.print_help()
+        return 2
+    merged = merge_spool(
+        args.paths, window=args.window, jobs=args.jobs, delete=args.delete
+    )
+    write_merged(merged, args.output, args.format.split(","))
+    for (label, window_start), stats in sorted(merged.items()):
+        print(
+            "%s %d: %d profiles, %d functions"
+            % (label, window_start, stats.meta["profiles"], len(stats))
+        )
+    return 0
+
+
+def _spool_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in os.scandir(path):
+                if entry.name.endswith(SPOOL_SUFFIX):
+                    yield entry.path
+        else:
+            yield path
+
+
+def _merge_chunk(paths, window):
+    merged = {}
+    for path in paths:
+        stats = read_spool(path)
+        meta = stats.meta
+        label = meta.get("label") or meta.get("name", "")
+        timestamp = meta.get("timestamp", 0.0)
+        window_start = timestamp - timestamp % window if window else 0
+        group = (label, int(window_start))
+        source_meta = {
+            "label": label,
+            "window_start": int(window_start),
+            "window_end": int(window_start + window) if window else None,
+            "profiles": 1,
+            "pids": [meta.get("pid")],
+        }
+        if group in merged:
+            merge_stats_dicts(merged[group][0], stats.to_stats_dict())
+            _merge_meta(merged[group][1], source_meta)
+        else:
+            merged[group] = (stats.to_stats_dict(), source_meta)
+    return merged
+
+
+def _combine(chunks):
+    merged = {}
+    for chunk in chunks:
+        for group, (stats, meta) in chunk.items():
+            if group in merged:
+                merge_stats_dicts(merged[group][0], stats)
+                _merge_meta(merged[group][1], meta)
+            else:
+                merged[group] = (stats, meta)
+    return merged
+
+
+def _merge_meta(target, source):
+    target["profiles"] += source["profiles"]
+    target["pids"] = sorted(set(target["pids"]) | set(source["pids"]), key=str)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
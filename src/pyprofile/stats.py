@@ -0,0 +1,333 @@
+"""Columnar profiling statistics.
+
+``StructuredStats`` holds the content of a ``pstats.Stats.stats`` dict in
+compact ``array.array`` columns with interned file and function names,
+and writes it to CSV, JSON or a compact binary format without rendering
+and re-parsing ``print_stats`` text.
+"""
+
+import csv
+import json
+import pstats
+import struct
+import sys
+from array import array
+
+__all__ = [
+    "StructuredStats",
+    "merge_stats_dicts",
+]
+
+BINARY_MAGIC = b"PYPS"
+BINARY_VERSION = 1
+
+CSV_HEADER = (
+    "ncalls",
+    "primcalls",
+    "tottime",
+    "percall",
+    "cumtime",
+    "percall",
+    "filename",
+    "lineno",
+    "function",
+)
+
+_HEADER = struct.Struct("<4sHHI")
+_COUNT = struct.Struct("<I")
+
+# (attribute, typecode) in the order they are serialized.
+_ROW_COLUMNS = (
+    ("calls", "q"),
+    ("prim_calls", "q"),
+    ("tottime", "d"),
+    ("cumtime", "d"),
+    ("file_ids", "i"),
+    ("lines", "i"),
+    ("func_ids", "i"),
+)
+_EDGE_COLUMNS = (
+    ("edge_callers", "i"),
+    ("edge_callees", "i"),
+    ("edge_calls", "q"),
+    ("edge_prim_calls", "q"),
+    ("edge_tottime", "d"),
+    ("edge_cumtime", "d"),
+)
+
+
+class StructuredStats(object):
+    """Array backed profiling statistics.
+
+    Every function is a row of the ``calls``, ``prim_calls``,
+    ``tottime``, ``cumtime``, ``file_ids``, ``lines`` and ``func_ids``
+    columns; ids index into ``strings``. Caller/callee pairs are kept
+    in the ``edge_*`` columns, referencing function rows.
+
+    Instances are accepted by ``pstats.Stats`` like a profiler object.
+
+    ``stacks`` holds the collapsed stacks of a sampled profile, or the
+    ones unfolded for flame graphs, ``{"a;b;c": seconds}``; they are
+    not serialized. ``memory`` likewise holds the ``MemoryStats`` of a
+    profile taken with ``memory=True``, summarized in ``meta``, ``gc``
+    the ``GCStats`` of one taken with ``gc=True``, summarized too, and
+    ``line_stats`` the ``{func: {lineno: (hits, seconds)}}`` timings of
+    the functions profiled line by line.
+    """
+
+    def __init__(self, meta: dict = None):
+        self.meta = dict(meta or {})
+        self.strings = []
+        self._string_ids = {}
+        self._rows = {}
+        for attribute, typecode in _ROW_COLUMNS + _EDGE_COLUMNS:
+            setattr(self, attribute, array(typecode))
+        self.stats = {}
+        self.stacks = None
+        self.memory = None
+        self.gc = None
+        self.line_stats = None
+
+    def __len__(self):
+        return len(self.calls)
+
+    @classmethod
+    def from_pstats(cls, stats, meta: dict = None):
+        """Build from a ``pstats.Stats`` instance.
+        """
+        return cls.from_stats_dict(stats.stats, meta)
+
+    @classmethod
+    def from_stats_dict(cls, stats: dict, meta: dict = None):
+        """Build from a raw ``{func: (cc, nc, tt, ct, callers)}`` dict.
+        """
+        self = cls(meta)
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            self.add_function(func, nc, cc, tt, ct)
+        for func, (cc, nc, tt, ct, callers) in stats.items():
+            callee = self._rows[func]
+            for caller, edge in callers.items():
+                if not isinstance(edge, tuple):
+                    # profile module only records the number of calls
+                    edge = (edge, edge, 0.0, 0.0)
+                self.add_edge(self.add_function(caller), callee, *edge[:4])
+        return self
+
+    def intern(self, value: str) -> int:
+        string_id = self._string_ids.get(value)
+        if string_id is None:
+            string_id = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def add_function(
+        self, func, calls=0, prim_calls=0, tottime=0.0, cumtime=0.0
+    ) -> int:
+        """Add a ``(file, line, name)`` function row, returns its index.
+
+        Adding an existing function accumulates its counters.
+        """
+        row = self._rows.get(func)
+        if row is None:
+            row = self._rows[func] = len(self.calls)
+            self.calls.append(calls)
+            self.prim_calls.append(prim_calls)
+            self.tottime.append(tottime)
+            self.cumtime.append(cumtime)
+            self.file_ids.append(self.intern(func[0]))
+            self.lines.append(func[1])
+            self.func_ids.append(self.intern(func[2]))
+        elif calls or prim_calls or tottime or cumtime:
+            self.calls[row] += calls
+            self.prim_calls[row] += prim_calls
+            self.tottime[row] += tottime
+            self.cumtime[row] += cumtime
+        return row
+
+    def add_edge(
+        self, caller, callee, calls, prim_calls, tottime, cumtime
+    ) -> None:
+        self.edge_callers.append(caller)
+        self.edge_callees.append(callee)
+        self.edge_calls.append(calls)
+        self.edge_prim_calls.append(prim_calls)
+        self.edge_tottime.append(tottime)
+        self.edge_cumtime.append(cumtime)
+
+    def key(self, row: int) -> tuple:
+        """The pstats ``(file, line, name)`` key of a row.
+        """
+        return (
+            self.strings[self.file_ids[row]],
+            self.lines[row],
+            self.strings[self.func_ids[row]],
+        )
+
+    def order(self, *columns: str) -> list:
+        """Row indices sorted by the given columns, largest first.
+        """
+        columns = [getattr(self, column) for column in columns]
+        return sorted(
+            range(len(self)),
+            key=lambda row: tuple(column[row] for column in columns),
+            reverse=True,
+        )
+
+    @property
+    def total_tt(self) -> float:
+        return sum(self.tottime)
+
+    def to_stats_dict(self) -> dict:
+        """Rebuild the raw pstats dict.
+        """
+        keys = [self.key(row) for row in range(len(self))]
+        callers = [{} for _ in keys]
+        for edge in range(len(self.edge_callers)):
+            caller = keys[self.edge_callers[edge]]
+            callers[self.edge_callees[edge]][caller] = (
+                self.edge_calls[edge],
+                self.edge_prim_calls[edge],
+                self.edge_tottime[edge],
+                self.edge_cumtime[edge],
+            )
+        return {
+            key: (
+                self.prim_calls[row],
+                self.calls[row],
+                self.tottime[row],
+                self.cumtime[row],
+                callers[row],
+            )
+            for row, key in enumerate(keys)
+        }
+
+    def create_stats(self):
+        """Profiler protocol used by ``pstats.Stats``.
+        """
+        self.stats = self.to_stats_dict()
+
+    def to_csv(self, fp) -> None:
+        writer = csv.writer(fp, lineterminator="\n")
+        writer.writerow(CSV_HEADER)
+        for row in self.order("calls", "tottime", "cumtime"):
+            calls = self.calls[row]
+            prim_calls = self.prim_calls[row]
+            tottime = self.tottime[row]
+            cumtime = self.cumtime[row]
+            writer.writerow(
+                (
+                    calls,
+                    prim_calls,
+                    tottime,
+                    tottime / calls if calls else 0.0,
+                    cumtime,
+                    cumtime / prim_calls if prim_calls else 0.0,
+                    self.strings[self.file_ids[row]],
+                    self.lines[row],
+                    self.strings[self.func_ids[row]],
+                )
+            )
+
+    def to_json(self, fp) -> None:
+        strings = self.strings
+        json.dump(
+            {
+                "meta": self.meta,
+                "functions": [
+                    {
+                        "file": strings[self.file_ids[row]],
+                        "line": self.lines[row],
+                        "function": strings[self.func_ids[row]],
+                        "calls": self.calls[row],
+                        "primitive_calls": self.prim_calls[row],
+                        "tottime": self.tottime[row],
+                        "cumtime": self.cumtime[row],
+                    }
+                    for row in range(len(self))
+                ],
+                "edges": [
+                    {
+                        "caller": self.edge_callers[edge],
+                        "callee": self.edge_callees[edge],
+                        "calls": self.edge_calls[edge],
+                        "primitive_calls": self.edge_prim_calls[edge],
+                        "tottime": self.edge_tottime[edge],
+                        "cumtime": self.edge_cumtime[edge],
+                    }
+                    for edge in range(len(self.edge_callers))
+                ],
+            },
+            fp,
+        )
+
+    def to_binary(self, fp) -> None:
+        """Write the compact binary format to a binary file object.
+
+        Layout: header, JSON meta, string table, row columns, edge
+        columns. Numbers are little-endian.
+        """
+        meta = json.dumps(self.meta).encode("utf-8")
+        fp.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(meta)))
+        fp.write(meta)
+        encoded = [value.encode("utf-8") for value in self.strings]
+        fp.write(_COUNT.pack(len(encoded)))
+        _write_array(fp, array("I", [len(value) for value in encoded]))
+        fp.write(b"".join(encoded))
+        for columns in (_ROW_COLUMNS, _EDGE_COLUMNS):
+            fp.write(_COUNT.pack(len(getattr(self, columns[0][0]))))
+            for attribute, _ in columns:
+                _write_array(fp, getattr(self, attribute))
+
+    @classmethod
+    def from_binary(cls, fp):
+        """Read stats written by ``to_binary``.
+        """
+        magic, version, _, meta_size = _HEADER.unpack(fp.read(_HEADER.size))
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError("Not a pyprofile binary stats file.")
+        self = cls(json.loads(fp.read(meta_size).decode("utf-8")))
+        lengths = _read_array(fp, "I", _read_count(fp))
+        blob = fp.read(sum(lengths))
+        offset = 0
+        for length in lengths:
+            self.intern(blob[offset : offset + length].decode("utf-8"))
+            offset += length
+        for columns in (_ROW_COLUMNS, _EDGE_COLUMNS):
+            count = _read_count(fp)
+            for attribute, typecode in columns:
+                setattr(self, attribute, _read_array(fp, typecode, count))
+        self._rows = {self.key(row): row for row in range(len(self))}
+        return self
+
+
+def merge_stats_dicts(target: dict, source: dict) -> dict:
+    """Add the raw pstats dict ``source`` into ``target``, in place.
+
+    Uses the same semantics as ``pstats.Stats.add``.
+    """
+    for func, stat in source.items():
+        if func in target:
+            target[func] = pstats.add_func_stats(target[func], stat)
+        else:
+            cc, nc, tt, ct, callers = stat
+            target[func] = (cc, nc, tt, ct, dict(callers))
+    return target
+
+
+def _read_count(fp):
+    return _COUNT.unpack(fp.read(_COUNT.size))[0]
+
+
+def _write_array(fp, values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    fp.write(values.tobytes())
+
+
+def _read_array(fp, typecode, count):
+    values = array(typecode)
+    values.frombytes(fp.read(values.itemsize * count))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
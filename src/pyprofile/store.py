@@ -0,0 +1,738 @@
+"""Indexed store of profiles with retention.
+
+Instead of loose files per profile, ``ProfileStore`` appends profiles
+to segment files of a directory, one segment per process at a time so
+pre-fork workers never share one. Within a segment, file and function
+names are interned once, in string records shared by every later
+profile of the segment. A profile record holds its JSON meta, its
+function rows sorted by own time, and its caller/callee edges
+compressed with zlib.
+
+Each segment has a small index file next to it, one entry per profile
+with its label, timestamp, pid and position, so queries by name, time
+and pid never open the segments. Segments are read through ``mmap``:
+the top functions of a profile are a prefix of its uncompressed rows,
+read without decompressing edges or building whole stats.
+
+Retention works on whole segments: the oldest ones are removed once
+the store exceeds ``max_bytes`` or when they are older than
+``max_age``. It runs whenever a writer starts a new segment, which
+happens every ``segment_size`` bytes or ``segment_interval`` seconds.
+The latest segment of a process still alive, named after its pid, is
+kept as it may still be written; a writer whose segment was removed
+anyway, e.g. by hand, starts a new one.
+
+Command line usage::
+
+    python -m pyprofile.store query <dump_dir>/store --label _api_orders_
+        --last 3600 --top 20
+"""
+
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+from .stats import _EDGE_COLUMNS, _ROW_COLUMNS, StructuredStats
+
+__all__ = [
+    "ProfileRef",
+    "ProfileStore",
+    "export_store",
+    "get_store",
+]
+
+MAGIC = b"PYPST1\n\0"
+SEGMENT_SUFFIX = ".pst"
+INDEX_SUFFIX = ".idx"
+
+SORT_COLUMNS = ("tottime", "cumtime", "calls")
+
+_RECORD = struct.Struct("<cI")
+_PROFILE = struct.Struct("<IIII")
+_INDEX = struct.Struct("<ddQIIIH")
+_COUNT = struct.Struct("<I")
+
+_STRINGS = b"S"
+_STATS = b"P"
+
+
+class ProfileRef(object):
+    """Index entry of a stored profile.
+
+    ``offset`` and ``size`` locate its record in ``segment``;
+    ``functions`` is its number of function rows.
+    """
+
+    __slots__ = (
+        "label",
+        "timestamp",
+        "wall_time",
+        "pid",
+        "functions",
+        "segment",
+        "offset",
+        "size",
+    )
+
+    def __init__(
+        self,
+        label,
+        timestamp,
+        wall_time,
+        pid,
+        functions,
+        segment,
+        offset,
+        size,
+    ):
+        self.label = label
+        self.timestamp = timestamp
+        self.wall_time = wall_time
+        self.pid = pid
+        self.functions = functions
+        self.segment = segment
+        self.offset = offset
+        self.size = size
+
+    def __repr__(self):
+        return "<ProfileRef %s %s pid=%d>" % (
+            self.label,
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.timestamp)),
+            self.pid,
+        )
+
+
+class _Segment(object):
+    """Read-only mapping of a segment and the strings interned so far.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = []
+        self.scanned = len(MAGIC)
+        self._file = open(path, "rb")
+        self.map = None
+        self.remap()
+
+    def remap(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not a pyprofile store segment: %s" % self.path)
+
+    def read_strings(self, until: int):
+        """Decode the string records written before offset ``until``.
+        """
+        buffer = self.map
+        while self.scanned < until:
+            kind, size = _RECORD.unpack_from(buffer, self.scanned)
+            start = self.scanned + _RECORD.size
+            if kind == _STRINGS:
+                count = _COUNT.unpack_from(buffer, start)[0]
+                lengths = _column(buffer, start + _COUNT.size, "I", count)
+                offset = start + _COUNT.size + 4 * count
+                for length in lengths:
+                    self.strings.append(
+                        bytes(buffer[offset : offset + length]).decode("utf-8")
+                    )
+                    offset += length
+            self.scanned = start + size
+        return self.strings
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+
+
+class ProfileStore(object):
+    """Directory of profile segments.
+
+    :param max_bytes: size of the store above which the oldest segments
+        are removed, unbounded when ``None``
+    :type max_bytes: int
+    :param max_age: seconds after the last write of a segment when it is
+        removed, kept forever when ``None``
+    :type max_age: float
+    :param segment_size: bytes after which a writer starts a new segment
+    :type segment_size: int
+    :param segment_interval: seconds after which a writer starts a new
+        segment, so retention by age applies to low traffic processes
+    :type segment_interval: float
+    :param compress_level: zlib level of the edges
+    :type compress_level: int
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 1 << 30,
+        max_age: float = 7 * 86400.0,
+        segment_size: int = 64 << 20,
+        segment_interval: float = 3600.0,
+        compress_level: int = 6,
+    ):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_size = segment_size
+        self.segment_interval = segment_interval
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        # guards the caches of readers, which never take the writer lock
+        self._read_lock = threading.Lock()
+        self._file = None
+        self._index_file = None
+        self._segment_path = None
+        self._segment_started = 0.0
+        self._size = 0
+        self._pid = None
+        self._string_ids = {}
+        self._indexes = {}
+        self._segments = {}
+
+    def add(self, stats: StructuredStats) -> ProfileRef:
+        """Append a profile, returns its index entry.
+        """
+        meta = stats.meta
+        label = meta.get("label") or meta.get("name", "")
+        timestamp = meta.get("timestamp") or time.time()
+        wall_time = meta.get("wall_time")
+        encoded_meta = json.dumps(meta).encode("utf-8")
+        order = stats.order("tottime")
+        positions = [0] * len(order)
+        for position, row in enumerate(order):
+            positions[row] = position
+        edges = _to_bytes(
+            array("i", (positions[row] for row in stats.edge_callers)),
+            array("i", (positions[row] for row in stats.edge_callees)),
+            *(getattr(stats, attribute) for attribute, _ in _EDGE_COLUMNS[2:])
+        )
+        edges = zlib.compress(edges, self.compress_level)
+
+        with self._lock:
+            self._open_segment()
+            new_strings = []
+            ids = array("i")
+            for value in stats.strings:
+                string_id = self._string_ids.get(value)
+                if string_id is None:
+                    string_id = self._string_ids[value] = len(self._string_ids)
+                    new_strings.append(value.encode("utf-8"))
+                ids.append(string_id)
+            rows = _to_bytes(
+                *(
+                    array(typecode, (column[row] for row in order))
+                    for column, typecode in (
+                        (stats.calls, "q"),
+                        (stats.prim_calls, "q"),
+                        (stats.tottime, "d"),
+                        (stats.cumtime, "d"),
+                        ([ids[i] for i in stats.file_ids], "i"),
+                        (stats.lines, "i"),
+                        ([ids[i] for i in stats.func_ids], "i"),
+                    )
+                )
+            )
+            chunks = []
+            if new_strings:
+                payload = (
+                    _COUNT.pack(len(new_strings))
+                    + _to_bytes(array("I", map(len, new_strings)))
+                    + b"".join(new_strings)
+                )
+                chunks.append(_RECORD.pack(_STRINGS, len(payload)) + payload)
+            header = _PROFILE.pack(
+                len(encoded_meta),
+                len(order),
+                len(stats.edge_callers),
+                len(edges),
+            )
+            size = len(header) + len(encoded_meta) + len(rows) + len(edges)
+            offset = self._size + sum(map(len, chunks)) + _RECORD.size
+            chunks.append(_RECORD.pack(_STATS, size))
+            chunks.extend((header, encoded_meta, rows, edges))
+            self._file.write(b"".join(chunks))
+            self._size = offset + size
+            ref = ProfileRef(
+                label,
+                timestamp,
+                wall_time,
+                os.getpid(),
+                len(order),
+                self._segment_path,
+                offset,
+                size,
+            )
+            # written after the record, a crash in between leaves an
+            # unindexed record rather than an entry without one
+            self._index_file.write(_index_entry(ref))
+        return ref
+
+    def query(
+        self,
+        label: str = None,
+        since: float = None,
+        until: float = None,
+        pid: int = None,
+    ) -> list:
+        """Index entries of the stored profiles, oldest first.
+
+        :param label: profiles of this label only
+        :type label: str
+        :param since: profiles taken at or after this timestamp
+        :type since: float
+        :param until: profiles taken before this timestamp
+        :type until: float
+        :param pid: profiles of this process only
+        :type pid: int
+        """
+        refs = [
+            ref
+            for segment in self.segments()
+            for ref in self._read_index(segment)
+            if (label is None or ref.label == label)
+            and (since is None or ref.timestamp >= since)
+            and (until is None or ref.timestamp < until)
+            and (pid is None or ref.pid == pid)
+        ]
+        refs.sort(key=lambda ref: ref.timestamp)
+        return refs
+
+    def labels(self) -> dict:
+        """``{label: number of stored profiles}``.
+        """
+        counts = {}
+        for ref in self.query():
+            counts[ref.label] = counts.get(ref.label, 0) + 1
+        return counts
+
+    def load(self, ref: ProfileRef) -> StructuredStats:
+        """Whole stats of a stored profile, edges included.
+        """
+        segment, strings, (meta_size, rows, edges, edges_size) = self._record(
+            ref
+        )
+        buffer = segment.map
+        offset = ref.offset + _PROFILE.size
+        stats = StructuredStats(
+            json.loads(bytes(buffer[offset : offset + meta_size]))
+        )
+        offset += meta_size
+        for attribute, typecode in _ROW_COLUMNS:
+            column = _column(buffer, offset, typecode, rows)
+            offset += column.itemsize * rows
+            if attribute in ("file_ids", "func_ids"):
+                column = array("i", (stats.intern(strings[i]) for i in column))
+            setattr(stats, attribute, column)
+        blob = zlib.decompress(buffer[offset : offset + edges_size])
+        offset = 0
+        for attribute, typecode in _EDGE_COLUMNS:
+            column = _column(blob, offset, typecode, edges)
+            offset += column.itemsize * edges
+            setattr(stats, attribute, column)
+        stats._rows = {stats.key(row): row for row in range(len(stats))}
+        return stats
+
+    def top(self, ref: ProfileRef, n: int = 10, sort: str = "tottime"):
+        """Top ``n`` functions of a stored profile.
+
+        Sorting by own time reads the first ``n`` rows only, the other
+        columns read one column of the rows; edges are left compressed.
+
+        :param sort: ``"tottime"``, ``"cumtime"`` or ``"calls"``
+        :type sort: str
+        :returns: ``[((file, line, name), calls, tottime, cumtime)]``,
+            largest first
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError("Unsupported sort column: %s" % sort)
+        segment, strings, (meta_size, rows, _, _) = self._record(ref)
+        start = ref.offset + _PROFILE.size + meta_size
+        if sort == "tottime":
+            selected = range(min(n, rows))
+        else:
+            column = self._row_column(segment, start, rows, sort, rows)
+            selected = heapq.nlargest(n, range(rows), key=column.__getitem__)
+        count = max(selected, default=-1) + 1
+        columns = {
+            attribute: self._row_column(segment, start, rows, attribute, count)
+            for attribute in (
+                "calls",
+                "tottime",
+                "cumtime",
+                "file_ids",
+                "lines",
+                "func_ids",
+            )
+        }
+        return [
+            (
+                (
+                    strings[columns["file_ids"][row]],
+                    columns["lines"][row],
+                    strings[columns["func_ids"][row]],
+                ),
+                columns["calls"][row],
+                columns["tottime"][row],
+                columns["cumtime"][row],
+            )
+            for row in selected
+        ]
+
+    def top_functions(self, refs, n: int = 20, sort: str = "tottime"):
+        """Top ``n`` functions over several stored profiles, their
+        counters summed, in the format of ``top``.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError("Unsupported sort column: %s" % sort)
+        totals = {}
+        for ref in refs:
+            for key, calls, tottime, cumtime in self.top(ref, ref.functions):
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = [calls, tottime, cumtime]
+                else:
+                    total[0] += calls
+                    total[1] += tottime
+                    total[2] += cumtime
+        index = {"calls": 0, "tottime": 1, "cumtime": 2}[sort]
+        return [
+            (key, calls, tottime, cumtime)
+            for key, (calls, tottime, cumtime) in heapq.nlargest(
+                n, totals.items(), key=lambda item: item[1][index]
+            )
+        ]
+
+    def segments(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def enforce_retention(self) -> int:
+        """Remove the segments past ``max_bytes`` or ``max_age``, oldest
+        first, except the one being written. Returns how many went.
+        """
+        entries = []
+        for segment in self.segments():
+            try:
+                info = os.stat(segment)
+            except FileNotFoundError:
+                # removed meanwhile, e.g. by another process
+                continue
+            size = info.st_size
+            if os.path.exists(_index_path(segment)):
+                size += os.path.getsize(_index_path(segment))
+            entries.append((info.st_mtime, segment, size))
+        entries.sort()
+        writing = _live_segments(entries)
+        total = sum(size for _, _, size in entries)
+        now = time.time()
+        removed = 0
+        for mtime, segment, size in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            if segment in writing or (
+                segment == self._segment_path and self._pid == os.getpid()
+            ):
+                continue
+            self._forget(segment)
+            for path in (segment, _index_path(segment)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+            for segment in list(self._segments):
+                self._forget(segment)
+
+    def _open_segment(self):
+        pid = os.getpid()
+        if (
+            self._file is not None
+            and self._pid == pid
+            and self._size < self.segment_size
+            and time.time() - self._segment_started < self.segment_interval
+            and os.fstat(self._file.fileno()).st_nlink
+        ):
+            return
+        if self._pid == pid:
+            self._close_writer()
+        # forked workers start a segment of their own, the parent's
+        # files are left to the parent
+        os.makedirs(self.path, exist_ok=True)
+        now = time.time()
+        self._segment_path = os.path.join(
+            self.path,
+            "profiles_%d_%d_%06d%s"
+            % (pid, now, int(now * 1e6) % 1000000, SEGMENT_SUFFIX),
+        )
+        # unbuffered: records are written in one call each
+        self._file = open(self._segment_path, "wb", buffering=0)
+        self._file.write(MAGIC)
+        self._index_file = open(
+            _index_path(self._segment_path), "wb", buffering=0
+        )
+        self._pid = pid
+        self._segment_started = now
+        self._size = len(MAGIC)
+        self._string_ids = {}
+        self.enforce_retention()
+
+    def _close_writer(self):
+        for f in (self._file, self._index_file):
+            if f is not None:
+                f.close()
+        self._file = self._index_file = None
+
+    def _read_index(self, segment):
+        with self._read_lock:
+            return list(self._parse_index(segment))
+
+    def _parse_index(self, segment):
+        # index files only grow, new entries are parsed incrementally
+        parsed, refs = self._indexes.get(segment, (0, []))
+        try:
+            with open(_index_path(segment), "rb") as f:
+                f.seek(parsed)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        offset = 0
+        while offset + _INDEX.size <= len(data):
+            (
+                timestamp,
+                wall_time,
+                record_offset,
+                size,
+                pid,
+                functions,
+                label_size,
+            ) = _INDEX.unpack_from(data, offset)
+            end = offset + _INDEX.size + label_size
+            if end > len(data):
+                # being written
+                break
+            refs.append(
+                ProfileRef(
+                    data[offset + _INDEX.size : end].decode("utf-8"),
+                    timestamp,
+                    None if math.isnan(wall_time) else wall_time,
+                    pid,
+                    functions,
+                    segment,
+                    record_offset,
+                    size,
+                )
+            )
+            offset = end
+        self._indexes[segment] = (parsed + offset, refs)
+        return refs
+
+    def _record(self, ref):
+        with self._read_lock:
+            segment = self._segments.get(ref.segment)
+            if segment is None:
+                segment = self._segments[ref.segment] = _Segment(ref.segment)
+            if ref.offset + ref.size > len(segment.map):
+                segment.remap()
+            strings = segment.read_strings(ref.offset)
+        return segment, strings, _PROFILE.unpack_from(segment.map, ref.offset)
+
+    def _row_column(self, segment, start, rows, attribute, count):
+        offset = start
+        for name, typecode in _ROW_COLUMNS:
+            itemsize = array(typecode).itemsize
+            if name == attribute:
+                return _column(segment.map, offset, typecode, count)
+            offset += itemsize * rows
+        raise KeyError(attribute)
+
+    def _forget(self, segment):
+        with self._read_lock:
+            self._indexes.pop(segment, None)
+            mapped = self._segments.pop(segment, None)
+        if mapped is not None:
+            mapped.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str, **options) -> ProfileStore:
+    """Store of ``path`` shared within the process.
+
+    The first call for a path creates the store with ``options``, e.g.
+    retention settings; later calls return it as is.
+    """
+    path = str(path)
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(path)
+            if store is None:
+                store = _stores[path] = ProfileStore(path, **options)
+    return store
+
+
+def export_store(stats, path, artifacts):
+    """Exporter of the ``store`` format.
+    """
+    get_store(path).add(stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pyprofile.store",
+        description="Query a pyprofile profile store.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    query = subparsers.add_parser("query", help="list stored profiles")
+    query.add_argument("path", help="store directory")
+    query.add_argument("--label", default=None)
+    query.add_argument("--pid", type=int, default=None)
+    query.add_argument(
+        "--last", type=float, default=None, help="profiles of the last seconds"
+    )
+    query.add_argument(
+        "--top",
+        type=int,
+        default=0,
+        help="print the top functions of the matching profiles",
+    )
+    query.add_argument("--sort", default="tottime", choices=SORT_COLUMNS)
+    args = parser.parse_args(argv)
+    if args.command != "query":
+        parser.print_help()
+        return 2
+    store = ProfileStore(args.path, max_bytes=None, max_age=None)
+    refs = store.query(
+        label=args.label,
+        since=time.time() - args.last if args.last is not None else None,
+        pid=args.pid,
+    )
+    if not args.top:
+        for ref in refs:
+            print(
+                "%s %s pid=%d functions=%d wall_time=%s"
+                % (
+                    time.strftime(
+                        "%Y-%m-%dT%H:%M:%S", time.localtime(ref.timestamp)
+                    ),
+                    ref.label,
+                    ref.pid,
+                    ref.functions,
+                    ref.wall_time,
+                )
+            )
+        return 0
+    print("%d profiles" % len(refs))
+    print("     calls    tottime    cumtime function")
+    for (filename, line, name), calls, tottime, cumtime in store.top_functions(
+        refs, args.top, args.sort
+    ):
+        print(
+            "%10d %10.6f %10.6f %s:%d(%s)"
+            % (calls, tottime, cumtime, filename, line, name)
+        )
+    return 0
+
+
+def _live_segments(entries):
+    # latest segment of every other process still running
+    latest = {}
+    for _, segment, _ in entries:
+        name = os.path.basename(segment)[: -len(SEGMENT_SUFFIX)]
+        try:
+            pid, seconds, microseconds = map(int, name.split("_")[1:])
+        except ValueError:
+            continue
+        if pid != os.getpid():
+            latest[pid] = max(
+                latest.get(pid, ()), (seconds, microseconds, segment)
+            )
+    return {
+        segment for pid, (_, _, segment) in latest.items() if _pid_alive(pid)
+    }
+
+
+def _pid_alive(pid):
+    if os.name != "posix":
+        # os.kill would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _index_path(segment):
+    return segment[: -len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+
+
+def _index_entry(ref):
+    # cut on a character boundary
+    label = (
+        ref.label.encode("utf-8")[:65535]
+        .decode("utf-8", "ignore")
+        .encode("utf-8")
+    )
+    return (
+        _INDEX.pack(
+            ref.timestamp,
+            float("nan") if ref.wall_time is None else ref.wall_time,
+            ref.offset,
+            ref.size,
+            ref.pid,
+            ref.functions,
+            len(label),
+        )
+        + label
+    )
+
+
+def _to_bytes(*columns):
+    chunks = []
+    for values in columns:
+        if sys.byteorder == "big":
+            values = array(values.typecode, values)
+            values.byteswap()
+        chunks.append(values.tobytes())
+    return b"".join(chunks)
+
+
+def _column(buffer, offset, typecode, count):
+    values = array(typecode)
+    values.frombytes(buffer[offset : offset + values.itemsize * count])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+if __name__ == "__main__":
+    sys.exit(main())
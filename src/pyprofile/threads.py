@@ -0,0 +1,130 @@
+"""cProfile collectors spanning several threads.
+
+cProfile only hooks the thread that enables it. ``ThreadedProfile``
+installs a bootstrap hook with ``threading.setprofile`` so every thread
+started while profiling gets its own collector, then merges them.
+``threading.setprofile`` only reaches threads started after it is
+called: on Python < 3.12, threads that were already running when the
+profile was enabled are not profiled at all.
+
+Since Python 3.12 cProfile is built on ``sys.monitoring`` and already
+records the calls of every thread, but a second instance cannot be
+enabled; a single collector is used there and no per-thread breakdown
+is available.
+
+A collector can only be unhooked from its own thread, and pool threads
+outlive the profile. The collectors of started threads hence time
+events through a Python function, which also unhooks the thread at its
+first event once the profile is disabled; this roughly doubles their
+overhead compared to the calling thread's. Use the sampling engine to
+cover threads that were already running, or to get a breakdown on
+Python 3.12+.
+"""
+
+import cProfile
+import sys
+import threading
+import timeit
+
+from .stats import merge_stats_dicts
+
+__all__ = [
+    "ThreadedProfile",
+]
+
+PER_THREAD_COLLECTORS = sys.version_info < (3, 12)
+
+
+class ThreadedProfile(object):
+    """cProfile for the calling thread and the threads it starts.
+    """
+
+    def __init__(self):
+        self.profiles = {}
+        self.thread_names = {}
+        self.stats = {}
+        self.thread_stats = {}
+        self._thread_id = None
+        self._previous_hook = None
+        self._enabled = False
+
+    def enable(self):
+        if self._enabled:
+            return
+        self._thread_id = threading.get_ident()
+        if self._thread_id not in self.profiles:
+            self.profiles[self._thread_id] = cProfile.Profile()
+            self.thread_names[
+                self._thread_id
+            ] = threading.current_thread().name
+        if PER_THREAD_COLLECTORS:
+            self._previous_hook = getattr(
+                threading, "getprofile", lambda: None
+            )()
+            threading.setprofile(self._bootstrap)
+        self._enabled = True
+        self.profiles[self._thread_id].enable()
+
+    def disable(self):
+        if not self._enabled:
+            return
+        self.profiles[self._thread_id].disable()
+        if PER_THREAD_COLLECTORS:
+            threading.setprofile(self._previous_hook)
+        self._enabled = False
+
+    def pause(self):
+        """Suspend the calling thread's collector only.
+        """
+        self.profiles[self._thread_id].disable()
+
+    def resume(self):
+        self.profiles[self._thread_id].enable()
+
+    def create_stats(self):
+        """Merge every thread's stats into ``stats``.
+
+        Threads still running keep their collector until they finish;
+        what they run after this call is not reported.
+        """
+        self.disable()
+        self.thread_stats = {}
+        merged = {}
+        for thread_id, prof in list(self.profiles.items()):
+            # snapshot_stats() does not disable the collector, which
+            # would unhook the calling thread instead of the profiled one
+            prof.snapshot_stats()
+            self.thread_stats[thread_id] = prof.stats
+            merge_stats_dicts(merged, prof.stats)
+        self.stats = merged
+
+    def runcall(self, func, *args, **kwargs):
+        self.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.disable()
+
+    def _bootstrap(self, frame, event, arg):
+        # runs once, as the first profiling event of a new thread
+        if not self._enabled:
+            sys.setprofile(None)
+            return
+        thread_id = threading.get_ident()
+        prof = cProfile.Profile(self._worker_timer())
+        self.profiles[thread_id] = prof
+        self.thread_names[thread_id] = threading.current_thread().name
+        prof.enable()
+
+    def _worker_timer(self):
+        clock = timeit.default_timer
+        setprofile = sys.setprofile
+
+        def timer():
+            if not self._enabled:
+                # prof.disable() would flush the collector in the middle
+                # of its own event
+                setprofile(None)
+            return clock()
+
+        return timer
@@ -0,0 +1,269 @@
+"""Timelines of nested blocks in the Chrome trace-event format.
+
+Spans opened while another one is active, in the same thread or task,
+become its children; the current span is kept in a context variable so
+tasks of one event loop do not mix. Each finished span is written as a
+complete (``"X"``) event, and spans of one root share a track, so the
+files open as nested slices in Perfetto or ``chrome://tracing``.
+
+Events are buffered and appended to a JSON array left open until the
+file is closed, which the format allows, so traces are written as they
+go and a crashed process still leaves a readable file. ``Tracer``
+writes one file per root span, e.g. per request, or one per time
+window.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+import timeit
+
+__all__ = [
+    "Span",
+    "Tracer",
+    "TraceWriter",
+    "current_span",
+    "get_tracer",
+]
+
+TRACE_MODES = ("request", "window")
+
+_current_span = contextvars.ContextVar("pyprofile_span", default=None)
+
+
+def current_span():
+    """Innermost open span of the calling thread or task, or ``None``.
+    """
+    return _current_span.get()
+
+
+class TraceWriter(object):
+    """Chrome trace-event JSON array appended to a file in batches.
+
+    :param buffer_size: events kept in memory between two writes
+    :type buffer_size: int
+    """
+
+    def __init__(self, path: str, buffer_size: int = 256):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.users = 0
+        self.retired = False
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._separator = "\n"
+        self._file = open(path, "w", encoding="UTF-8")
+        self._file.write("[")
+
+    def write(self, event: dict):
+        encoded = json.dumps(event, separators=(",", ":"), default=str)
+        with self._lock:
+            self._buffer.append(encoded)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+
+    def _flush(self):
+        if not self._buffer or self._file is None:
+            return
+        self._file.write(self._separator + ",\n".join(self._buffer))
+        self._file.flush()
+        self._separator = ",\n"
+        self._buffer = []
+
+
+class Span(object):
+    """An open block of a trace, closed by ``Tracer.end``.
+    """
+
+    __slots__ = ("name", "category", "start", "track", "writer", "parent")
+
+    def __init__(self, name, category, start, track, writer, parent):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.track = track
+        self.writer = writer
+        self.parent = parent
+
+    def query(self, sql: str, start: float, duration: float, alias=None):
+        """Add a query as a child slice, ``start`` being a
+        ``timeit.default_timer()`` value.
+        """
+        self.writer.write(
+            {
+                "name": sql[:100],
+                "cat": "sql",
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": self.track,
+                "args": {"sql": sql, "alias": alias},
+            }
+        )
+
+
+class Tracer(object):
+    """Writes the spans begun through it to ``dump_dir``.
+
+    :param mode: ``"request"`` for a file per root span, or
+        ``"window"`` for a file per ``window`` seconds
+    :type mode: str
+    :param window: seconds covered by each file in ``"window"`` mode
+    :type window: float
+    :param buffer_size: events buffered per file between two writes
+    :type buffer_size: int
+    """
+
+    def __init__(
+        self,
+        dump_dir: str,
+        mode: str = "request",
+        window: float = 60.0,
+        buffer_size: int = 256,
+    ):
+        if mode not in TRACE_MODES:
+            raise ValueError("Unsupported trace mode: %s" % mode)
+        self.dump_dir = dump_dir
+        self.mode = mode
+        self.window = window
+        self.buffer_size = buffer_size
+        self._tracks = itertools.count(1)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._window_end = 0.0
+        atexit.register(self.close)
+
+    def begin(self, name: str, category: str = "block") -> Span:
+        """Open a span, child of the current one if any.
+        """
+        parent = _current_span.get()
+        if parent is None:
+            track = next(self._tracks)
+            writer = self._acquire(name)
+            writer.write(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": track,
+                    "args": {
+                        "name": "%s (%s)"
+                        % (name, threading.current_thread().name)
+                    },
+                }
+            )
+        else:
+            track, writer = parent.track, parent.writer
+        span = Span(
+            name, category, timeit.default_timer(), track, writer, parent
+        )
+        _current_span.set(span)
+        return span
+
+    def end(self, span: Span, args: dict = None):
+        """Close ``span`` and write it, with ``args`` if given.
+        """
+        end = timeit.default_timer()
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": span.start * 1e6,
+            "dur": (end - span.start) * 1e6,
+            "pid": os.getpid(),
+            "tid": span.track,
+        }
+        if args:
+            event["args"] = args
+        span.writer.write(event)
+        _current_span.set(span.parent)
+        if span.parent is None:
+            self._release(span.writer)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "block"):
+        span = self.begin(name, category)
+        try:
+            yield span
+        finally:
+            self.end(span)
+
+    def close(self):
+        """Close the file of the current window.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                writer.retired = True
+                if not writer.users:
+                    writer.close()
+
+    def _acquire(self, name):
+        with self._lock:
+            if self.mode == "request":
+                writer = self._open("trace_%s" % _file_label(name))
+                writer.retired = True
+            else:
+                now = time.time()
+                if self._writer is None or now >= self._window_end:
+                    if self._writer is not None:
+                        self._writer.retired = True
+                        if not self._writer.users:
+                            self._writer.close()
+                    self._writer = self._open("trace_%d" % os.getpid())
+                    self._window_end = now + self.window
+                writer = self._writer
+            writer.users += 1
+            return writer
+
+    def _release(self, writer):
+        with self._lock:
+            writer.users -= 1
+            if writer.retired and not writer.users:
+                writer.close()
+
+    def _open(self, prefix):
+        # several files can start within a second, ids keep them apart
+        path = os.path.join(
+            self.dump_dir,
+            "%s_%d_%d.json" % (prefix, int(time.time()), next(_file_ids)),
+        )
+        return TraceWriter(path, self.buffer_size)
+
+
+_file_ids = itertools.count()
+_tracers = {}
+
+
+def get_tracer(dump_dir: str, **options) -> Tracer:
+    """Tracer of ``dump_dir``, shared by every caller with the same
+    options.
+    """
+    key = (dump_dir, tuple(sorted(options.items())))
+    tracer = _tracers.get(key)
+    if tracer is None:
+        tracer = _tracers.setdefault(key, Tracer(dump_dir, **options))
+    return tracer
+
+
+def _file_label(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
@@ -0,0 +1,100 @@
+import csv
+import gc
+import json
+import time
+
+from pyprofile import profile
+from pyprofile.publishers import Publisher
+
+
+def test_aggregated_calls_share_one_dump(tmp_path):
+    @profile(dump_dir=tmp_path, save_stats=True, aggregate=True, flush_every=5)
+    def square(value):
+        return value * value
+
+    assert [square(i) for i in range(7)] == [i * i for i in range(7)]
+
+    csv_files = list(tmp_path.glob("stats_square_*.csv"))
+    assert len(csv_files) == 1
+    with open(csv_files[0]) as f:
+        rows = [
+            row for row in csv.DictReader(f) if row["function"] == "square"
+        ]
+    assert rows[0]["ncalls"] == "5"
+    # the window of the last two calls, and its timer, go
+    square.aggregator.flush()
+
+
+class Recorder(Publisher):
+    def __init__(self):
+        self.published = []
+
+    def submit(self, fn, stats, artifacts):
+        self.published.append(stats)
+
+
+def test_aggregated_calls_are_filtered_with_gc(tmp_path):
+    recorder = Recorder()
+
+    @profile(
+        dump_dir=tmp_path,
+        save_stats=True,
+        aggregate=True,
+        flush_every=3,
+        exclude=["json.*"],
+        gc=True,
+        publisher=recorder,
+    )
+    def encode(value):
+        gc.collect()
+        return json.dumps(value)
+
+    for i in range(3):
+        encode([i])
+
+    (stats,) = recorder.published
+    functions = {key[2] for key in stats.to_stats_dict()}
+    assert "encode" in functions
+    assert "dumps" not in functions
+    assert stats.gc.count >= 3
+    assert stats.meta["gc"]["collections"] == stats.gc.count
+
+
+def test_aggregated_window_flushes_when_idle(tmp_path):
+    recorder = Recorder()
+
+    @profile(
+        dump_dir=tmp_path,
+        save_stats=True,
+        aggregate=True,
+        flush_interval=0.05,
+        publisher=recorder,
+    )
+    def idle():
+        return 1
+
+    idle()
+    deadline = time.monotonic() + 5
+    while not recorder.published and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert recorder.published[0].meta["profiles"] == 1
+
+
+def test_aggregated_window_without_interval(tmp_path):
+    recorder = Recorder()
+
+    @profile(
+        dump_dir=tmp_path,
+        save_stats=True,
+        aggregate=True,
+        flush_every=2,
+        flush_interval=None,
+        publisher=recorder,
+    )
+    def square(value):
+        return value * value
+
+    assert [square(i) for i in range(3)] == [0, 1, 4]
+    assert [stats.meta["profiles"] for stats in recorder.published] == [2]
+    square.aggregator.flush()
+    assert [stats.meta["profiles"] for stats in recorder.published] == [2, 1]
@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from pyprofile import profile
+from pyprofile.budget import OverheadBudget
+
+
+def test_rate_settles_on_budget():
+    budget = OverheadBudget(0.02, half_life=50)
+    for _ in range(5000):
+        profiled = budget.sample()
+        # 1 ms calls, 0.1 ms more when profiled
+        budget.record(0.0011 if profiled else 0.001, profiled)
+
+    assert budget.baseline == pytest.approx(0.001)
+    assert budget.overhead == pytest.approx(0.0001)
+    assert budget.rate == pytest.approx(0.2)
+    assert budget.overhead_ratio == pytest.approx(0.02)
+    assert budget.counters()["calls"] == 5000
+    assert budget.profiled == pytest.approx(1000, rel=0.05)
+
+
+def test_rate_follows_the_function():
+    budget = OverheadBudget(0.1, half_life=20, max_rate=0.5)
+    for _ in range(1000):
+        profiled = budget.sample()
+        budget.record(0.002 if profiled else 0.001, profiled)
+    assert budget.rate == pytest.approx(0.1)
+
+    # the function got 10 times slower, profiling is relatively cheaper
+    for _ in range(1000):
+        profiled = budget.sample()
+        budget.record(0.011 if profiled else 0.01, profiled)
+    assert budget.rate == pytest.approx(0.5)
+
+    # free profiling is capped
+    for _ in range(1000):
+        budget.record(0.01, budget.sample())
+    assert budget.rate == 0.5
+
+
+def test_sampling_is_evenly_spread():
+    budget = OverheadBudget(max_rate=0.25)
+    assert [budget.sample() for _ in range(8)] == [
+        False,
+        False,
+        False,
+        True,
+    ] * 2
+
+
+def test_decorator_profiles_a_fraction_of_calls():
+    @profile(overhead_budget=0.05)
+    def sleepy():
+        time.sleep(0.001)
+        return 1
+
+    for _ in range(100):
+        assert sleepy() == 1
+    assert sleepy.budget.calls == 100
+    assert 0 < sleepy.budget.profiled < 100
+    assert sleepy.budget.baseline >= 0.001
+
+    with pytest.raises(ValueError):
+        profile(overhead_budget=0)(sleepy)
+
+
+FRESH_PROCESS = """
+import json, time
+from pyprofile import profile
+
+@profile(overhead_budget=0.05)
+def sleepy():
+    time.sleep(0.001)
+
+for _ in range(20):
+    sleepy()
+print(json.dumps(sleepy.budget.counters()))
+"""
+
+
+def test_first_profiled_call_is_warmup():
+    # a fresh process, the first profiled call imports the profiler
+    output = subprocess.run(
+        [sys.executable, "-c", FRESH_PROCESS],
+        check=True,
+        stdout=subprocess.PIPE,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    ).stdout
+    counters = json.loads(output)
+    assert counters["profiled"] >= 2
+    assert counters["rate"] > 0.01
@@ -0,0 +1,40 @@
+from pyprofile import Profiler
+from pyprofile.diff import compare, load_profiles, main
+
+
+def fast():
+    return sum(range(1000))
+
+
+def slow():
+    return sum(range(100000))
+
+
+def test_compare_and_budgets(tmp_path):
+    for name, func in (("base", fast), ("head", slow)):
+        for _ in range(2):
+            with Profiler(
+                name, dump_dir=tmp_path / name, save_stats=True, spool=True,
+            ):
+                func()
+
+    base, base_profiles = load_profiles([tmp_path / "base" / "spool"])
+    head, head_profiles = load_profiles([tmp_path / "head" / "spool"])
+    assert base_profiles == head_profiles == 2
+    comparison = compare(base, head, base_profiles, head_profiles, 0, 0)
+    assert comparison.total_ratio > 0
+    assert any(delta.func[2] == "slow" for delta in comparison.significant())
+    assert comparison.violations(max_total=1.0)
+    assert not compare(base, base, min_time=0).violations(max_total=0.0)
+
+    args = [
+        "--base",
+        str(tmp_path / "base" / "spool"),
+        "--head",
+        str(tmp_path / "head" / "spool"),
+    ]
+    dot = tmp_path / "diff.dot"
+    assert main(args + ["--dot", str(dot)]) == 0
+    assert "digraph" in dot.read_text()
+    assert main(args + ["--max-total", "1.0"]) == 1
+    assert main(args + ["--budget", "*(slow)=0"]) == 1
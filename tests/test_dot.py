@@ -0,0 +1,59 @@
+import cProfile
+import pstats
+
+import pytest
+
+gprof2dot = pytest.importorskip("gprof2dot")
+
+from pyprofile import Profiler  # noqa: E402
+from pyprofile.dot import profile_from_stats  # noqa: E402
+from pyprofile.stats import StructuredStats  # noqa: E402
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+def tiny():
+    pass
+
+
+def work():
+    tiny()
+    sorted(str(fib(i)) for i in range(18))
+
+
+def test_profile_from_stats_matches_parsed_prof():
+    prof = cProfile.Profile()
+    prof.runcall(work)
+    stats = pstats.Stats(prof).stats
+
+    parsed = gprof2dot.PstatsParser(StructuredStats.from_stats_dict(stats))
+    parsed = parsed.parse()
+    parsed.prune(0.5 / 100.0, 0.1 / 100.0, None, False)
+    built = profile_from_stats(stats)
+
+    def graph(profile):
+        return {
+            function.name: (
+                function.called,
+                round(function.weight, 9),
+                sorted(
+                    profile.functions[call.callee_id].name
+                    for call in function.calls.values()
+                ),
+            )
+            for function in profile.functions.values()
+        }
+
+    assert graph(built) == graph(parsed)
+    assert not any("tiny" in f.name for f in built.functions.values())
+    assert len(built.functions) < len(stats)
+
+
+def test_profiler_dot_without_dump_dir():
+    with Profiler("graph") as prof:
+        work()
+    dot = prof.dot()
+    assert dot.startswith("digraph")
+    assert "fib" in dot
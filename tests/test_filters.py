@@ -0,0 +1,101 @@
+import sys
+
+import pytest
+from pyprofile import Profiler
+from pyprofile.filters import ModuleFilter, collapse_stats, module_name
+
+
+def outer():
+    return sum(inner(i) for i in range(50))
+
+
+def inner(i):
+    return i * 2
+
+
+def test_module_name_and_patterns():
+    assert module_name(__file__).endswith("test_filters")
+    assert module_name("~") == "builtins"
+    assert module_name("<frozen importlib._bootstrap>") == (
+        "importlib._bootstrap"
+    )
+
+    only_tests = ModuleFilter(include=["*test_filters"])
+    assert only_tests((__file__, 1, "outer"))
+    assert not only_tests(("~", 0, "<built-in method builtins.len>"))
+    no_inner = ModuleFilter(include=["*test_filters"], exclude=["*.inner"])
+    assert no_inner.code(outer.__code__)
+    assert not no_inner.code(inner.__code__)
+
+
+def test_collapse_stats_moves_time_to_nearest_kept_caller():
+    view = ("app.py", 1, "view")
+    helper = ("app.py", 9, "helper")
+    dispatch = ("django.py", 1, "dispatch")
+    middleware = ("django.py", 5, "middleware")
+    orm = ("django.py", 9, "orm")
+    stats = {
+        dispatch: (1, 1, 0.5, 10.0, {}),
+        middleware: (1, 1, 0.5, 9.5, {dispatch: (1, 1, 0.5, 9.5)}),
+        view: (1, 1, 1.0, 9.0, {middleware: (1, 1, 1.0, 9.0)}),
+        orm: (
+            4,
+            4,
+            6.0,
+            6.0,
+            {view: (3, 3, 4.5, 4.5), helper: (1, 1, 1.5, 1.5)},
+        ),
+        helper: (2, 2, 0.5, 2.0, {view: (2, 2, 0.5, 2.0)}),
+    }
+    collapsed = collapse_stats(stats, lambda func: func[0] == "app.py")
+
+    assert set(collapsed) == {view, helper}
+    # framework code around the view is left out
+    assert collapsed[view][4] == {}
+    assert collapsed[view][2] == pytest.approx(1.0 + 4.5)
+    assert collapsed[helper][2] == pytest.approx(0.5 + 1.5)
+    assert collapsed[helper][3] == 2.0
+
+
+def test_collapse_stats_discards_time_of_paths_without_kept_caller():
+    view = ("app.py", 1, "view")
+    dispatch = ("django.py", 1, "dispatch")
+    builtin = ("~", 0, "<built-in method builtins.len>")
+    stats = {
+        dispatch: (1, 1, 0.1, 1.12, {}),
+        view: (1, 1, 0.01, 0.02, {dispatch: (1, 1, 0.01, 0.02)}),
+        builtin: (
+            1001,
+            1001,
+            1.001,
+            1.001,
+            {dispatch: (1000, 1000, 1.0, 1.0), view: (1, 1, 0.001, 0.001)},
+        ),
+    }
+    collapsed = collapse_stats(stats, lambda func: func[0] == "app.py")
+
+    assert set(collapsed) == {view}
+    assert collapsed[view][2] == pytest.approx(0.011)
+    for cc, nc, tt, ct, callers in collapsed.values():
+        assert tt <= ct
+
+
+@pytest.mark.parametrize("engine", ["cprofile", "sampling", "monitoring"])
+def test_profiler_include(engine):
+    with Profiler(
+        "include",
+        engine=engine,
+        interval=0.001,
+        include=["*test_filters"],
+        exclude=["*.inner"],
+    ) as prof:
+        for _ in range(200):
+            outer()
+
+    functions = {prof.stats.key(row)[2] for row in range(len(prof.stats))}
+    assert "inner" not in functions
+    assert functions <= {"outer", "<genexpr>", "test_profiler_include"}
+    if engine != "sampling":
+        assert "outer" in functions
+    if engine == "monitoring" and sys.version_info >= (3, 12):
+        assert type(prof.profiler).__name__ == "MonitoringProfiler"
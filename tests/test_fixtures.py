@@ -0,0 +1,95 @@
+import pytest
+from pyprofile import profile
+from pyprofile.fixtures import FixtureStore, load_fixtures, replay
+
+calls = []
+
+
+def work(n, scale=1):
+    calls.append(n)
+    if n < 0:
+        raise ValueError(n)
+    return sum(range(n)) * scale
+
+
+def test_capture_and_replay(tmp_path):
+    store = FixtureStore(str(tmp_path / "store"))
+    captured = profile(capture=store, save_stats=False)(work)
+    assert captured(10, scale=2) == 90
+    captured(20, scale=2)
+    store.record("%s:work" % __name__, (-1,), {"scale": 2})
+    # not picklable, skipped rather than failing the call
+    assert store.record("%s:work" % __name__, (lambda: None,)) is False
+    assert store.recorded == 3 and store.skipped == 1
+
+    target = "%s:work" % __name__
+    assert store.targets() == {target: 3}
+    assert [fixture.args for fixture in store] == [(10,), (20,), (-1,)]
+
+    del calls[:]
+    result = replay(str(tmp_path / "store"), warmup=2, iterations=5)
+    # warmup and timed passes call every fixture, timed ones only count
+    assert len(calls) == 3 * 7
+    summary = result.summary()[target]
+    assert summary["count"] == 10 and summary["errors"] == 5
+    assert summary["p99"] >= summary["p50"] >= 0
+
+
+def test_replay_processes(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    for n in range(6):
+        store.record("%s:work" % __name__, (n,))
+    store.close()
+
+    result = replay(store, iterations=3, processes=2)
+    assert result.histograms["%s:work" % __name__].count == 18
+
+
+def test_replay_counts_unresolvable_targets(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    store.record("%s:renamed" % __name__, (1,))
+    store.record("%s:work" % __name__, (2,))
+
+    result = replay(store, warmup=0, iterations=2)
+    assert result.errors == {"%s:renamed" % __name__: 2}
+    assert result.histograms["%s:work" % __name__].count == 2
+
+
+def test_truncated_segment(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    store.record("%s:work" % __name__, (1,))
+    store.record("%s:work" % __name__, (2,))
+    store.close()
+    (segment,) = store.segments()
+    with open(segment, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    assert [fixture.args for fixture in store] == [(1,)]
+
+
+def test_resolve_unwraps_profiled_functions():
+    from pyprofile.fixtures import resolve
+
+    assert resolve("%s:decorated" % __name__) is decorated.__wrapped__
+    with pytest.raises(AttributeError):
+        resolve("%s:missing" % __name__)
+
+
+def test_load_fixtures_merges_every_match(tmp_path):
+    paths = []
+    for name, text in (("a.sql", "select 1;\n"), ("b.txt", "skipped\n")):
+        paths.append(tmp_path / name)
+        paths[-1].write_text(text)
+    paths.append(tmp_path / "c.sql")
+    paths[-1].write_text("select 2;\n")
+
+    assert (
+        load_fixtures(paths, raw=True, file_type="sql")
+        == "select 1;\nselect 2;\n"
+    )
+    assert load_fixtures(paths, raw=True, file_type="json") is None
+    assert load_fixtures(paths) is None
+
+
+@profile(save_stats=False)
+def decorated():
+    pass
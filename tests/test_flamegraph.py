@@ -0,0 +1,61 @@
+import io
+import time
+
+from pyprofile import Profiler
+from pyprofile.flamegraph import collapsed_from_stats, render_svg
+
+
+def leaf():
+    return sum(range(20000))
+
+
+def branch(n):
+    return [leaf() for _ in range(n)]
+
+
+def recurse(depth):
+    return recurse(depth - 1) if depth else leaf()
+
+
+def test_collapsed_from_call_graph():
+    with Profiler("flame") as prof:
+        branch(3)
+        recurse(5)
+
+    collapsed = collapsed_from_stats(prof.stats.to_stats_dict(), 0)
+    stacks = [stack.split(";") for stack in collapsed]
+    names = [[frame.split(" ")[0] for frame in stack] for stack in stacks]
+    assert any("branch" in stack and stack[-1] == "leaf" for stack in names)
+    assert any("recurse" in stack and stack[-1] == "leaf" for stack in names)
+    # recursion is folded, no function appears twice in a stack
+    assert all(len(stack) == len(set(stack)) for stack in stacks)
+
+    output = io.StringIO()
+    render_svg(collapsed, output, title="flame", icicle=True)
+    svg = output.getvalue()
+    assert svg.startswith("<?xml") and svg.rstrip().endswith("</svg>")
+    assert "leaf (test_flamegraph.py:" in svg
+
+
+def test_flamegraph_artifacts(tmp_path):
+    with Profiler(
+        "sampled",
+        dump_dir=tmp_path,
+        save_stats=True,
+        write_csv=False,
+        write_dot=False,
+        write_collapsed=True,
+        engine="sampling",
+        interval=0.001,
+    ):
+        end = time.monotonic() + 0.1
+        while time.monotonic() < end:
+            leaf()
+
+    (svg,) = tmp_path.glob("stats_sampled_*.svg")
+    assert "leaf" in svg.read_text()
+    (folded,) = tmp_path.glob("stats_sampled_*.folded")
+    assert all(
+        line.rsplit(" ", 1)[1].isdigit()
+        for line in folded.read_text().splitlines()
+    )
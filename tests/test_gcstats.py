@@ -0,0 +1,46 @@
+import gc
+
+from pyprofile import Profiler
+from pyprofile.gcstats import GCMonitor
+
+
+def make_cycles(count):
+    for _ in range(count):
+        a = []
+        a.append(a)
+
+
+def test_monitor_records_collections():
+    outer = GCMonitor().start()
+    inner = GCMonitor(max_collections=1).start()
+    make_cycles(100)
+    gc.collect()
+    gc.collect(0)
+    stats = inner.stop()
+    gc.collect()
+    outer_stats = outer.stop()
+
+    assert stats.count == 2
+    assert len(stats.collections) == 1
+    generation, seconds, collected, uncollectable = stats.collections[0]
+    assert (generation, uncollectable) == (2, 0)
+    assert collected >= 100
+    assert stats.pause >= stats.max_pause >= seconds > 0
+    assert stats.generations[2]["collections"] == 1
+    assert stats.generations[2]["collected"] >= 100
+    assert outer_stats.count == 3
+    assert not [
+        cb for cb in gc.callbacks if cb.__module__ == "pyprofile.gcstats"
+    ]
+
+
+def test_profiler_gc_mode():
+    with Profiler("gc", gc=True) as prof:
+        make_cycles(100)
+        gc.collect()
+    assert prof.stats.gc.count >= 1
+    assert prof.stats.meta["gc"]["collections"] == prof.stats.gc.count
+
+    with Profiler("no_gc") as prof:
+        gc.collect()
+    assert prof.stats.gc is None
@@ -0,0 +1,86 @@
+import json
+import threading
+
+from pyprofile import Profiler
+from pyprofile.histogram import (
+    OTHER,
+    Histogram,
+    HistogramRegistry,
+    SnapshotExporter,
+    registry,
+)
+
+
+def test_percentiles_and_merge():
+    histogram = Histogram("block")
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000.0)
+
+    p50, p99 = histogram.percentiles(50, 99)
+    assert abs(p50 - 0.5) < 0.5 / 64
+    assert abs(p99 - 0.99) < 0.99 / 64
+    assert histogram.count == 1000
+    assert histogram.max == 1.0
+
+    other = Histogram("block")
+    threads = [
+        threading.Thread(target=other.record, args=(2.0,)) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.merge(other)
+    assert histogram.count == 1004
+    assert abs(histogram.percentile(100) - 2.0) < 2.0 / 64
+
+    restored = Histogram.from_snapshot(
+        json.loads(json.dumps(histogram.snapshot()))
+    )
+    assert list(restored.counts()) == list(histogram.counts())
+
+
+def test_profiler_records_and_exporter(tmp_path):
+    with Profiler("histogram_block"):
+        pass
+    assert registry.get("histogram_block").count == 1
+
+    path = tmp_path / "histograms.jsonl"
+    SnapshotExporter(path=str(path)).export()
+    snapshot = json.loads(path.read_text())["histograms"]["histogram_block"]
+    assert snapshot["count"] == 1
+    assert registry.get("histogram_block").count == 0
+
+
+def test_registry_default_cap_bounds_shard_memory():
+    histograms = HistogramRegistry()
+    for route in range(500):
+        histograms.record("/orders/%d" % route, 0.001)
+    shard_bytes = sum(
+        counts.itemsize * len(counts)
+        for name in histograms.names()
+        for counts, _ in histograms.get(name)._shards.values()
+    )
+    assert len(histograms.names()) <= 101
+    assert shard_bytes < 2 * 1024 * 1024
+
+
+def test_registry_caps_names_and_prunes_threads():
+    histograms = HistogramRegistry(max_names=2)
+    for path in ("/orders/1", "/orders/2", "/orders/3", "/orders/4"):
+        histograms.record(path, 0.001)
+    assert histograms.names() == sorted(["/orders/1", "/orders/2", OTHER])
+    assert histograms.get("/orders/5").count == 2
+
+    histogram = histograms.get("/orders/1")
+    threads = [
+        threading.Thread(target=histogram.record, args=(0.002,))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert histograms.snapshot()["/orders/1"]["count"] == 9
+    assert len(histogram._shards) == 2
+    assert histogram.max == 0.002
@@ -0,0 +1,74 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+# cumulative time of "import pyprofile" reported by -X importtime, free
+# of interpreter startup; it takes about 1 ms, as "import cProfile" does
+IMPORT_BUDGET_SECONDS = 0.05
+
+SCRIPT = """
+import json, sys
+
+import pyprofile
+import pyprofile.contrib.django
+import pyprofile.contrib.django.sql_profiler
+
+@pyprofile.profile
+def decorated():
+    pass
+
+@pyprofile.profile(enabled=False)
+def disabled():
+    pass
+
+print(json.dumps({
+    "modules": sorted(sys.modules),
+    "disabled": disabled.__module__ == "__main__" and disabled.__name__,
+}))
+"""
+
+
+def run_script(*options, script=SCRIPT):
+    return subprocess.run(
+        [sys.executable] + list(options) + ["-c", script],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+
+
+def test_import_and_decorate_are_lazy():
+    result = json.loads(run_script().stdout)
+
+    loaded = set(result["modules"])
+    for module in (
+        "gprof2dot",
+        "pstats",
+        "inspect",
+        "datetime",
+        "concurrent.futures",
+        "tracemalloc",
+        "mmap",
+        "zlib",
+        "django.conf",
+        "django.db",
+        "pyprofile.aggregate",
+        "pyprofile.memory",
+        "pyprofile.publishers",
+        "pyprofile.stats",
+        "pyprofile.store",
+    ):
+        assert module not in loaded, module
+    assert result["disabled"] == "disabled"
+
+
+def test_import_time_budget():
+    stderr = run_script("-X", "importtime", script="import pyprofile").stderr
+    (microseconds,) = re.findall(
+        r"^import time:\s+\d+ \|\s+(\d+) \| pyprofile$", stderr, re.M
+    )
+    assert int(microseconds) / 1e6 < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,89 @@
+import threading
+import tracemalloc
+
+from pyprofile import Profiler
+from pyprofile.memory import MemoryProfiler
+
+retained = []
+
+
+def allocate():
+    retained.append([bytearray(1024) for _ in range(1000)])
+
+
+def test_memory_mode(tmp_path):
+    with Profiler(
+        "memory",
+        dump_dir=tmp_path,
+        save_stats=True,
+        write_csv=False,
+        write_dot=False,
+        write_flamegraph=False,
+        memory=True,
+        memory_frames=3,
+        memory_key_type="traceback",
+    ) as prof:
+        allocate()
+
+    memory = prof.stats.memory
+    assert not tracemalloc.is_tracing()
+    assert memory.net > 1000 * 1024
+    assert memory.peak >= memory.end
+    assert prof.stats.meta["memory"]["net"] == memory.net
+    size_diff, _, _, _, filename, _, traceback = memory.rows[0]
+    assert size_diff > 1000 * 1024
+    assert filename == __file__
+    assert traceback.endswith("%s:%d" % (filename, memory.rows[0][5]))
+    assert traceback.count(";") == 2
+
+    (csv_file,) = tmp_path.glob("stats_memory_*.mem.csv")
+    assert csv_file.read_text().startswith("size_diff,count_diff")
+    retained.clear()
+
+
+def test_memory_mode_nested_in_tracing():
+    tracemalloc.start()
+    try:
+        with Profiler("memory_nested", memory=True) as prof:
+            allocate()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert prof.stats.memory.rows[0][0] > 1000 * 1024
+    retained.clear()
+
+
+def test_memory_profiles_overlapping_in_threads():
+    first = MemoryProfiler().start()
+    second_started = threading.Event()
+    first_stopped = threading.Event()
+    results = []
+
+    def second():
+        profiler = MemoryProfiler().start()
+        second_started.set()
+        first_stopped.wait(5)
+        allocate()
+        results.append(profiler.stop())
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    second_started.wait(5)
+    first.stop()
+    assert tracemalloc.is_tracing()
+    first_stopped.set()
+    thread.join()
+
+    assert not tracemalloc.is_tracing()
+    assert results[0].rows[0][0] > 1000 * 1024
+    retained.clear()
+
+
+def test_nested_memory_profile_keeps_outer_peak():
+    outer = MemoryProfiler().start()
+    # freed before the inner profile starts, only the peak remembers it
+    del [bytearray(1024) for _ in range(4000)][:]
+    inner = MemoryProfiler().start()
+    inner.stop()
+    stats = outer.stop()
+    assert stats.peak - stats.start > 4000 * 1024
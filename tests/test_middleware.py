@@ -0,0 +1,228 @@
+import asyncio
+import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+django = pytest.importorskip("django")
+
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=True,
+        PROFILING=True,
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": ":memory:",
+            }
+        },
+    )
+    django.setup()
+
+from django.http import HttpResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.urls import ResolverMatch  # noqa: E402
+from pyprofile.contrib.django.middleware import (  # noqa: E402
+    RequestProfilingMiddleware,
+    SamplingPolicy,
+    current_profiler,
+)
+from pyprofile.histogram import registry  # noqa: E402
+
+
+def test_sampling_policy_rate_and_cap():
+    policy = SamplingPolicy(sample_rate=2, max_per_second=1)
+
+    picked = [policy.should_profile("/") for _ in range(6)]
+    assert picked.count(True) <= 2
+    assert picked[0] is False and picked[1] is True
+
+
+def test_sampling_policy_profiles_slow_paths_once():
+    policy = SamplingPolicy(slow_threshold=0.1)
+
+    policy.record("/slow", 0.5, profiled=False)
+    assert policy.should_profile("/slow")
+    policy.record("/slow", None, profiled=True)
+    assert not policy.should_profile("/slow")
+
+
+def test_middleware_persists_sampled_requests(tmp_path, monkeypatch):
+    seen = []
+
+    def view(request):
+        seen.append(current_profiler())
+        return HttpResponse(b"body")
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(
+        settings, "PROFILER_DUMP", str(tmp_path), raising=False
+    )
+    middleware = RequestProfilingMiddleware(view)
+    response = middleware(RequestFactory().get("/orders/"))
+
+    assert response.content == b"body"
+    assert seen[0] is not None and current_profiler() is None
+    assert list(tmp_path.glob("stats__orders__*.csv"))
+
+
+def test_middleware_propagates_view_errors(monkeypatch):
+    def view(request):
+        raise KeyError("missing")
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(settings, "PROFILER_SAVE_STATS", False, raising=False)
+    middleware = RequestProfilingMiddleware(view)
+    with pytest.raises(KeyError):
+        middleware(RequestFactory().get("/broken/"))
+    assert current_profiler() is None
+
+
+def test_middleware_records_durations_per_view(monkeypatch):
+    def view(request):
+        # set by the URL resolver before the view runs
+        request.resolver_match = ResolverMatch(
+            view, (), {"pk": 42}, url_name="order-detail"
+        )
+        return HttpResponse(b"body")
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(settings, "PROFILER_SAVE_STATS", False, raising=False)
+    middleware = RequestProfilingMiddleware(view)
+    middleware(RequestFactory().get("/orders/42/"))
+
+    assert registry.get("order-detail").count == 1
+    assert "_orders_42_" not in registry.names()
+
+
+def test_async_middleware(tmp_path, monkeypatch):
+    async def view(request):
+        await asyncio.sleep(0)
+        return HttpResponse(b"async body")
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(
+        settings, "PROFILER_DUMP", str(tmp_path), raising=False
+    )
+    middleware = RequestProfilingMiddleware(view)
+    response = asyncio.run(middleware(RequestFactory().get("/async/")))
+
+    assert response.content == b"async body"
+    assert list(tmp_path.glob("stats__async__*.csv"))
+
+
+def test_middleware_shows_memory(monkeypatch):
+    def view(request):
+        return HttpResponse(b"x" * 100000)
+
+    monkeypatch.setattr(settings, "PROFILING_MEMORY", True, raising=False)
+    middleware = RequestProfilingMiddleware(view)
+    response = middleware(RequestFactory().get("/memory/?prof"))
+
+    assert b"---- Memory ----" in response.content
+
+
+def test_middleware_concurrent_requests(monkeypatch):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def view(request):
+        barrier.wait()
+        sum(range(10000))
+        barrier.wait()
+        return HttpResponse(b"concurrent")
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(settings, "PROFILER_SAVE_STATS", False, raising=False)
+    middleware = RequestProfilingMiddleware(view)
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(
+            pool.map(
+                middleware,
+                [RequestFactory().get("/concurrent/") for _ in range(2)],
+            )
+        )
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert [response.content for response in responses] == [b"concurrent"] * 2
+
+
+def test_middleware_shows_gc(monkeypatch):
+    def view(request):
+        gc.collect()
+        return HttpResponse(b"collected")
+
+    monkeypatch.setattr(settings, "PROFILING_GC", True, raising=False)
+    middleware = RequestProfilingMiddleware(view)
+    response = middleware(RequestFactory().get("/gc/?prof"))
+
+    assert b"---- GC ----" in response.content
+
+
+def test_middleware_captures_sampled_requests(tmp_path, monkeypatch):
+    from pyprofile.contrib.django.capture import REPLAY_TARGET
+    from pyprofile.fixtures import FixtureStore
+
+    monkeypatch.setattr(settings, "PROFILING_SAMPLE_RATE", 1, raising=False)
+    monkeypatch.setattr(settings, "PROFILER_SAVE_STATS", False, raising=False)
+    monkeypatch.setattr(
+        settings, "PROFILING_CAPTURE_DIR", str(tmp_path), raising=False
+    )
+    middleware = RequestProfilingMiddleware(lambda request: HttpResponse())
+    middleware(
+        RequestFactory().post(
+            "/orders/?page=2",
+            b'{"id": 1}',
+            content_type="application/json",
+            HTTP_COOKIE="secret",
+            HTTP_X_TENANT="acme",
+        )
+    )
+
+    (fixture,) = FixtureStore(str(tmp_path))
+    assert fixture.target == REPLAY_TARGET
+    method, path, body, content_type, headers = fixture.args
+    assert (method, path, body) == ("POST", "/orders/?page=2", b'{"id": 1}')
+    assert content_type == "application/json"
+    assert headers == {"HTTP_X_TENANT": "acme"}
+
+
+def test_capture_leaves_credentials_out(tmp_path):
+    from pyprofile.contrib.django.capture import capture_request
+    from pyprofile.fixtures import FixtureStore
+
+    store = FixtureStore(str(tmp_path))
+    capture_request(
+        store,
+        RequestFactory().post(
+            "/login/",
+            {"username": "ann", "password": "hunter2"},
+            HTTP_X_API_KEY="key",
+            HTTP_PROXY_AUTHORIZATION="Basic abc",
+            HTTP_X_CSRFTOKEN="token",
+            HTTP_X_TENANT="acme",
+        ),
+    )
+    capture_request(
+        store,
+        RequestFactory().post("/orders/", {"id": 1}, HTTP_X_TENANT="acme"),
+    )
+
+    login, orders = FixtureStore(str(tmp_path))
+    _, _, body, _, headers = login.args
+    assert headers == {"HTTP_X_TENANT": "acme"}
+    assert body == b""
+    assert b'name="id"' in orders.args[2]
+
+
+def test_middleware_shows_dot_without_dump_dir(monkeypatch):
+    pytest.importorskip("gprof2dot")
+
+    monkeypatch.setattr(settings, "PROFILER_SAVE_STATS", False, raising=False)
+    middleware = RequestProfilingMiddleware(lambda request: HttpResponse())
+    response = middleware(RequestFactory().get("/graph/?prof=dot"))
+
+    assert response["Content-Type"].startswith("text/vnd.graphviz")
+    assert response.content.startswith(b"digraph")
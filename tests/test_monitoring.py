@@ -0,0 +1,166 @@
+import sys
+
+import pytest
+from pyprofile import Profiler
+from pyprofile.publishers import Publisher
+
+requires_monitoring = pytest.mark.skipif(
+    sys.version_info < (3, 12), reason="sys.monitoring is Python 3.12+"
+)
+
+
+def leaf(x):
+    return x + 1
+
+
+def loop(n):
+    total = 0
+    for i in range(n):
+        total += leaf(i)
+    return total
+
+
+def recurse(n):
+    return 0 if n == 0 else recurse(n - 1) + 1
+
+
+def fail():
+    raise ValueError
+
+
+def numbers():
+    for i in range(3):
+        yield leaf(i)
+
+
+def calls(prof, name):
+    for row in range(len(prof.stats)):
+        if prof.stats.key(row)[2] == name:
+            return prof.stats.calls[row], prof.stats.prim_calls[row]
+    return None
+
+
+@requires_monitoring
+def test_monitoring_engine_counts_calls():
+    with Profiler("monitoring", engine="monitoring", max_calls=0) as prof:
+        loop(100)
+        recurse(5)
+        list(numbers())
+        with pytest.raises(ValueError):
+            fail()
+
+    assert calls(prof, "leaf") == (103, 103)
+    assert calls(prof, "recurse") == (6, 1)
+    assert calls(prof, "fail") == (1, 1)
+    # one call per resumption, like cProfile
+    assert calls(prof, "numbers") == (4, 4)
+    assert prof.stats.meta["engine"] == "monitoring"
+
+
+@requires_monitoring
+def test_monitoring_engine_retires_hot_functions():
+    with Profiler("retired", engine="monitoring", max_calls=10) as prof:
+        loop(1000)
+    assert calls(prof, "leaf") == (10, 10)
+    assert calls(prof, "loop") == (1, 1)
+
+    # disabled events come back with the next profile
+    with Profiler("again", engine="monitoring", max_calls=10) as prof:
+        loop(1000)
+    assert calls(prof, "leaf") == (10, 10)
+
+
+@requires_monitoring
+def test_monitoring_engine_keeps_events_disabled_by_other_tools():
+    monitoring = sys.monitoring
+    seen = []
+
+    def on_start(code, offset):
+        if code is leaf.__code__:
+            seen.append(code)
+            return monitoring.DISABLE
+
+    monitoring.use_tool_id(monitoring.DEBUGGER_ID, "other")
+    try:
+        monitoring.register_callback(
+            monitoring.DEBUGGER_ID, monitoring.events.PY_START, on_start
+        )
+        monitoring.set_events(
+            monitoring.DEBUGGER_ID, monitoring.events.PY_START
+        )
+        loop(10)
+        for _ in range(2):
+            with Profiler("other", engine="monitoring", max_calls=5) as prof:
+                loop(10)
+            assert calls(prof, "leaf") == (5, 5)
+        assert prof.profiler._tool_id is None
+        assert len(seen) == 1
+    finally:
+        monitoring.set_events(monitoring.DEBUGGER_ID, 0)
+        monitoring.register_callback(
+            monitoring.DEBUGGER_ID, monitoring.events.PY_START, None
+        )
+        monitoring.free_tool_id(monitoring.DEBUGGER_ID)
+
+
+@requires_monitoring
+def test_monitoring_engine_lines(tmp_path):
+    published = []
+
+    class Recorder(Publisher):
+        def submit(self, fn, stats, artifacts):
+            published.append(artifacts)
+            fn(stats, artifacts)
+
+    with Profiler(
+        "lines",
+        dump_dir=str(tmp_path),
+        save_stats=True,
+        write_flamegraph=False,
+        write_dot=False,
+        engine="monitoring",
+        lines=["loop"],
+        publisher=Recorder(),
+    ) as prof:
+        loop(10)
+
+    (timings,) = [
+        timings
+        for (_, _, name), timings in prof.stats.line_stats.items()
+        if name == "loop"
+    ]
+    first = loop.__code__.co_firstlineno
+    assert set(timings) >= {first + 1, first + 2, first + 4}
+    assert all(seconds >= 0 for _, seconds in timings.values())
+    text = open(published[0]["lines"]).read()
+    assert text.startswith("filename,function,lineno,hits,seconds\n")
+    assert ",loop,%d," % (first + 4) in text
+
+
+def test_monitoring_engine_falls_back_to_cprofile(monkeypatch):
+    from pyprofile import monitoring
+
+    monkeypatch.setattr(monitoring, "available", lambda: False)
+    with Profiler("fallback", engine="monitoring") as prof:
+        loop(10)
+    assert type(prof.profiler).__name__ == "Profile"
+    assert calls(prof, "leaf") == (10, 10)
+    assert prof.stats.meta["engine"] == "cprofile"
+
+
+@requires_monitoring
+def test_monitoring_engine_falls_back_when_ids_go(monkeypatch):
+    from pyprofile import monitoring
+
+    # the ids get taken between available() and enable()
+    monkeypatch.setattr(monitoring, "available", lambda: True)
+    for tool_id in monitoring.TOOL_IDS:
+        sys.monitoring.use_tool_id(tool_id, "other")
+    try:
+        with Profiler("taken", engine="monitoring") as prof:
+            loop(10)
+    finally:
+        for tool_id in monitoring.TOOL_IDS:
+            sys.monitoring.free_tool_id(tool_id)
+    assert prof.stats.meta["engine"] == "cprofile"
+    assert calls(prof, "leaf") == (10, 10)
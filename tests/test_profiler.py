@@ -1,7 +1,12 @@
+import asyncio
+import signal
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
-from pyprofile import profile
+from pyprofile import Profiler, profile
+from pyprofile.publishers import Publisher
 
 
 @pytest.fixture
@@ -28,3 +33,94 @@ def test_profile_decorator(dump_dir):
 
     assert fn() == 2, "fn with no parameters failed."
     assert fn_with_parameters(5) == 5, "fn with parameters failed."
+
+
+def test_sampling_engine(dump_dir):
+    @profile(dump_dir=dump_dir, save_stats=True, engine="sampling")
+    def spin(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            pass
+        return seconds
+
+    assert spin(0.2) == 0.2
+    csv_files = list(dump_dir.glob("stats_spin_*.csv"))
+    assert csv_files, "sampling engine did not publish a csv."
+    assert "spin" in csv_files[0].read_text()
+
+    with Profiler("empty", engine="sampling", interval=10) as prof:
+        pass
+    assert len(prof.stats) == 0
+
+
+@pytest.mark.skipif(
+    not hasattr(signal, "setitimer"), reason="needs signal.setitimer"
+)
+def test_signal_sampling_outside_main_thread():
+    def spin():
+        with Profiler(
+            "worker", engine="sampling", sampling_mode="signal"
+        ) as prof:
+            end = time.monotonic() + 0.1
+            while time.monotonic() < end:
+                pass
+        return prof
+
+    with ThreadPoolExecutor(1) as executor:
+        prof = executor.submit(spin).result()
+
+    assert prof.engine_used == "sampling"
+    assert prof.profiler.mode == "thread"
+    assert prof.profiler.samples
+
+
+def test_profile_coroutine_keeps_tasks_apart():
+    profilers = []
+
+    class Recorder(Publisher):
+        def submit(self, fn, *args):
+            profilers.append(args[0])
+            return True
+
+    @profile(dump_dir="unused", save_stats=True, publisher=Recorder())
+    async def task(name, delay):
+        await asyncio.sleep(delay)
+        return name
+
+    async def main():
+        return await asyncio.gather(task("a", 0.2), task("b", 0.1))
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert len(profilers) == 2
+    for stats in profilers:
+        assert stats.meta["wall_time"] >= 0.1
+        assert stats.meta["cpu_time"] < stats.meta["wall_time"]
+        assert not any(
+            stats.strings[stats.func_ids[row]] == "main"
+            for row in range(len(stats))
+        )
+
+
+@pytest.mark.parametrize("engine", ["cprofile", "sampling", "monitoring"])
+def test_profile_threads(engine):
+    def spin(seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            pass
+
+    with Profiler("threads", engine=engine, threads=True) as prof:
+        with ThreadPoolExecutor(2) as executor:
+            list(executor.map(spin, [0.1, 0.1]))
+
+    functions = {prof.stats.key(row)[2] for row in range(len(prof.stats))}
+    assert "spin" in functions
+    if engine != "cprofile" or sys.version_info < (3, 12):
+        assert len(prof.thread_stats()) >= 2
+
+
+def test_profile_threads_unhooks_pool_threads():
+    with ThreadPoolExecutor(1) as executor:
+        with Profiler("threads", threads=True):
+            executor.submit(sum, range(10)).result()
+        # the next task runs without the collector of the profile
+        assert executor.submit(sys.getprofile).result() is None
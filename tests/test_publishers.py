@@ -0,0 +1,49 @@
+import gc
+import threading
+import weakref
+
+from pyprofile import Profiler
+from pyprofile.publishers import BackgroundPublisher
+
+
+def test_background_publisher_flush(tmp_path):
+    publisher = BackgroundPublisher(maxsize=4)
+    with Profiler(
+        "bg", dump_dir=tmp_path, save_stats=True, publisher=publisher
+    ):
+        sum(range(1000))
+
+    assert publisher.flush(timeout=10)
+    assert publisher.published == 1
+    assert list(tmp_path.glob("stats_bg_*.csv"))
+    assert list(tmp_path.glob("stats_bg_*.dot"))
+    publisher.shutdown()
+
+
+def test_background_publisher_drops_on_overflow():
+    release = threading.Event()
+    publisher = BackgroundPublisher(maxsize=1, overflow="drop")
+
+    assert publisher.submit(release.wait)
+    # wait for the worker to pick the blocking job up
+    while publisher._queue.qsize():
+        pass
+    assert publisher.submit(release.wait)
+    assert not publisher.submit(release.wait)
+    assert publisher.dropped == 1
+
+    release.set()
+    assert publisher.flush(timeout=10)
+    assert publisher.published == 2
+    publisher.shutdown()
+
+
+def test_background_publisher_is_collected_after_shutdown():
+    publisher = BackgroundPublisher()
+    publisher.submit(sum, range(10))
+    publisher.shutdown()
+    ref = weakref.ref(publisher)
+
+    del publisher
+    gc.collect()
+    assert ref() is None
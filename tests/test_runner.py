@@ -0,0 +1,89 @@
+import signal
+import sys
+
+import pytest
+from pyprofile.runner import main
+
+SCRIPT = """
+import sys
+import time
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(100))
+
+
+for _ in range(int(sys.argv[1])):
+    busy(0.05)
+if len(sys.argv) > 2:
+    sys.exit(int(sys.argv[2]))
+"""
+
+
+@pytest.fixture
+def script(tmp_path):
+    path = tmp_path / "busy_script.py"
+    path.write_text(SCRIPT)
+    return path
+
+
+def test_run_script(tmp_path, script):
+    dump_dir = tmp_path / "out"
+    assert (
+        main(
+            [
+                "run",
+                "-o",
+                str(dump_dir),
+                "--format",
+                "csv,json",
+                str(script),
+                "2",
+            ]
+        )
+        == 0
+    )
+    (csv_file,) = dump_dir.glob("stats_busy_script_*.csv")
+    assert "busy" in csv_file.read_text()
+    assert list(dump_dir.glob("stats_busy_script_*.json"))
+    assert not list(dump_dir.glob("*.dot"))
+
+
+def test_run_module_prints_report(tmp_path, script, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    assert main(["run", "-m", "busy_script", "1", "3"]) == 3
+    assert "busy_script.py" in capsys.readouterr().out
+    assert "busy_script" not in sys.modules
+
+
+@pytest.mark.skipif(
+    not hasattr(signal, "setitimer"), reason="needs signal.setitimer"
+)
+def test_run_interval_snapshots(tmp_path, script):
+    dump_dir = tmp_path / "out"
+    assert (
+        main(
+            [
+                "run",
+                "-o",
+                str(dump_dir),
+                "--interval",
+                "0.1",
+                "--name",
+                "windows",
+                str(script),
+                "8",
+            ]
+        )
+        == 0
+    )
+    csv_files = sorted(dump_dir.glob("stats_windows_*.csv"))
+    assert len(csv_files) >= 3
+    assert signal.getsignal(signal.SIGALRM) == signal.SIG_DFL
+
+
+def test_run_rejects_unknown_format(script):
+    with pytest.raises(SystemExit):
+        main(["run", "--format", "svg", str(script), "1"])
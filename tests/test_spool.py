@@ -0,0 +1,37 @@
+from pyprofile import Profiler
+from pyprofile.spool import main, merge_spool
+
+
+def test_spool_and_merge(tmp_path):
+    for _ in range(3):
+        with Profiler(
+            "orders", dump_dir=tmp_path, save_stats=True, spool=True
+        ):
+            sorted(range(1000))
+    spool_files = list((tmp_path / "spool").iterdir())
+    assert len(spool_files) == 3
+
+    merged = merge_spool([str(tmp_path / "spool")], window=0, jobs=2)
+    (stats,) = merged.values()
+    assert stats.meta["profiles"] == 3
+    row = next(
+        row
+        for row in range(len(stats))
+        if stats.key(row)[2] == "<built-in method builtins.sorted>"
+    )
+    assert stats.calls[row] == 3
+
+    assert (
+        main(
+            [
+                "merge",
+                str(tmp_path / "spool"),
+                "-o",
+                str(tmp_path / "out"),
+                "--window",
+                "0",
+            ]
+        )
+        == 0
+    )
+    assert list((tmp_path / "out").glob("stats_orders_0.csv"))
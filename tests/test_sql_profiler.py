@@ -0,0 +1,151 @@
+import gc
+import logging
+
+import pytest
+
+django = pytest.importorskip("django")
+
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure(
+        DEBUG=True,
+        PROFILING=True,
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": ":memory:",
+            }
+        },
+    )
+    django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from pyprofile.contrib.django.queries import fingerprint  # noqa: E402
+from pyprofile.contrib.django.sql_profiler import Profiler  # noqa: E402
+
+
+def test_fingerprint_strips_literals():
+    assert fingerprint(
+        "SELECT * FROM t WHERE a = 'x''y' AND b IN (1, 2, 3) AND c = %s"
+    ) == fingerprint("SELECT * FROM t WHERE a = 'z' AND b IN (4) AND c = %s")
+    assert fingerprint("SELECT a::integer FROM t") == (
+        "SELECT a::integer FROM t"
+    )
+
+
+def test_capture_without_debug_flags_n_plus_one(caplog):
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TABLE items (id integer)")
+
+    with override_settings(DEBUG=False), caplog.at_level(logging.DEBUG):
+        with Profiler("items", profile_sql=True) as prof:
+            with connection.cursor() as cursor:
+                for i in range(12):
+                    cursor.execute("SELECT id FROM items WHERE id = %s", [i])
+                cursor.execute("SELECT count(*) FROM items")
+
+    assert prof.queries.count == 13
+    (suspect,) = prof.queries.n_plus_one_suspects()
+    assert suspect.count == 12
+    assert suspect.fingerprint == "SELECT id FROM items WHERE id = ?"
+    assert suspect.percentile(99) >= suspect.percentile(50) > 0
+    assert "possible N+1" in caplog.text
+
+
+def test_query_log_ring_buffer_single_record(caplog):
+    with override_settings(PROFILING_SQL_LOG_SIZE=5), caplog.at_level(
+        logging.DEBUG
+    ):
+        with Profiler("ring", profile_sql=True) as prof:
+            with connection.cursor() as cursor:
+                for i in range(20):
+                    cursor.execute("SELECT %s", [i])
+
+    query_log = prof.queries.log
+    assert len(query_log) == 5
+    assert query_log.dropped == 15
+    records = query_log.records()
+    offsets = [record["offset"] for record in records]
+    assert offsets == sorted(offsets)
+    assert {record["alias"] for record in records} == {"default"}
+
+    (record,) = [r for r in caplog.records if hasattr(r, "queries")]
+    assert record.queries == records
+    assert record.queries_dropped == 15
+    assert record.fingerprints[0]["count"] == 20
+
+
+def test_query_log_slow_only_and_async(caplog):
+    with override_settings(
+        PROFILING_SQL_LOG_SLOW=60.0, PROFILING_SQL_LOG_ASYNC=True
+    ), caplog.at_level(logging.DEBUG):
+        with Profiler("slow", profile_sql=True) as prof:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        from pyprofile.contrib.django.sql_profiler import (
+            get_query_log_publisher,
+        )
+
+        get_query_log_publisher().flush()
+
+    assert len(prof.queries.log) == 0
+    assert prof.queries.log.skipped == 1
+    (record,) = [r for r in caplog.records if hasattr(r, "queries")]
+    assert record.queries == [] and record.queries_skipped == 1
+
+
+def test_trace_nested_blocks_and_queries(tmp_path):
+    import json
+
+    with override_settings(PROFILING_TRACE_DIR=str(tmp_path)):
+        with Profiler("view", profile_sql=True):
+            with Profiler("service", profile_sql=True):
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.execute("SELECT 2")
+        with Profiler("other"):
+            pass
+
+    paths = sorted(tmp_path.glob("trace_*.json"))
+    assert [path.name.split("_")[1] for path in paths] == ["other", "view"]
+    events = json.loads(paths[1].read_text())
+    slices = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(slices) == {"view", "service", "SELECT 1", "SELECT 2"}
+    assert {e["tid"] for e in slices.values()} == {slices["view"]["tid"]}
+    view, service = slices["view"], slices["service"]
+    assert view["ts"] <= service["ts"]
+    assert service["ts"] + service["dur"] <= view["ts"] + view["dur"]
+    assert slices["SELECT 1"]["cat"] == "sql"
+    assert slices["SELECT 1"]["ts"] >= service["ts"]
+    assert view["args"]["sql_count"] == 2
+
+
+def test_trace_window_writer(tmp_path):
+    import json
+
+    from pyprofile.trace import Tracer
+
+    tracer = Tracer(str(tmp_path), mode="window", buffer_size=2)
+    for i in range(5):
+        with tracer.span("block %d" % i):
+            with tracer.span("child"):
+                pass
+    (path,) = tmp_path.glob("trace_*.json")
+    # readable before the window is closed, the array left open
+    assert path.read_text().startswith("[\n{")
+    tracer.close()
+    events = json.loads(path.read_text())
+    assert len([e for e in events if e["ph"] == "X"]) == 10
+    assert len({e["tid"] for e in events}) == 5
+
+
+def test_gc_pauses_in_performance(caplog):
+    with caplog.at_level(logging.INFO):
+        with Profiler("collecting", profile_gc=True):
+            gc.collect()
+
+    (record,) = [r for r in caplog.records if hasattr(r, "performance")]
+    assert record.performance["gc"]["collections"] >= 1
+    assert record.performance["gc"]["pause_seconds"] > 0
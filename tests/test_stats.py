@@ -0,0 +1,38 @@
+import cProfile
+import io
+import pstats
+
+from pyprofile.stats import StructuredStats
+
+
+def _workload(n):
+    return sum(i * i for i in range(n))
+
+
+def _structured_stats():
+    prof = cProfile.Profile()
+    prof.runcall(_workload, 1000)
+    return StructuredStats.from_pstats(pstats.Stats(prof), {"name": "t"})
+
+
+def test_binary_round_trip():
+    stats = _structured_stats()
+    buf = io.BytesIO()
+    stats.to_binary(buf)
+    buf.seek(0)
+    loaded = StructuredStats.from_binary(buf)
+
+    assert loaded.meta == {"name": "t"}
+    assert loaded.to_stats_dict() == stats.to_stats_dict()
+
+
+def test_csv_and_pstats_compatibility():
+    stats = _structured_stats()
+    out = io.StringIO()
+    stats.to_csv(out)
+    lines = out.getvalue().splitlines()
+
+    assert lines[0].startswith("ncalls,primcalls,tottime")
+    assert len(lines) == len(stats) + 1
+    assert any("_workload" in line for line in lines)
+    assert pstats.Stats(stats).total_calls == sum(stats.calls)
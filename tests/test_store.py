@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+import time
+
+from pyprofile import Profiler
+from pyprofile.store import ProfileStore, get_store, main
+
+
+def work(size):
+    return sorted(range(size), key=lambda value: -value)
+
+
+def test_store_query_load_and_top(tmp_path):
+    for label in ("orders", "users", "orders"):
+        with Profiler(label, dump_dir=tmp_path, save_stats=True, store=True):
+            work(20000)
+    assert not list(tmp_path.glob("stats_*"))
+
+    store = get_store(tmp_path / "store")
+    assert store.labels() == {"orders": 2, "users": 1}
+    refs = store.query(label="orders", since=time.time() - 3600)
+    assert len(refs) == 2
+    assert refs[0].pid == os.getpid()
+    assert not store.query(until=time.time() - 3600)
+    assert len(store.segments()) == 1
+
+    stats = store.load(refs[0])
+    assert stats.meta["label"] == "orders"
+    assert len(stats) == refs[0].functions
+    assert any(key[2] == "work" for key in stats.to_stats_dict())
+
+    top = store.top(refs[0], 2)
+    assert [row[2] for row in top] == sorted(stats.tottime, reverse=True)[:2]
+    ((key, calls, tottime, cumtime),) = store.top(refs[0], 1, sort="calls")
+    assert key[2] == "<lambda>"
+    assert calls == 20000
+    assert stats.to_stats_dict()[key][1] == calls
+
+    (total,) = [
+        row
+        for row in store.top_functions(refs, 50, sort="calls")
+        if row[0] == key
+    ]
+    assert total[1] == 40000
+
+
+def test_store_round_trips_edges(tmp_path):
+    with Profiler("edges") as prof:
+        work(1000)
+    store = ProfileStore(tmp_path)
+    ref = store.add(prof.stats)
+    store.add(prof.stats)
+    assert store.load(ref).to_stats_dict() == prof.stats.to_stats_dict()
+
+
+def test_store_retention(tmp_path):
+    store = ProfileStore(tmp_path, max_bytes=None, segment_size=1)
+    with Profiler("retained") as prof:
+        work(100)
+    for _ in range(3):
+        store.add(prof.stats)
+    assert len(store.segments()) == 3
+
+    old = store.segments()[0]
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+    store.max_age = 3600
+    assert store.enforce_retention() == 1
+    assert old not in store.segments()
+
+    store.max_bytes = 1
+    assert store.enforce_retention() == 1
+    # the segment being written stays
+    assert len(store.segments()) == 1
+    assert len(store.query()) == 1
+
+
+def test_store_command_line(tmp_path, capsys):
+    with Profiler("cli") as prof:
+        work(100)
+    ProfileStore(tmp_path).add(prof.stats)
+
+    assert main(["query", str(tmp_path), "--label", "cli"]) == 0
+    assert " cli pid=" in capsys.readouterr().out
+    assert main(["query", str(tmp_path), "--top", "3"]) == 0
+    assert "1 profiles" in capsys.readouterr().out
+
+
+WRITER = """
+import sys
+from pyprofile import Profiler
+from pyprofile.store import ProfileStore
+
+store = ProfileStore(sys.argv[1], max_bytes=None)
+with Profiler("writer") as prof:
+    sum(range(100))
+for line in sys.stdin:
+    print(store.add(prof.stats).segment, flush=True)
+"""
+
+
+def test_store_retention_spares_live_writers(tmp_path):
+    writer = subprocess.Popen(
+        [sys.executable, "-c", WRITER, str(tmp_path)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+    )
+    try:
+        writer.stdin.write("\n")
+        writer.stdin.flush()
+        segment = writer.stdout.readline().strip()
+        with Profiler("reader") as prof:
+            work(100)
+        store = ProfileStore(tmp_path, max_bytes=1)
+        store.add(prof.stats)
+        assert store.enforce_retention() == 0
+        assert os.path.exists(segment)
+
+        # a writer whose segment went anyway starts a new one
+        os.remove(segment)
+        writer.stdin.write("\n")
+        writer.stdin.flush()
+        assert writer.stdout.readline().strip() != segment
+        assert [ref.label for ref in store.query(pid=writer.pid)] == ["writer"]
+    finally:
+        writer.stdin.close()
+        writer.wait(10)
+    assert store.enforce_retention() == 1
+    assert store.segments() == [store._segment_path]
+
+
+def test_store_truncates_labels_on_characters(tmp_path):
+    with Profiler("é" * 40000) as prof:
+        work(100)
+    store = ProfileStore(tmp_path)
+    store.add(prof.stats)
+    (ref,) = store.query()
+    assert ref.label == "é" * 32767